@@ -46,8 +46,12 @@ def create_app(config_name='default'):
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
 
-    # ProxyFix for Render.com (behind reverse proxy)
-    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
+    # ProxyFix for Render.com (behind reverse proxy): trust only the
+    # X-Forwarded-* values added by TRUSTED_PROXY_COUNT proxies, so
+    # request.remote_addr is the real client address
+    proxies = app.config.get('TRUSTED_PROXY_COUNT', 0)
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies, x_prefix=proxies)
 
     # Disable template caching for development
     app.config['TEMPLATES_AUTO_RELOAD'] = True
@@ -58,9 +62,17 @@ def create_app(config_name='default'):
     login_manager.init_app(app)
     migrate.init_app(app, db)
 
-    # Initialize Flask-Session (for Render deployment)
-    app.config['SESSION_SQLALCHEMY'] = db
-    sess.init_app(app)
+    # Server-side sessions shared by all workers (Flask-Session for other SESSION_TYPE values)
+    if app.config.get('SESSION_TYPE') == 'database':
+        from app.utils.session_helper import init_sessions
+        init_sessions(app)
+    else:
+        app.config['SESSION_SQLALCHEMY'] = db
+        sess.init_app(app)
+
+    # Rate limit counters (per process, or shared by the workers of a host)
+    from app.utils.rate_limit_helper import init_rate_limiter
+    init_rate_limiter(app)
 
     # Initialize Babel with absolute path
     app.config['BABEL_DEFAULT_LOCALE'] = 'ar'
@@ -114,6 +126,18 @@ def create_app(config_name='default'):
     from app.security import bp as security_bp
     app.register_blueprint(security_bp, url_prefix='/security')
 
+    # In-process product search index (synced on commit)
+    from app.utils.search_helper import init_product_search
+    init_product_search(app)
+
+    # Background job workers (started with the first request)
+    from app.utils.job_helper import init_jobs
+    init_jobs(app)
+
+    # Per-request query counts, N+1 warnings and the slow query log
+    from app.utils.query_stats_helper import init_query_stats
+    init_query_stats(app)
+
     # Add context processor for translations and currency
     @app.context_processor
     def inject_locale():
@@ -128,22 +152,12 @@ def create_app(config_name='default'):
     @app.context_processor
     def inject_currency():
         """Inject currency information into all templates"""
-        from app.models import Company
+        from app.utils.settings_helper import get_currency_info
         from flask_babel import gettext
 
-        try:
-            company = Company.query.first()
-            if company and company.currency:
-                currency_code = company.currency
-            else:
-                currency_code = app.config.get('DEFAULT_CURRENCY', 'SAR')
-        except:
-            # Fallback if database is not available
-            currency_code = 'SAR'
-
-        # Get currency info from config
-        currency_info = app.config['CURRENCIES'].get(currency_code, {})
-        currency_symbol = currency_info.get('symbol', 'ر.س')
+        currency = get_currency_info()
+        currency_code = currency['code']
+        currency_symbol = currency['symbol']
 
         # Translate currency name based on code
         currency_name_map = {
@@ -171,18 +185,9 @@ def create_app(config_name='default'):
     @app.template_filter('currency')
     def currency_filter(value):
         """Format number with currency symbol"""
-        from app.models import Company
+        from app.utils.settings_helper import get_currency_info
 
-        try:
-            company = Company.query.first()
-            if company and company.currency:
-                currency_code = company.currency
-                currency_info = app.config['CURRENCIES'].get(currency_code, {})
-                currency_symbol = currency_info.get('symbol', 'ر.س')
-            else:
-                currency_symbol = 'ر.س'
-        except:
-            currency_symbol = 'ر.س'
+        currency_symbol = get_currency_info()['symbol']
 
         try:
             return f"{float(value):.2f} {currency_symbol}"
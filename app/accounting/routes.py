@@ -5,8 +5,15 @@ from app.auth.decorators import permission_required
 from app.accounting import bp
 from app import db
 from app.models_accounting import Account, JournalEntry, JournalEntryItem, Payment, BankAccount, CostCenter
-from app.models import Customer, Supplier
-from app.utils.accounting_helper import create_payment_journal_entry
+from app.models import Customer, Supplier, Branch, Warehouse
+from app.utils.accounting_helper import create_payment_journal_entry, update_account_balances
+from app.utils.export_helper import get_export_format, iter_query, stream_export
+from app.utils.balance_helper import (AccountBalance, get_account_balances, get_monthly_account_totals,
+                                     get_opening_balance, statement_lines_query, get_account_statement)
+from app.utils.pagination_helper import keyset_paginate
+from app.utils.aging_helper import AGING_TYPES, BUCKET_KEYS, get_aging, get_aging_invoices
+from app.utils.cost_center_helper import get_cost_center_report
+from sqlalchemy import func
 from datetime import datetime, date
 
 # ==================== دليل الحسابات ====================
@@ -92,7 +99,7 @@ def account_details(id):
 @permission_required('accounting.transactions.view')
 def journal_entries():
     """List journal entries - قائمة القيود اليومية"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     status = request.args.get('status', 'all')
 
     query = JournalEntry.query
@@ -100,8 +107,8 @@ def journal_entries():
     if status != 'all':
         query = query.filter_by(status=status)
 
-    entries = query.order_by(JournalEntry.entry_date.desc(), JournalEntry.created_at.desc())\
-        .paginate(page=page, per_page=20, error_out=False)
+    entries = keyset_paginate(query, (JournalEntry.entry_date, JournalEntry.created_at, JournalEntry.id),
+                              cursor, per_page=20)
 
     return render_template('accounting/journal_entries.html',
                          entries=entries,
@@ -146,6 +153,7 @@ def add_journal_entry():
             descriptions = request.form.getlist('item_description[]')
             debits = request.form.getlist('debit[]')
             credits = request.form.getlist('credit[]')
+            cost_centers = request.form.getlist('cost_center_id[]')
 
             total_debit = 0
             total_credit = 0
@@ -158,6 +166,7 @@ def add_journal_entry():
                     item = JournalEntryItem(
                         journal_entry_id=entry.id,
                         account_id=int(accounts[i]),
+                        cost_center_id=int(cost_centers[i]) if i < len(cost_centers) and cost_centers[i] else None,
                         description=descriptions[i],
                         debit=debit,
                         credit=credit
@@ -184,10 +193,11 @@ def add_journal_entry():
             db.session.rollback()
             flash(f'حدث خطأ: {str(e)}', 'danger')
 
-    # Get accounts for dropdown
+    # Get accounts and cost centers for dropdowns
     accounts = Account.query.filter_by(is_active=True).order_by(Account.code).all()
+    cost_centers = CostCenter.query.filter_by(is_active=True).order_by(CostCenter.code).all()
 
-    return render_template('accounting/add_journal_entry.html', accounts=accounts)
+    return render_template('accounting/add_journal_entry.html', accounts=accounts, cost_centers=cost_centers)
 
 @bp.route('/journal-entries/<int:id>')
 @login_required
@@ -209,23 +219,14 @@ def post_journal_entry(id):
             flash('هذا القيد تم ترحيله مسبقاً', 'warning')
             return redirect(url_for('accounting.journal_entry_details', id=id))
 
-        # Update account balances
-        for item in entry.items:
-            account = Account.query.get(item.account_id)
-            account.debit_balance += item.debit
-            account.credit_balance += item.credit
-
-            # Calculate current balance based on account type
-            if account.account_type in ['asset', 'expense']:
-                account.current_balance = account.debit_balance - account.credit_balance
-            else:  # liability, equity, revenue
-                account.current_balance = account.credit_balance - account.debit_balance
-
         # Update entry status
         entry.status = 'posted'
         entry.posted_by = current_user.id
         entry.posted_at = datetime.utcnow()
 
+        # Update account balances and monthly snapshots
+        update_account_balances(entry)
+
         db.session.commit()
 
         flash('تم ترحيل القيد بنجاح', 'success')
@@ -445,6 +446,8 @@ def add_cost_center():
                 name=request.form.get('name'),
                 name_en=request.form.get('name_en'),
                 parent_id=request.form.get('parent_id', type=int) if request.form.get('parent_id') else None,
+                branch_id=request.form.get('branch_id', type=int) or None,
+                warehouse_id=request.form.get('warehouse_id', type=int) or None,
                 description=request.form.get('description'),
                 is_active=True
             )
@@ -461,8 +464,11 @@ def add_cost_center():
 
     # Get parent cost centers
     parent_centers = CostCenter.query.filter_by(is_active=True).order_by(CostCenter.code).all()
+    branches = Branch.query.filter_by(is_active=True).order_by(Branch.name).all()
+    warehouses = Warehouse.query.filter_by(is_active=True).order_by(Warehouse.name).all()
 
-    return render_template('accounting/add_cost_center.html', parent_centers=parent_centers)
+    return render_template('accounting/add_cost_center.html', parent_centers=parent_centers,
+                         branches=branches, warehouses=warehouses)
 
 # ==================== التقارير ====================
 
@@ -471,7 +477,20 @@ def add_cost_center():
 @permission_required('reports.financial')
 def trial_balance():
     """Trial balance report - ميزان المراجعة"""
-    accounts = Account.query.filter_by(is_active=True).order_by(Account.code).all()
+    # As of a date (all posted entries by default), optionally from a start date
+    as_of = _parse_date(request.args.get('as_of'))
+    start_date = _parse_date(request.args.get('start_date'))
+
+    # Accounts with a balance; the page and the export show the same rows
+    accounts = [acc for acc in get_account_balances(as_of=as_of, start_date=start_date)
+                if acc.debit_balance > 0 or acc.credit_balance > 0]
+
+    export_format = get_export_format()
+    if export_format:
+        rows = ((acc.code, acc.name, acc.debit_balance, acc.credit_balance) for acc in accounts)
+        return stream_export(export_format, 'trial_balance',
+                             [_('Account Code'), _('Account Name'), _('Debit'), _('Credit')],
+                             rows)
 
     total_debit = sum(acc.debit_balance for acc in accounts)
     total_credit = sum(acc.credit_balance for acc in accounts)
@@ -479,32 +498,60 @@ def trial_balance():
     return render_template('accounting/trial_balance.html',
                          accounts=accounts,
                          total_debit=total_debit,
-                         total_credit=total_credit)
+                         total_credit=total_credit,
+                         today=(as_of or date.today()).strftime('%Y-%m-%d'),
+                         as_of=request.args.get('as_of', ''),
+                         start_date=request.args.get('start_date', ''))
 
 @bp.route('/reports/balance-sheet')
 @login_required
 @permission_required('reports.financial')
 def balance_sheet():
     """Balance sheet report - الميزانية العمومية"""
-    # Assets
-    assets = Account.query.filter_by(account_type='asset', is_active=True).order_by(Account.code).all()
-    total_assets = sum(acc.current_balance for acc in assets)
-
-    # Liabilities
-    liabilities = Account.query.filter_by(account_type='liability', is_active=True).order_by(Account.code).all()
-    total_liabilities = sum(acc.current_balance for acc in liabilities)
-
-    # Equity
-    equity = Account.query.filter_by(account_type='equity', is_active=True).order_by(Account.code).all()
-    total_equity = sum(acc.current_balance for acc in equity)
+    as_of = _parse_date(request.args.get('as_of')) or date.today()
+    balances = get_account_balances(as_of=as_of)
+
+    # Assets and liabilities are split by code: 12xx+ fixed assets, 22xx+ long-term liabilities
+    assets = [acc for acc in balances if acc.account_type == 'asset']
+    current_assets = [acc for acc in assets if acc.code[:2] < '12']
+    fixed_assets = [acc for acc in assets if acc.code[:2] >= '12']
+    liabilities = [acc for acc in balances if acc.account_type == 'liability']
+    current_liabilities = [acc for acc in liabilities if acc.code[:2] < '22']
+    long_term_liabilities = [acc for acc in liabilities if acc.code[:2] >= '22']
+    equity_accounts = [acc for acc in balances if acc.account_type == 'equity']
+
+    # Profit not yet closed to equity keeps the statement balanced
+    net_income = sum(acc.current_balance for acc in balances if acc.account_type == 'revenue') - \
+        sum(acc.current_balance for acc in balances if acc.account_type == 'expense')
+    if net_income:
+        equity_accounts.append(AccountBalance(
+            None, '', 'صافي ربح الفترة', 'Net income', 'equity', None,
+            max(-net_income, 0), max(net_income, 0), net_income
+        ))
+
+    total_current_assets = sum(acc.current_balance for acc in current_assets)
+    total_fixed_assets = sum(acc.current_balance for acc in fixed_assets)
+    total_current_liabilities = sum(acc.current_balance for acc in current_liabilities)
+    total_long_term_liabilities = sum(acc.current_balance for acc in long_term_liabilities)
+    total_assets = total_current_assets + total_fixed_assets
+    total_liabilities = total_current_liabilities + total_long_term_liabilities
+    total_equity = sum(acc.current_balance for acc in equity_accounts)
 
     return render_template('accounting/balance_sheet.html',
-                         assets=assets,
-                         liabilities=liabilities,
-                         equity=equity,
-                         total_assets=total_assets,
+                         report_date=as_of.strftime('%Y-%m-%d'),
+                         current_assets=current_assets,
+                         fixed_assets=fixed_assets,
+                         current_liabilities=current_liabilities,
+                         long_term_liabilities=long_term_liabilities,
+                         equity_accounts=equity_accounts,
+                         total_current_assets=total_current_assets,
+                         total_fixed_assets=total_fixed_assets,
+                         total_current_liabilities=total_current_liabilities,
+                         total_long_term_liabilities=total_long_term_liabilities,
+                         total_assets=round(total_assets, 2),
                          total_liabilities=total_liabilities,
-                         total_equity=total_equity)
+                         total_equity=total_equity,
+                         total_liabilities_equity=round(total_liabilities + total_equity, 2))
 
 @bp.route('/reports/income-statement')
 @login_required
@@ -515,24 +562,19 @@ def income_statement():
     start_date = request.args.get('start_date', date.today().replace(day=1).strftime('%Y-%m-%d'))
     end_date = request.args.get('end_date', date.today().strftime('%Y-%m-%d'))
 
+    # Totals of the period from the monthly balance snapshots
+    balances = get_account_balances(as_of=_parse_date(end_date), start_date=_parse_date(start_date))
+
     # Revenue accounts
-    revenue_accounts = Account.query.filter_by(account_type='revenue', is_active=True).order_by(Account.code).all()
+    revenue_accounts = [acc for acc in balances if acc.account_type == 'revenue']
     total_revenue = sum(acc.credit_balance for acc in revenue_accounts)
 
-    # COGS accounts (تكلفة البضاعة المباعة)
-    cogs_accounts = Account.query.filter(
-        Account.account_type == 'expense',
-        Account.code.like('5%'),  # Assuming COGS accounts start with 5
-        Account.is_active == True
-    ).order_by(Account.code).all()
+    # COGS accounts (تكلفة البضاعة المباعة) - assuming COGS accounts start with 5
+    cogs_accounts = [acc for acc in balances if acc.account_type == 'expense' and acc.code.startswith('5')]
     total_cogs = sum(acc.debit_balance for acc in cogs_accounts)
 
     # Operating expense accounts
-    expense_accounts = Account.query.filter(
-        Account.account_type == 'expense',
-        ~Account.code.like('5%'),  # Exclude COGS
-        Account.is_active == True
-    ).order_by(Account.code).all()
+    expense_accounts = [acc for acc in balances if acc.account_type == 'expense' and not acc.code.startswith('5')]
     total_expenses = sum(acc.debit_balance for acc in expense_accounts)
 
     # Calculations
@@ -636,84 +678,112 @@ def account_statement():
                              selected_account_id=None)
 
     account = Account.query.get_or_404(account_id)
-
-    # Get entries for this account
-    entries = JournalEntryItem.query.join(JournalEntry).filter(
-        JournalEntryItem.account_id == account_id,
-        JournalEntry.status == 'posted'
-    ).order_by(JournalEntry.entry_date).all()
-
-    # Calculate balances
-    opening_balance = 0  # Should be calculated from previous period
-    total_debit = sum(entry.debit for entry in entries)
-    total_credit = sum(entry.credit for entry in entries)
-    closing_balance = opening_balance + total_debit - total_credit
+    period_start, period_end = _parse_date(start_date), _parse_date(end_date)
+
+    export_format = get_export_format()
+    if export_format:
+        opening_balance = get_opening_balance(account_id, period_start)
+        rows = statement_lines_query(account_id, period_start, period_end).with_entities(
+            JournalEntry.entry_date, JournalEntry.entry_number,
+            func.coalesce(func.nullif(JournalEntryItem.description, ''), JournalEntry.description),
+            JournalEntryItem.debit, JournalEntryItem.credit
+        ).order_by(JournalEntry.entry_date, JournalEntry.id, JournalEntryItem.id)
+        return stream_export(export_format, f'account_statement_{account.code}',
+                             [_('Date'), _('Entry Number'), _('Description'), _('Debit'), _('Credit'), _('Balance')],
+                             _with_running_balance(iter_query(rows), opening_balance, period_start))
+
+    # Opening balance, window totals and running balances are computed in SQL
+    statement = get_account_statement(account_id, period_start, period_end,
+                                      cursor=request.args.get('cursor'), per_page=50)
 
     return render_template('accounting/account_statement.html',
                          all_accounts=all_accounts,
                          account=account,
-                         entries=entries,
-                         opening_balance=opening_balance,
-                         total_debit=total_debit,
-                         total_credit=total_credit,
-                         closing_balance=closing_balance,
+                         entries=statement.lines,
+                         opening_balance=statement.opening_balance,
+                         total_debit=statement.total_debit,
+                         total_credit=statement.total_credit,
+                         closing_balance=statement.closing_balance,
                          start_date=start_date,
                          end_date=end_date,
                          selected_account_id=account_id)
 
+def _parse_date(value):
+    """'YYYY-MM-DD' query argument -> date (None when missing or invalid)"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+def _with_running_balance(rows, opening_balance=0, start_date=None):
+    """Opening balance row, then statement rows with the running balance (debit - credit) appended"""
+    balance = opening_balance
+    yield (start_date, '', _('Opening Balance'), None, None, balance)
+    for row in rows:
+        balance += (row[3] or 0) - (row[4] or 0)
+        yield (*row, balance)
+
 @bp.route('/reports/aging')
 @login_required
 @permission_required('reports.financial')
 def aging_report():
     """Aging report - تقرير الأعمار"""
     report_type = request.args.get('type', 'receivables')
-    report_date = date.today().strftime('%Y-%m-%d')
-
-    # Simplified aging data (should be calculated from actual invoices)
-    aging_data = []
-    totals = {
-        'total': 0,
-        'current': 0,
-        'days_31_60': 0,
-        'days_61_90': 0,
-        'days_91_120': 0,
-        'over_120': 0
-    }
+    if report_type not in AGING_TYPES:
+        report_type = 'receivables'
+    as_of = _parse_date(request.args.get('as_of')) or date.today()
 
-    if report_type == 'receivables':
-        # Get customers with outstanding balances
-        customers = Customer.query.all()
-        for customer in customers:
-            # This should be calculated from actual invoices
-            aging_data.append({
-                'name': customer.name,
-                'total': 0,
-                'current': 0,
-                'days_31_60': 0,
-                'days_61_90': 0,
-                'days_91_120': 0,
-                'over_120': 0
-            })
-    else:
-        # Get suppliers with outstanding balances
-        suppliers = Supplier.query.all()
-        for supplier in suppliers:
-            aging_data.append({
-                'name': supplier.name,
-                'total': 0,
-                'current': 0,
-                'days_31_60': 0,
-                'days_61_90': 0,
-                'days_91_120': 0,
-                'over_120': 0
-            })
+    # Open invoices bucketed by days past due in one grouped query
+    aging_data, totals = get_aging(report_type, as_of)
 
     return render_template('accounting/aging_report.html',
                          report_type=report_type,
-                         report_date=report_date,
+                         report_date=as_of.strftime('%Y-%m-%d'),
                          aging_data=aging_data,
                          totals=totals)
 
+@bp.route('/api/aging')
+@login_required
+@permission_required('reports.financial')
+def api_aging():
+    """
+    Aging as JSON (collection tooling)
+
+    Query args:
+        type: 'receivables' (default) or 'payables'
+        as_of: Report date (YYYY-MM-DD, today by default)
+        party_id: Customer/supplier id, to list its open invoices instead
+        limit: Maximum number of invoices with party_id
+    """
+    report_type = request.args.get('type', 'receivables')
+    if report_type not in AGING_TYPES:
+        return jsonify({'success': False, 'message': _('Invalid aging report type')}), 400
+    as_of = _parse_date(request.args.get('as_of')) or date.today()
+
+    party_id = request.args.get('party_id', type=int)
+    if party_id:
+        invoices = get_aging_invoices(report_type, party_id, as_of, limit=request.args.get('limit', type=int))
+        return jsonify({
+            'success': True,
+            'type': report_type,
+            'as_of': as_of.isoformat(),
+            'party_id': party_id,
+            'invoices': [dict(invoice._asdict(),
+                              invoice_date=invoice.invoice_date.isoformat(),
+                              due_date=invoice.due_date.isoformat())
+                         for invoice in invoices]
+        })
+
+    rows, totals = get_aging(report_type, as_of)
+    return jsonify({
+        'success': True,
+        'type': report_type,
+        'as_of': as_of.isoformat(),
+        'buckets': list(BUCKET_KEYS),
+        'totals': totals,
+        'parties': rows
+    })
+
 @bp.route('/reports/cost-center')
 @login_required
 @permission_required('reports.financial')
@@ -722,35 +792,18 @@ def cost_center_report():
     start_date = request.args.get('start_date', date.today().replace(day=1).strftime('%Y-%m-%d'))
     end_date = request.args.get('end_date', date.today().strftime('%Y-%m-%d'))
 
-    # Get all cost centers
-    centers = CostCenter.query.filter_by(is_active=True).order_by(CostCenter.code).all()
-
-    # Calculate revenue and expenses for each cost center
-    cost_centers = []
-    total_revenue = 0
-    total_expenses = 0
-    total_net_profit = 0
-
-    for center in centers:
-        # This should be calculated from actual transactions
-        revenue = 0
-        expenses = 0
-        net_profit = revenue - expenses
-
-        cost_centers.append({
-            'code': center.code,
-            'name': center.name,
-            'revenue': revenue,
-            'expenses': expenses,
-            'net_profit': net_profit
-        })
+    # Revenue and expenses per center, rolled up the tree in one query
+    cost_centers = get_cost_center_report(_parse_date(start_date), _parse_date(end_date))
 
-        total_revenue += revenue
-        total_expenses += expenses
-        total_net_profit += net_profit
+    # Top-level centers already include their children
+    top_centers = [center for center in cost_centers if center['depth'] == 0]
+    total_revenue = sum(center['revenue'] for center in top_centers)
+    total_expenses = sum(center['expenses'] for center in top_centers)
+    total_net_profit = total_revenue - total_expenses
 
     return render_template('accounting/cost_center_report.html',
                          cost_centers=cost_centers,
+                         top_centers=top_centers,
                          total_revenue=total_revenue,
                          total_expenses=total_expenses,
                          total_net_profit=total_net_profit,
@@ -763,9 +816,10 @@ def cost_center_report():
 def reports():
     """Reports main page - صفحة التقارير الرئيسية"""
     # Get summary data
-    total_assets = sum(acc.debit_balance for acc in Account.query.filter_by(account_type='asset', is_active=True).all())
-    total_revenue = sum(acc.credit_balance for acc in Account.query.filter_by(account_type='revenue', is_active=True).all())
-    total_expenses = sum(acc.debit_balance for acc in Account.query.filter_by(account_type='expense', is_active=True).all())
+    balances = get_account_balances()
+    total_assets = sum(acc.debit_balance for acc in balances if acc.account_type == 'asset')
+    total_revenue = sum(acc.credit_balance for acc in balances if acc.account_type == 'revenue')
+    total_expenses = sum(acc.debit_balance for acc in balances if acc.account_type == 'expense')
     net_profit = total_revenue - total_expenses
 
     return render_template('accounting/reports.html',
@@ -779,31 +833,28 @@ def reports():
 @permission_required('accounting.view')
 def dashboard():
     """Accounting dashboard - لوحة التحكم المحاسبية"""
-    # Summary data
-    total_assets = sum(acc.debit_balance for acc in Account.query.filter_by(account_type='asset', is_active=True).all())
-
-    # Monthly data (simplified - should be calculated from actual transactions)
-    monthly_revenue = 0
-    monthly_expenses = 0
+    # Summary data from the monthly balance snapshots
+    today = date.today()
+    balances = get_account_balances()
+    total_assets = sum(acc.debit_balance for acc in balances if acc.account_type == 'asset')
+
+    # This month's revenue and expenses
+    month_balances = get_account_balances(as_of=today, start_date=today.replace(day=1))
+    monthly_revenue = sum(acc.current_balance for acc in month_balances if acc.account_type == 'revenue')
+    monthly_expenses = sum(acc.current_balance for acc in month_balances if acc.account_type == 'expense')
     monthly_profit = monthly_revenue - monthly_expenses
 
     # Financial indicators
-    current_assets = sum(acc.debit_balance for acc in Account.query.filter(
-        Account.account_type == 'asset',
-        Account.code.like('1%'),
-        Account.is_active == True
-    ).all())
-
-    current_liabilities = sum(acc.credit_balance for acc in Account.query.filter(
-        Account.account_type == 'liability',
-        Account.code.like('2%'),
-        Account.is_active == True
-    ).all())
+    current_assets = sum(acc.debit_balance for acc in balances
+                         if acc.account_type == 'asset' and acc.code.startswith('1'))
+
+    current_liabilities = sum(acc.credit_balance for acc in balances
+                              if acc.account_type == 'liability' and acc.code.startswith('2'))
 
     current_ratio = current_assets / current_liabilities if current_liabilities > 0 else 0
     profit_margin = (monthly_profit / monthly_revenue * 100) if monthly_revenue > 0 else 0
 
-    total_liabilities = sum(acc.credit_balance for acc in Account.query.filter_by(account_type='liability', is_active=True).all())
+    total_liabilities = sum(acc.credit_balance for acc in balances if acc.account_type == 'liability')
     debt_ratio = (total_liabilities / total_assets * 100) if total_assets > 0 else 0
     roa = (monthly_profit / total_assets * 100) if total_assets > 0 else 0
 
@@ -819,10 +870,22 @@ def dashboard():
     overdue_payables_count = 0
     pending_entries_count = JournalEntry.query.filter_by(status='draft').count()
 
-    # Chart data (last 6 months)
-    chart_labels = []
+    # Chart data (last 6 months, one grouped snapshot query per account type)
+    month_starts = []
+    for i in range(5, -1, -1):
+        year, month = divmod(today.year * 12 + today.month - 1 - i, 12)
+        month_starts.append(date(year, month + 1, 1))
+    monthly_revenue_totals = get_monthly_account_totals(month_starts[0], account_type='revenue')
+    monthly_expense_totals = get_monthly_account_totals(month_starts[0], account_type='expense')
+
+    chart_labels = [month.strftime('%Y-%m') for month in month_starts]
     revenue_data = []
     expense_data = []
+    for month in month_starts:
+        debit, credit = monthly_revenue_totals.get((month.year, month.month), (0, 0))
+        revenue_data.append(round(credit - debit, 2))
+        debit, credit = monthly_expense_totals.get((month.year, month.month), (0, 0))
+        expense_data.append(round(debit - credit, 2))
 
     # Expense distribution
     expense_categories = []
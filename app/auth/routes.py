@@ -4,17 +4,14 @@ from flask_babel import gettext as _
 from app import db
 from app.auth import bp
 from app.models import User, SecurityLog, SessionLog
+from app.utils.security_helper import check_rate_limit
 from datetime import datetime
+import math
+import time
 import uuid
 
 def get_client_ip():
-    """Get client IP address"""
-    if request.headers.get('X-Forwarded-For'):
-        ip = request.headers.get('X-Forwarded-For')
-        # Ensure it's a string, not bytes
-        if isinstance(ip, bytes):
-            ip = ip.decode('utf-8', errors='ignore')
-        return ip.split(',')[0].strip()
+    """Get client IP address (resolved from trusted proxies by ProxyFix, see TRUSTED_PROXY_COUNT)"""
     return request.remote_addr or '0.0.0.0'
 
 def get_user_agent():
@@ -51,6 +48,19 @@ def login():
         password = request.form.get('password')
         remember = request.form.get('remember', False)
 
+        is_allowed, remaining, reset_time = check_rate_limit(
+            f'login:{request.remote_addr}', current_app.config.get('LOGIN_RATE_LIMIT', 10),
+            current_app.config.get('LOGIN_RATE_LIMIT_WINDOW', 60)
+        )
+        if not is_allowed:
+            log_security_event(None, 'login_rate_limited',
+                             f'Too many login attempts (username: {username})', 'warning')
+            retry_after = max(1, math.ceil(reset_time - time.time()))
+            flash(f'محاولات تسجيل دخول كثيرة. يرجى المحاولة بعد {retry_after} ثانية', 'danger')
+            response = make_response(render_template('auth/login.html'), 429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
         user = User.query.filter_by(username=username).first()
 
         if user is None or not user.check_password(password):
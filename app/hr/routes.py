@@ -6,7 +6,10 @@ from app.hr import bp
 from app import db
 from app.models import Employee, Department, Position, Attendance, Leave, LeaveType, Payroll, Branch
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, extract
+from app.utils.payroll_helper import payroll_exists, get_attendance_summary, EMPTY_ATTENDANCE
+from app.utils.job_helper import enqueue_job
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 # ==================== Dashboard ====================
 @bp.route('/')
@@ -637,47 +640,18 @@ def generate_payroll():
             year = int(request.form.get('year'))
 
             # Check if payroll already exists
-            existing = Payroll.query.filter_by(month=month, year=year).first()
-            if existing:
+            if payroll_exists(month, year):
                 flash('كشف الرواتب لهذا الشهر موجود بالفعل', 'warning')
                 return redirect(url_for('hr.payroll'))
 
-            # Get all active employees
-            employees = Employee.query.filter_by(is_active=True).all()
-
-            for employee in employees:
-                # Calculate overtime
-                overtime_hours = db.session.query(func.sum(Attendance.overtime_hours)).filter(
-                    Attendance.employee_id == employee.id,
-                    extract('month', Attendance.attendance_date) == month,
-                    extract('year', Attendance.attendance_date) == year
-                ).scalar() or 0
-
-                overtime_amount = overtime_hours * (employee.basic_salary / 240)  # Assuming 240 working hours per month
-
-                # Calculate net salary
-                basic_salary = employee.basic_salary
-                allowances = 0  # Can be customized
-                deductions = 0  # Can be customized
-                net_salary = basic_salary + allowances + overtime_amount - deductions
-
-                payroll = Payroll(
-                    employee_id=employee.id,
-                    month=month,
-                    year=year,
-                    basic_salary=basic_salary,
-                    allowances=allowances,
-                    deductions=deductions,
-                    overtime=overtime_amount,
-                    net_salary=net_salary,
-                    status='draft'
-                )
-
-                db.session.add(payroll)
-
-            db.session.commit()
-            flash(f'تم إنشاء كشف الرواتب لشهر {month}/{year} بنجاح', 'success')
-            return redirect(url_for('hr.payroll'))
+            # Generated by a background job; the page follows its progress
+            job = enqueue_job('hr.generate_payroll', {
+                'month': month,
+                'year': year,
+                'back_url': url_for('hr.payroll', month=month, year=year)
+            }, user_id=current_user.id, message=f'{month}/{year}')
+            flash(f'جاري إنشاء كشف الرواتب لشهر {month}/{year}', 'info')
+            return redirect(url_for('main.job_status', id=job.id))
         except Exception as e:
             db.session.rollback()
             flash(f'حدث خطأ: {str(e)}', 'danger')
@@ -748,31 +722,14 @@ def attendance_summary_report():
         year = today.year
 
     # Get all employees
-    employees = Employee.query.filter_by(is_active=True).all()
+    employees = Employee.query.options(joinedload(Employee.department)).filter_by(is_active=True).all()
 
-    # Get attendance for the month
+    # Attendance of the month, summed per employee in one query
+    summary = get_attendance_summary(month, year)
     attendance_data = []
     for employee in employees:
-        records = Attendance.query.filter(
-            Attendance.employee_id == employee.id,
-            extract('month', Attendance.attendance_date) == month,
-            extract('year', Attendance.attendance_date) == year
-        ).all()
-
-        present_days = len([r for r in records if r.status == 'present'])
-        absent_days = len([r for r in records if r.status == 'absent'])
-        late_days = len([r for r in records if r.status == 'late'])
-        total_hours = sum([r.working_hours for r in records])
-        overtime_hours = sum([r.overtime_hours for r in records])
-
-        attendance_data.append({
-            'employee': employee,
-            'present_days': present_days,
-            'absent_days': absent_days,
-            'late_days': late_days,
-            'total_hours': total_hours,
-            'overtime_hours': overtime_hours
-        })
+        attendance = summary.get(employee.id, EMPTY_ATTENDANCE)
+        attendance_data.append(dict(attendance._asdict(), employee=employee))
 
     return render_template('hr/attendance_summary_report.html',
                          attendance_data=attendance_data,
@@ -8,6 +8,17 @@ from app.models_sales import SalesInvoiceItem, QuotationItem
 from app.models_purchases import PurchaseInvoiceItem, PurchaseOrderItem, PurchaseReturnItem
 from app.models_pos import POSOrderItem
 from app.auth.decorators import permission_required, any_permission_required
+from app.utils.settings_helper import get_company
+from app.utils.catalogue_helper import CATALOGUE_SCOPES, get_catalogue_version, get_catalogue_snapshot
+from app.utils.search_helper import search_products, lookup_product, paginate_search_results
+from app.utils.pagination_helper import keyset_paginate
+from app.utils.stock_helper import get_stock_map
+from app.utils.import_helper import IMPORT_COLUMNS, get_import_format, save_import_file
+from app.utils.job_helper import enqueue_job
+from app.utils.stock_mutation_helper import StockChange, InsufficientStock, change_stock, stock_transaction
+from app.utils.stock_ledger_helper import delete_product_snapshot_lines
+from app.utils.export_helper import get_export_format, stream_export
+from sqlalchemy.orm import contains_eager
 from datetime import datetime
 import os
 from werkzeug.utils import secure_filename
@@ -48,34 +59,34 @@ def products():
     search = request.args.get('search', '')
     category_id = request.args.get('category', type=int)
 
-    query = Product.query
-
     if search:
-        query = query.filter(
-            (Product.name.contains(search)) |
-            (Product.code.contains(search)) |
-            (Product.barcode.contains(search))
+        # Ranked matches from the search index (code/barcode, name prefix, substring)
+        results = search_products(search, limit=None, category_id=category_id, include_inactive=True)
+        products = paginate_search_results(results, page=page, per_page=20)
+    else:
+        query = Product.query
+        if category_id:
+            query = query.filter_by(category_id=category_id)
+
+        products = query.order_by(Product.created_at.desc()).paginate(
+            page=page, per_page=20, error_out=False
         )
 
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-
-    products = query.order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
-
     categories = Category.query.filter_by(is_active=True).all()
 
+    # Stock of the page's products in one grouped query
+    stock_map = get_stock_map([product.id for product in products.items])
+
     # Get company settings for currency
-    from app.models import Company
     from flask import current_app
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
     currency_name = current_app.config['CURRENCIES'].get(currency_code, {}).get('name', 'ريال سعودي')
 
     return render_template('inventory/products.html',
                          products=products,
+                         stock_map=stock_map,
                          categories=categories,
                          search=search,
                          category_id=category_id,
@@ -205,34 +216,19 @@ def add_product():
             db.session.flush()  # Get product ID before adding stock
 
             # Add initial stock for each warehouse
-            stock_added = False
+            opening_stock = []
             for key in request.form.keys():
                 if key.startswith('warehouse_'):
                     warehouse_id = int(key.split('_')[1])
                     quantity = request.form.get(key, 0, type=float)
 
                     if quantity > 0:
-                        stock = Stock(
-                            product_id=product.id,
-                            warehouse_id=warehouse_id,
-                            quantity=quantity,
-                            available_quantity=quantity
-                        )
-                        db.session.add(stock)
-
-                        # Create stock movement record
-                        movement = StockMovement(
-                            product_id=product.id,
-                            warehouse_id=warehouse_id,
-                            movement_type='in',
-                            quantity=quantity,
-                            reference_type='initial_stock',
-                            reference_id=product.id,
-                            notes='رصيد افتتاحي عند إضافة المنتج',
-                            user_id=current_user.id
-                        )
-                        db.session.add(movement)
-                        stock_added = True
+                        opening_stock.append(StockChange(product.id, warehouse_id, quantity))
+
+            # Stock rows and their movement records
+            change_stock(opening_stock, reference_type='initial_stock', reference_id=product.id,
+                         user_id=current_user.id, notes='رصيد افتتاحي عند إضافة المنتج')
+            stock_added = bool(opening_stock)
 
             db.session.commit()
 
@@ -256,6 +252,41 @@ def add_product():
                          units=units,
                          warehouses=warehouses)
 
+@bp.route('/products/import', methods=['GET', 'POST'])
+@login_required
+@permission_required('inventory.products.create')
+def import_products():
+    """Bulk product import from a CSV or Excel file"""
+    warehouses = Warehouse.query.filter_by(is_active=True).all()
+
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        import_format = get_import_format(upload.filename if upload else None)
+        if import_format is None:
+            flash(_('Please choose a CSV or Excel (.xlsx) file'), 'error')
+        else:
+            # Imported by a background job; the page follows its progress
+            job = enqueue_job('inventory.import_products', {
+                'path': save_import_file(upload, import_format),
+                'format': import_format,
+                'warehouse_id': request.form.get('warehouse_id', type=int),
+                'user_id': current_user.id,
+                'update_existing': request.form.get('update_existing') == 'on',
+                'back_url': url_for('inventory.products')
+            }, user_id=current_user.id, message=upload.filename)
+            flash(_('The import has started; you can follow it on this page'), 'info')
+            return redirect(url_for('main.job_status', id=job.id))
+
+    return render_template('inventory/import_products.html', warehouses=warehouses)
+
+@bp.route('/products/import/template')
+@login_required
+@permission_required('inventory.products.create')
+def import_products_template():
+    """Empty import file with the expected columns"""
+    headers = [names[0] for names in IMPORT_COLUMNS.values()]
+    return stream_export(get_export_format() or 'csv', 'products_import_template', headers, [])
+
 @bp.route('/products/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 @permission_required('inventory.products.edit')
@@ -381,6 +412,7 @@ def delete_product(id):
         POSOrderItem.query.filter_by(product_id=id).delete()
         Stock.query.filter_by(product_id=id).delete()
         StockMovement.query.filter_by(product_id=id).delete()
+        delete_product_snapshot_lines(id)
 
         # Delete the product
         product_name = product.name
@@ -467,17 +499,17 @@ def delete_category(id):
 @permission_required('inventory.stock.view')
 def stock():
     """View stock levels"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     warehouse_id = request.args.get('warehouse', type=int)
     
-    query = Stock.query.join(Product).join(Warehouse)
+    query = Stock.query.join(Product).join(Warehouse).options(
+        contains_eager(Stock.product), contains_eager(Stock.warehouse)
+    )
     
     if warehouse_id:
         query = query.filter(Stock.warehouse_id == warehouse_id)
     
-    stocks = query.order_by(Product.name).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    stocks = keyset_paginate(query, (Product.name, Stock.id), cursor, per_page=20, descending=False)
     
     warehouses = Warehouse.query.filter_by(is_active=True).all()
     
@@ -579,7 +611,9 @@ def warehouse_details(id):
     warehouse = Warehouse.query.get_or_404(id)
 
     # Get stock in this warehouse
-    stocks = Stock.query.filter_by(warehouse_id=id).join(Product).order_by(Product.name).all()
+    stocks = Stock.query.filter_by(warehouse_id=id).join(Product).options(
+        contains_eager(Stock.product)
+    ).order_by(Product.name).all()
 
     # Calculate statistics
     total_products = len(stocks)
@@ -593,6 +627,18 @@ def warehouse_details(id):
                          total_value=total_value,
                          low_stock_count=low_stock_count)
 
+@stock_transaction
+def _transfer_stock(product_id, from_warehouse_id, to_warehouse_id, quantity, notes, user_id):
+    """Move stock between warehouses; committed and retried by @stock_transaction"""
+    names = dict(db.session.query(Warehouse.id, Warehouse.name).filter(
+        Warehouse.id.in_((from_warehouse_id, to_warehouse_id))))
+    change_stock([
+        StockChange(product_id, from_warehouse_id, -quantity,
+                    notes=f'نقل إلى مستودع {names.get(to_warehouse_id)}. {notes or ""}'),
+        StockChange(product_id, to_warehouse_id, quantity,
+                    notes=f'نقل من مستودع {names.get(from_warehouse_id)}. {notes or ""}')
+    ], reference_type='transfer', user_id=user_id)
+
 @bp.route('/transfer', methods=['GET', 'POST'])
 @login_required
 @permission_required('inventory.stock.transfer')
@@ -611,66 +657,15 @@ def stock_transfer():
                 flash(_('Cannot transfer to the same warehouse'), 'danger')
                 return redirect(url_for('inventory.stock_transfer'))
 
-            # Get source stock
-            from_stock = Stock.query.filter_by(
-                product_id=product_id,
-                warehouse_id=from_warehouse_id
-            ).first()
-
-            if not from_stock or from_stock.available_quantity < quantity:
-                flash(_('Insufficient quantity available'), 'danger')
-                return redirect(url_for('inventory.stock_transfer'))
-
-            # Get or create destination stock
-            to_stock = Stock.query.filter_by(
-                product_id=product_id,
-                warehouse_id=to_warehouse_id
-            ).first()
-
-            if not to_stock:
-                to_stock = Stock(
-                    product_id=product_id,
-                    warehouse_id=to_warehouse_id,
-                    quantity=0,
-                    reserved_quantity=0,
-                    available_quantity=0
-                )
-                db.session.add(to_stock)
-
-            # Update stocks
-            from_stock.quantity -= quantity
-            from_stock.available_quantity -= quantity
-            to_stock.quantity += quantity
-            to_stock.available_quantity += quantity
-
-            # Create stock movements
-            out_movement = StockMovement(
-                product_id=product_id,
-                warehouse_id=from_warehouse_id,
-                movement_type='out',
-                quantity=quantity,
-                reference_type='transfer',
-                notes=f'نقل إلى مستودع {to_stock.warehouse.name}. {notes or ""}',
-                created_by=current_user.id
-            )
-
-            in_movement = StockMovement(
-                product_id=product_id,
-                warehouse_id=to_warehouse_id,
-                movement_type='in',
-                quantity=quantity,
-                reference_type='transfer',
-                notes=f'نقل من مستودع {from_stock.warehouse.name}. {notes or ""}',
-                created_by=current_user.id
-            )
-
-            db.session.add(out_movement)
-            db.session.add(in_movement)
-            db.session.commit()
+            _transfer_stock(int(product_id), int(from_warehouse_id), int(to_warehouse_id), quantity, notes,
+                            current_user.id)
 
             flash(_('Stock transferred successfully'), 'success')
             return redirect(url_for('inventory.stock_transfer'))
 
+        except InsufficientStock:
+            flash(_('Insufficient quantity available'), 'danger')
+            return redirect(url_for('inventory.stock_transfer'))
         except Exception as e:
             db.session.rollback()
             flash(_('An error occurred: %(error)s', error=str(e)), 'danger')
@@ -728,22 +723,93 @@ def api_product_stock(product_id):
 
     return jsonify(stock_data)
 
+def _search_result(entry, scope):
+    """JSON representation of a search index entry"""
+    price = entry.cost_price if scope == 'purchases' else entry.selling_price
+    return {
+        'id': entry.id,
+        'code': entry.code,
+        'barcode': entry.barcode or '',
+        'name': entry.name,
+        'name_en': entry.name_en or '',
+        'price': float(price or 0),
+        'tax': float(entry.tax_rate if entry.tax_rate is not None else 15)
+    }
+
+@bp.route('/api/products/search')
+@login_required
+@any_permission_required('pos.access', 'sales.create', 'purchases.create', 'inventory.products.view')
+def api_product_search():
+    """Product typeahead: ?q=<name, code or barcode>&limit=10&scope=sales|purchases"""
+    scope = request.args.get('scope')
+    if scope is not None and scope not in CATALOGUE_SCOPES:
+        return jsonify({'success': False, 'message': _('Invalid catalogue scope')}), 400
+
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    results = search_products(request.args.get('q', ''), limit=limit, scope=scope,
+                              category_id=request.args.get('category', type=int))
+    return jsonify({'success': True, 'results': [_search_result(entry, scope) for entry in results]})
+
+@bp.route('/api/products/lookup')
+@login_required
+@any_permission_required('pos.access', 'sales.create', 'purchases.create', 'inventory.products.view')
+def api_product_lookup():
+    """Exact product lookup by code or barcode (barcode scanners): ?code=<value>"""
+    scope = request.args.get('scope')
+    entry = lookup_product(request.args.get('code', ''))
+    if entry is not None and ((scope == 'sales' and not entry.is_sellable) or
+                              (scope == 'purchases' and not entry.is_purchasable)):
+        entry = None
+    if entry is None:
+        return jsonify({'success': False, 'message': _('Product not found')}), 404
+    return jsonify({'success': True, 'product': _search_result(entry, scope)})
+
+@bp.route('/api/catalogue')
+@login_required
+@any_permission_required('pos.access', 'sales.create', 'purchases.create', 'inventory.products.view')
+def api_catalogue():
+    """
+    Compact product catalogue snapshot (columnar JSON)
+
+    Query args:
+        scope: 'sales' (default) or 'purchases'
+        since: Version held by the client, to receive only the changes
+    Honours If-None-Match with 304 Not Modified while the version is unchanged.
+    """
+    scope = request.args.get('scope', 'sales')
+    if scope not in CATALOGUE_SCOPES:
+        return jsonify({'success': False, 'message': _('Invalid catalogue scope')}), 400
+
+    version = get_catalogue_version(scope)
+    etag = f'{scope}-{version}'
+
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(get_catalogue_snapshot(scope, request.args.get('since'), version))
+
+    response.set_etag(etag, weak=True)
+    # Browsers keep the copy but revalidate it on every use
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @bp.route('/damaged-inventory')
 @login_required
 @permission_required('inventory.stock.view')
 def damaged_inventory():
     """View damaged inventory"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     warehouse_id = request.args.get('warehouse', type=int)
 
-    query = DamagedInventory.query.join(Product).join(Warehouse)
+    query = DamagedInventory.query.join(Product).join(Warehouse).options(
+        contains_eager(DamagedInventory.product), contains_eager(DamagedInventory.warehouse)
+    )
 
     if warehouse_id:
         query = query.filter(DamagedInventory.warehouse_id == warehouse_id)
 
-    damaged_items = query.order_by(DamagedInventory.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    damaged_items = keyset_paginate(query, (DamagedInventory.created_at, DamagedInventory.id), cursor, per_page=20)
 
     warehouses = Warehouse.query.filter_by(is_active=True).all()
 
@@ -756,6 +822,43 @@ def damaged_inventory():
                          warehouse_id=warehouse_id,
                          total_damaged_value=total_damaged_value)
 
+@stock_transaction
+def _record_damaged_inventory(product_id, warehouse_id, quantity, reason, damage_type, notes, user_id):
+    """Move stock to damaged and record it; committed and retried by @stock_transaction"""
+    product = db.session.get(Product, product_id)
+
+    # Create damaged inventory record
+    damaged = DamagedInventory(
+        product_id=product_id,
+        warehouse_id=warehouse_id,
+        quantity=quantity,
+        reason=reason,
+        damage_type=damage_type,
+        cost_value=quantity * product.cost_price,
+        notes=notes,
+        user_id=user_id
+    )
+    db.session.add(damaged)
+    db.session.flush()  # Get the ID without committing
+
+    # Update stock
+    change_stock([StockChange(product_id, warehouse_id, -quantity, movement_type='damaged', damaged=quantity)],
+                 reference_type='damaged', reference_id=damaged.id, user_id=user_id,
+                 notes=f'{_("Damaged inventory")}: {reason}')
+
+@stock_transaction
+def _delete_damaged_inventory(id, user_id):
+    """Return damaged stock and delete its record; committed and retried by @stock_transaction"""
+    damaged = db.session.get(DamagedInventory, id)
+
+    # Restore stock
+    change_stock([StockChange(damaged.product_id, damaged.warehouse_id, damaged.quantity,
+                              movement_type='damaged', damaged=-damaged.quantity)],
+                 reference_type='damaged_delete', reference_id=damaged.id, user_id=user_id)
+
+    # Delete damaged record
+    db.session.delete(damaged)
+
 @bp.route('/damaged-inventory/add', methods=['GET', 'POST'])
 @login_required
 @permission_required('inventory.stock.edit')
@@ -770,57 +873,15 @@ def add_damaged_inventory():
             damage_type = request.form.get('damage_type')
             notes = request.form.get('notes')
 
-            # Get product and stock
-            product = Product.query.get_or_404(product_id)
-            stock = Stock.query.filter_by(
-                product_id=product_id,
-                warehouse_id=warehouse_id
-            ).first()
-
-            if not stock or stock.quantity < quantity:
-                flash(_('Insufficient quantity in stock'), 'error')
-                return redirect(url_for('inventory.add_damaged_inventory'))
-
-            # Calculate cost value
-            cost_value = quantity * product.cost_price
-
-            # Create damaged inventory record
-            damaged = DamagedInventory(
-                product_id=product_id,
-                warehouse_id=warehouse_id,
-                quantity=quantity,
-                reason=reason,
-                damage_type=damage_type,
-                cost_value=cost_value,
-                notes=notes,
-                user_id=current_user.id
-            )
-            db.session.add(damaged)
-            db.session.flush()  # Get the ID without committing
-
-            # Update stock
-            stock.quantity -= quantity
-            stock.damaged_quantity = (stock.damaged_quantity or 0) + quantity
-            stock.available_quantity = stock.quantity - stock.reserved_quantity - stock.damaged_quantity
-
-            # Create stock movement
-            movement = StockMovement(
-                product_id=product_id,
-                warehouse_id=warehouse_id,
-                movement_type='damaged',
-                quantity=-quantity,  # Negative for outgoing
-                reference_type='damaged',
-                reference_id=damaged.id,
-                notes=f'{_("Damaged inventory")}: {reason}',
-                user_id=current_user.id
-            )
-            db.session.add(movement)
-
-            db.session.commit()
+            _record_damaged_inventory(product_id, warehouse_id, quantity, reason, damage_type, notes,
+                                      current_user.id)
 
             flash(_('Damaged inventory recorded successfully'), 'success')
             return redirect(url_for('inventory.damaged_inventory'))
 
+        except InsufficientStock:
+            flash(_('Insufficient quantity in stock'), 'error')
+            return redirect(url_for('inventory.add_damaged_inventory'))
         except Exception as e:
             db.session.rollback()
             flash(_('An error occurred: %(error)s', error=str(e)), 'error')
@@ -840,21 +901,7 @@ def delete_damaged_inventory(id):
     damaged = DamagedInventory.query.get_or_404(id)
 
     try:
-        # Get stock
-        stock = Stock.query.filter_by(
-            product_id=damaged.product_id,
-            warehouse_id=damaged.warehouse_id
-        ).first()
-
-        if stock:
-            # Restore stock
-            stock.quantity += damaged.quantity
-            stock.damaged_quantity = max(0, (stock.damaged_quantity or 0) - damaged.quantity)
-            stock.available_quantity = stock.quantity - stock.reserved_quantity - stock.damaged_quantity
-
-        # Delete damaged record
-        db.session.delete(damaged)
-        db.session.commit()
+        _delete_damaged_inventory(id, current_user.id)
 
         flash(_('Damaged inventory record deleted successfully'), 'success')
     except Exception as e:
@@ -1,12 +1,12 @@
-from flask import render_template, redirect, url_for, flash, request, make_response, after_this_request
+from flask import render_template, redirect, url_for, flash, request, make_response, after_this_request, jsonify, abort
 from flask_login import login_required, current_user
 from app.auth.decorators import permission_required
 from app.main import bp
-from app import db
 from app.models import *
-from sqlalchemy import func
-from datetime import datetime, timedelta
-import calendar
+from app.utils.stock_helper import get_stock_overview
+from app.utils.rollup_helper import get_rollup_totals, get_monthly_rollup, get_top_products
+from app.utils.job_helper import get_user_jobs, can_view_job
+from datetime import datetime, date
 import json
 from pathlib import Path
 
@@ -35,12 +35,9 @@ def index():
         'total_warehouses': Warehouse.query.filter_by(is_active=True).count(),
     }
 
-    # Calculate low stock products
-    products = Product.query.filter_by(is_active=True, track_inventory=True).all()
-    for product in products:
-        current_stock = product.get_stock()
-        if product.min_stock and current_stock <= product.min_stock:
-            stats['low_stock_products'] += 1
+    # Calculate low stock products and inventory value in one grouped query
+    stock_overview = get_stock_overview()
+    stats['low_stock_products'] = stock_overview['low_stock_products']
 
     # Get recent sales
     recent_sales = SalesInvoice.query.order_by(SalesInvoice.created_at.desc()).limit(5).all()
@@ -48,30 +45,15 @@ def index():
     # Get recent purchases
     recent_purchases = PurchaseInvoice.query.order_by(PurchaseInvoice.created_at.desc()).limit(5).all()
 
-    # Sales this month
-    today = datetime.utcnow()
+    # Sales, purchases and cost of goods sold this month from the daily rollup
+    today = datetime.utcnow().date()
     first_day = today.replace(day=1)
-    sales_this_month = db.session.query(func.sum(SalesInvoice.total_amount)).filter(
-        SalesInvoice.invoice_date >= first_day,
-        SalesInvoice.status != 'cancelled'
-    ).scalar() or 0
-
-    # Purchases this month
-    purchases_this_month = db.session.query(func.sum(PurchaseInvoice.total_amount)).filter(
-        PurchaseInvoice.invoice_date >= first_day,
-        PurchaseInvoice.status != 'cancelled'
-    ).scalar() or 0
-
-    # Calculate COGS (Cost of Goods Sold) this month
-    sales_invoices = SalesInvoice.query.filter(
-        SalesInvoice.invoice_date >= first_day,
-        SalesInvoice.status != 'cancelled'
-    ).all()
-
-    cogs_this_month = 0
-    for invoice in sales_invoices:
-        for item in invoice.items:
-            cogs_this_month += item.product.cost_price * item.quantity
+    sales_totals = get_rollup_totals('sales', first_day, None)
+    purchases_totals = get_rollup_totals('purchases', first_day, None)
+
+    sales_this_month = sales_totals['total_amount']
+    purchases_this_month = purchases_totals['total_amount']
+    cogs_this_month = sales_totals['cost_amount']
 
     # Calculate profit this month (Sales - COGS)
     profit_this_month = sales_this_month - cogs_this_month
@@ -80,57 +62,33 @@ def index():
     stats['purchases_this_month'] = purchases_this_month
     stats['profit_this_month'] = profit_this_month
 
-    # Get sales data for last 6 months
+    # Get sales data for last 6 months (one grouped query per kind)
+    month_starts = []
+    for i in range(5, -1, -1):
+        year, month = divmod(today.year * 12 + today.month - 1 - i, 12)
+        month_starts.append(date(year, month + 1, 1))
+
+    monthly_sales = get_monthly_rollup('sales', month_starts[0], None)
+    monthly_purchases = get_monthly_rollup('purchases', month_starts[0], None)
+
+    # Arabic month names
+    arabic_months = ['يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو',
+                    'يوليو', 'أغسطس', 'سبتمبر', 'أكتوبر', 'نوفمبر', 'ديسمبر']
+
     sales_chart_data = []
     purchases_chart_data = []
     chart_labels = []
-
-    for i in range(5, -1, -1):
-        month_date = today - timedelta(days=30*i)
-        month_start = month_date.replace(day=1)
-
-        # Get last day of month
-        last_day = calendar.monthrange(month_start.year, month_start.month)[1]
-        month_end = month_start.replace(day=last_day)
-
-        # Sales for this month
-        month_sales = db.session.query(func.sum(SalesInvoice.total_amount)).filter(
-            SalesInvoice.invoice_date >= month_start,
-            SalesInvoice.invoice_date <= month_end,
-            SalesInvoice.status != 'cancelled'
-        ).scalar() or 0
-
-        # Purchases for this month
-        month_purchases = db.session.query(func.sum(PurchaseInvoice.total_amount)).filter(
-            PurchaseInvoice.invoice_date >= month_start,
-            PurchaseInvoice.invoice_date <= month_end,
-            PurchaseInvoice.status != 'cancelled'
-        ).scalar() or 0
-
-        sales_chart_data.append(float(month_sales))
-        purchases_chart_data.append(float(month_purchases))
-
-        # Arabic month names
-        arabic_months = ['يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو',
-                        'يوليو', 'أغسطس', 'سبتمبر', 'أكتوبر', 'نوفمبر', 'ديسمبر']
+    for month_start in month_starts:
+        key = (month_start.year, month_start.month)
+        sales_chart_data.append(float(monthly_sales.get(key, {}).get('total_amount') or 0))
+        purchases_chart_data.append(float(monthly_purchases.get(key, {}).get('total_amount') or 0))
         chart_labels.append(arabic_months[month_start.month - 1])
 
     # Get top selling products
-    top_products = db.session.query(
-        Product.name,
-        func.sum(SalesInvoiceItem.quantity).label('total_qty')
-    ).join(SalesInvoiceItem).join(SalesInvoice).filter(
-        SalesInvoice.status != 'cancelled',
-        SalesInvoice.invoice_date >= first_day
-    ).group_by(Product.id).order_by(func.sum(SalesInvoiceItem.quantity).desc()).limit(5).all()
-
-    # Calculate inventory value
-    inventory_value = 0
-    for product in products:
-        stock_qty = product.get_stock()
-        inventory_value += stock_qty * product.cost_price
-
-    stats['inventory_value'] = inventory_value
+    top_products = [(name, total_qty) for name, total_qty, _net_amount
+                    in get_top_products('sales', first_day, None, limit=5)]
+
+    stats['inventory_value'] = stock_overview['inventory_value']
 
     return render_template('main/index.html',
                          stats=stats,
@@ -145,5 +103,30 @@ def index():
 def about():
     return render_template('main/about.html')
 
+@bp.route('/jobs')
+@login_required
+def jobs():
+    """Background jobs of the current user (all jobs for admins)"""
+    return render_template('main/jobs.html', jobs=get_user_jobs(current_user))
+
+@bp.route('/jobs/<int:id>')
+@login_required
+def job_status(id):
+    """Progress and result of a background job"""
+    job = BackgroundJob.query.get_or_404(id)
+    if not can_view_job(current_user, job):
+        abort(403)
+    return render_template('main/job_status.html', job=job,
+                           back_url=job.payload_data.get('back_url') or url_for('main.jobs'))
+
+@bp.route('/api/jobs/<int:id>')
+@login_required
+def api_job_status(id):
+    """Background job status for polling"""
+    job = BackgroundJob.query.get_or_404(id)
+    if not can_view_job(current_user, job):
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(job.to_dict())
+
 
 
@@ -1,3 +1,4 @@
+import time
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
@@ -39,30 +40,32 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def get_permissions(self):
+        """Names of the role's permissions, compiled once per process and role version"""
+        if not self.role:
+            return frozenset()
+        from app.utils.permission_helper import get_role_permissions
+        return get_role_permissions(self.role.id, self.role.permissions_version)
+
     def has_permission(self, permission_name):
         """Check if user has a specific permission"""
         if self.is_admin:
             return True
-        if not self.role:
-            return False
-        try:
-            return any(p.name == permission_name for p in self.role.permissions)
-        except Exception as e:
-            # Log the error and return False
-            print(f"Error checking permission: {e}")
-            return False
+        return permission_name in self.get_permissions()
 
     def has_any_permission(self, *permission_names):
         """Check if user has any of the specified permissions"""
         if self.is_admin:
             return True
-        return any(self.has_permission(p) for p in permission_names)
+        permissions = self.get_permissions()
+        return any(p in permissions for p in permission_names)
 
     def has_all_permissions(self, *permission_names):
         """Check if user has all of the specified permissions"""
         if self.is_admin:
             return True
-        return all(self.has_permission(p) for p in permission_names)
+        permissions = self.get_permissions()
+        return all(p in permissions for p in permission_names)
 
     def is_account_locked(self):
         """Check if account is currently locked"""
@@ -104,6 +107,11 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+def _new_permissions_version():
+    # Starts from the clock so a role created with the id of a deleted one
+    # never matches that role's cached permissions
+    return int(time.time())
+
 class Role(db.Model):
     __tablename__ = 'roles'
 
@@ -112,7 +120,9 @@ class Role(db.Model):
     name_ar = db.Column(db.String(64))
     description = db.Column(db.String(256))
     description_en = db.Column(db.String(256))
-    permissions = db.relationship('Permission', secondary='role_permissions', backref='roles', lazy='joined')
+    permissions = db.relationship('Permission', secondary='role_permissions', backref='roles')
+    # Bumped whenever the role's permissions change (see app/utils/permission_helper.py)
+    permissions_version = db.Column(db.Integer, nullable=False, default=_new_permissions_version, server_default='1')
 
     def __repr__(self):
         return f'<Role {self.name}>'
@@ -152,6 +162,13 @@ class SecurityLog(db.Model):
     # Relationships
     user = db.relationship('User', backref='security_logs')
 
+    # Sort key of the keyset-paginated list view
+    __table_args__ = (
+        db.Index('ix_security_logs_created_at_id', 'created_at', 'id'),
+        # Recent events of a type (failed logins on the security dashboard)
+        db.Index('ix_security_logs_event_type_created_at', 'event_type', 'created_at'),
+    )
+
     def __repr__(self):
         return f'<SecurityLog {self.event_type} - {self.created_at}>'
 
@@ -189,6 +206,18 @@ class SessionLog(db.Model):
     def __repr__(self):
         return f'<SessionLog {self.user_id} - {self.session_id}>'
 
+class ServerSession(db.Model):
+    """Server-side session data (see app/utils/session_helper.py)"""
+    __tablename__ = 'server_sessions'
+
+    id = db.Column(db.String(64), primary_key=True)  # SHA-256 of the session id in the cookie
+    data = db.Column(db.Text, nullable=False)  # Tagged JSON of the session dict
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ServerSession {self.id[:8]} {self.expires_at}>'
+
 # Company and Branch Models
 class Company(db.Model):
     __tablename__ = 'companies'
@@ -209,6 +238,7 @@ class Company(db.Model):
     tax_rate = db.Column(db.Float, default=18.0)
     invoice_template = db.Column(db.String(50), default='modern')  # modern, classic, minimal, elegant
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Checked by the settings cache
 
     def __repr__(self):
         return f'<Company {self.name}>'
@@ -236,15 +266,18 @@ class Branch(db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # One row of users joined to roles; permissions come from the per-role cache
+    return db.session.get(User, int(user_id))
 
 # Import all models
-from app.models_inventory import Category, Unit, Product, Warehouse, Stock, StockMovement, DamagedInventory
+from app.models_inventory import Category, Unit, Product, Warehouse, Stock, StockMovement, DamagedInventory, StockSnapshot, StockSnapshotLine
 from app.models_sales import Customer, SalesInvoice, SalesInvoiceItem, Quotation, QuotationItem, SalesOrder
 from app.models_purchases import Supplier, PurchaseOrder, PurchaseOrderItem, PurchaseInvoice, PurchaseInvoiceItem, PurchaseReturn, PurchaseReturnItem
-from app.models_accounting import Account, JournalEntry, JournalEntryItem, Payment, BankAccount, CostCenter
+from app.models_accounting import Account, JournalEntry, JournalEntryItem, AccountPeriodBalance, Payment, BankAccount, CostCenter
 from app.models_hr import Employee, Department, Position, Attendance, Leave, LeaveType, Payroll
 from app.models_pos import POSSession, POSOrder, POSOrderItem
-from app.models_settings import SystemSettings, AccountingSettings
+from app.models_settings import SystemSettings, AccountingSettings, DocumentSequence
 from app.models_crm import Lead, Interaction, Opportunity, Task, Campaign, Contact
+from app.models_reports import DailyRollup
+from app.models_jobs import BackgroundJob
 
@@ -58,6 +58,11 @@ class JournalEntry(db.Model):
     user = db.relationship('User', foreign_keys=[user_id])
     items = db.relationship('JournalEntryItem', backref='journal_entry', cascade='all, delete-orphan')
     
+    # Sort key of the keyset-paginated list view
+    __table_args__ = (
+        db.Index('ix_journal_entries_entry_date_created_at_id', 'entry_date', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<JournalEntry {self.entry_number}>'
 
@@ -65,18 +70,52 @@ class JournalEntryItem(db.Model):
     __tablename__ = 'journal_entry_items'
     
     id = db.Column(db.Integer, primary_key=True)
-    journal_entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id'), nullable=False)
+    journal_entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id'), nullable=False, index=True)
     account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False)
+    cost_center_id = db.Column(db.Integer, db.ForeignKey('cost_centers.id'), index=True)
     
     description = db.Column(db.String(256))
     debit = db.Column(db.Float, default=0.0)
     credit = db.Column(db.Float, default=0.0)
     
     account = db.relationship('Account')
+    cost_center = db.relationship('CostCenter')
+    
+    # Lines of an account joined to their entries (account details and statement)
+    __table_args__ = (
+        db.Index('ix_journal_entry_items_account_id_journal_entry_id', 'account_id', 'journal_entry_id'),
+    )
     
     def __repr__(self):
         return f'<JournalEntryItem Account:{self.account_id}>'
 
+class AccountPeriodBalance(db.Model):
+    """
+    Debit/credit totals of posted journal lines per account and month
+
+    Updated in bulk when entries are posted (see app/utils/balance_helper.py),
+    so balances as of any date are the snapshots of the earlier months plus
+    the lines of the current month only.
+    """
+    __tablename__ = 'account_period_balances'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False)
+    period_start = db.Column(db.Date, nullable=False)  # First day of the month
+    
+    debit = db.Column(db.Float, nullable=False, default=0.0)
+    credit = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    account = db.relationship('Account')
+    
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'period_start', name='unique_account_period'),
+    )
+    
+    def __repr__(self):
+        return f'<AccountPeriodBalance {self.account_id} {self.period_start}>'
+
 class Payment(db.Model):
     __tablename__ = 'payments'
     
@@ -144,11 +183,17 @@ class CostCenter(db.Model):
     
     parent_id = db.Column(db.Integer, db.ForeignKey('cost_centers.id'))
     
+    # Default cost center of automatic entries of this branch / warehouse
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'))
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'))
+    
     is_active = db.Column(db.Boolean, default=True)
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     children = db.relationship('CostCenter', backref=db.backref('parent', remote_side=[id]))
+    branch = db.relationship('Branch')
+    warehouse = db.relationship('Warehouse')
     
     def __repr__(self):
         return f'<CostCenter {self.name}>'
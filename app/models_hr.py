@@ -118,6 +118,8 @@ class Attendance(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('employee_id', 'attendance_date', name='unique_employee_date'),
+        # Attendance of all employees over a date range (monthly summary, payroll)
+        db.Index('ix_attendance_attendance_date_employee_id', 'attendance_date', 'employee_id'),
     )
     
     def __repr__(self):
@@ -186,6 +188,8 @@ class Payroll(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('employee_id', 'month', 'year', name='unique_employee_month_year'),
+        # Payrolls of a month
+        db.Index('ix_payrolls_year_month', 'year', 'month'),
     )
     
     def __repr__(self):
@@ -70,7 +70,7 @@ class Product(db.Model):
     tax_rate = db.Column(db.Float, default=15.0)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # Catalogue versions
     
     # Relationships
     category = db.relationship('Category', backref='products')
@@ -106,6 +106,14 @@ class Warehouse(db.Model):
         return f'<Warehouse {self.name}>'
 
 class Stock(db.Model):
+    """
+    Current stock of a product in a warehouse
+
+    quantity and damaged_quantity are the running totals of the product's
+    stock movements in the warehouse; they are changed together with the
+    movements by app/utils/stock_mutation_helper.py and can be recomputed
+    from the ledger (app/utils/stock_ledger_helper.py).
+    """
     __tablename__ = 'stocks'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -114,7 +122,8 @@ class Stock(db.Model):
     quantity = db.Column(db.Float, default=0.0)
     reserved_quantity = db.Column(db.Float, default=0.0)  # Reserved for orders
     damaged_quantity = db.Column(db.Float, default=0.0)  # Damaged/defective items
-    available_quantity = db.Column(db.Float, default=0.0)  # quantity - reserved - damaged
+    available_quantity = db.Column(db.Float, default=0.0)  # quantity - reserved (damaged stock is already out of quantity)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped by every change (see stock_mutation_helper)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     product = db.relationship('Product', backref='stocks')
@@ -122,6 +131,8 @@ class Stock(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('product_id', 'warehouse_id', name='unique_product_warehouse'),
+        # Stock of a warehouse
+        db.Index('ix_stocks_warehouse_id_product_id', 'warehouse_id', 'product_id'),
     )
 
     def __repr__(self):
@@ -135,7 +146,8 @@ class StockMovement(db.Model):
     warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=False)
 
     movement_type = db.Column(db.String(20))  # in, out, transfer, adjustment, damaged
-    quantity = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Float, nullable=False)  # Signed change of the stock quantity (negative = out)
+    damaged_quantity = db.Column(db.Float, nullable=False, default=0.0, server_default='0')  # Signed change of the damaged quantity
     reference_type = db.Column(db.String(50))  # purchase, sale, transfer, adjustment, damaged
     reference_id = db.Column(db.Integer)
 
@@ -147,6 +159,14 @@ class StockMovement(db.Model):
     warehouse = db.relationship('Warehouse')
     user = db.relationship('User')
 
+    # Stock movement report: filtered by product and/or warehouse and a date
+    # range, newest first
+    __table_args__ = (
+        db.Index('ix_stock_movements_product_id_warehouse_id_created_at', 'product_id', 'warehouse_id', 'created_at'),
+        db.Index('ix_stock_movements_warehouse_id_created_at', 'warehouse_id', 'created_at'),
+        db.Index('ix_stock_movements_created_at', 'created_at'),
+    )
+
     def __repr__(self):
         return f'<StockMovement {self.movement_type} {self.quantity}>'
 
@@ -168,6 +188,53 @@ class DamagedInventory(db.Model):
     warehouse = db.relationship('Warehouse')
     user = db.relationship('User')
 
+    # Sort key of the keyset-paginated list view
+    __table_args__ = (
+        db.Index('ix_damaged_inventory_created_at_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<DamagedInventory Product:{self.product_id} Qty:{self.quantity}>'
 
+class StockSnapshot(db.Model):
+    """
+    Stock balances of a warehouse as of a position in the movement ledger
+
+    The balances are the totals of all movements of the warehouse with an
+    id up to last_movement_id; balances now are the latest snapshot plus the
+    movements after it (see app/utils/stock_ledger_helper.py).
+    """
+    __tablename__ = 'stock_snapshots'
+
+    id = db.Column(db.Integer, primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=False)
+    last_movement_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    warehouse = db.relationship('Warehouse')
+    lines = db.relationship('StockSnapshotLine', backref='snapshot', lazy='dynamic', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_stock_snapshots_warehouse_id', 'warehouse_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<StockSnapshot Warehouse:{self.warehouse_id} Movement:{self.last_movement_id}>'
+
+class StockSnapshotLine(db.Model):
+    """Balance of one product in a stock snapshot (products without stock are left out)"""
+    __tablename__ = 'stock_snapshot_lines'
+
+    id = db.Column(db.Integer, primary_key=True)
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('stock_snapshots.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+    damaged_quantity = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.UniqueConstraint('snapshot_id', 'product_id', name='unique_snapshot_product'),
+    )
+
+    def __repr__(self):
+        return f'<StockSnapshotLine Snapshot:{self.snapshot_id} Product:{self.product_id} Qty:{self.quantity}>'
+
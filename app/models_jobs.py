@@ -0,0 +1,75 @@
+from app import db
+from datetime import datetime
+import json
+
+# Background Job Models
+class BackgroundJob(db.Model):
+    """
+    Long-running operation executed by the job workers
+
+    Enqueued by web requests and claimed by worker threads with an atomic
+    status update (see app/utils/job_helper.py). payload and result hold
+    JSON; heartbeat_at is refreshed while the job reports progress so jobs
+    of a dead worker can be picked up again.
+    """
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    payload = db.Column(db.Text)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+
+    progress = db.Column(db.Integer, nullable=False, default=0)  # Percent
+    message = db.Column(db.String(255))
+    locale = db.Column(db.String(10))  # Language of the user who enqueued it (messages, errors)
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    worker = db.Column(db.String(64))
+    heartbeat_at = db.Column(db.DateTime)
+
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    user = db.relationship('User', foreign_keys=[created_by])
+
+    __table_args__ = (
+        db.Index('ix_background_jobs_status_run_after', 'status', 'run_after'),
+        db.Index('ix_background_jobs_created_by', 'created_by'),
+    )
+
+    @property
+    def payload_data(self):
+        return json.loads(self.payload) if self.payload else {}
+
+    @property
+    def result_data(self):
+        return json.loads(self.result) if self.result else None
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'error': self.error,
+            'result': self.result_data,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.job_type} {self.status}>'
@@ -29,6 +29,11 @@ class POSSession(db.Model):
     cashier = db.relationship('User')
     warehouse = db.relationship('Warehouse')
     
+    # Sort key of the keyset-paginated list view
+    __table_args__ = (
+        db.Index('ix_pos_sessions_created_at_id', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<POSSession {self.session_number}>'
 
@@ -56,6 +61,11 @@ class POSOrder(db.Model):
     
     status = db.Column(db.String(20), default='completed')  # completed, cancelled, refunded
     
+    # Client-generated id of orders queued by an offline till (idempotent sync)
+    client_uuid = db.Column(db.String(36), unique=True, index=True)
+    # Offline sale that took stock below zero (to be reviewed)
+    negative_stock = db.Column(db.Boolean, default=False, nullable=False, server_default='0', index=True)
+    
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -63,6 +73,11 @@ class POSOrder(db.Model):
     customer = db.relationship('Customer')
     items = db.relationship('POSOrderItem', backref='order', cascade='all, delete-orphan')
     
+    # Orders of a session by status (session close and reports)
+    __table_args__ = (
+        db.Index('ix_pos_orders_session_id_status', 'session_id', 'status'),
+    )
+    
     def __repr__(self):
         return f'<POSOrder {self.order_number}>'
 
@@ -80,6 +95,7 @@ class POSOrderItem(db.Model):
     tax_rate = db.Column(db.Float, default=15.0)
     tax_amount = db.Column(db.Float, default=0.0)
     total = db.Column(db.Float, default=0.0)
+    unit_cost = db.Column(db.Float)  # Product cost when the stock was issued
     
     product = db.relationship('Product')
     
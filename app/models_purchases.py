@@ -131,6 +131,11 @@ class PurchaseInvoice(db.Model):
     user = db.relationship('User')
     items = db.relationship('PurchaseInvoiceItem', backref='invoice', cascade='all, delete-orphan')
     
+    # Open invoices of the aging report
+    __table_args__ = (
+        db.Index('ix_purchase_invoices_status_payment_status_invoice_date', 'status', 'payment_status', 'invoice_date'),
+    )
+    
     def __repr__(self):
         return f'<PurchaseInvoice {self.invoice_number}>'
 
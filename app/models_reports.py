@@ -0,0 +1,36 @@
+from app import db
+from datetime import datetime
+
+# Reporting Models
+class DailyRollup(db.Model):
+    """
+    Daily sales/purchase facts per branch, warehouse and product
+
+    Maintained incrementally when invoices are posted, cancelled or deleted
+    (see app/utils/rollup_helper.py). Missing branch/warehouse/product ids
+    are stored as 0 so every key is comparable in the unique constraint.
+    """
+    __tablename__ = 'daily_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # sales, purchases
+    rollup_date = db.Column(db.Date, nullable=False)
+    branch_id = db.Column(db.Integer, nullable=False, default=0)
+    warehouse_id = db.Column(db.Integer, nullable=False, default=0)
+    product_id = db.Column(db.Integer, nullable=False, default=0)
+
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)  # Counted on one line per invoice
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+    net_amount = db.Column(db.Float, nullable=False, default=0.0)  # Revenue (sales) or spend (purchases) before tax
+    tax_amount = db.Column(db.Float, nullable=False, default=0.0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    cost_amount = db.Column(db.Float, nullable=False, default=0.0)  # Cost of goods sold (sales only)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'rollup_date', 'branch_id', 'warehouse_id', 'product_id',
+                            name='unique_daily_rollup_key'),
+    )
+
+    def __repr__(self):
+        return f'<DailyRollup {self.kind} {self.rollup_date} {self.product_id}>'
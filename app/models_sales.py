@@ -85,6 +85,15 @@ class SalesInvoice(db.Model):
     user = db.relationship('User')
     items = db.relationship('SalesInvoiceItem', backref='invoice', cascade='all, delete-orphan')
     
+    # Sort key of the keyset-paginated list view
+    __table_args__ = (
+        db.Index('ix_sales_invoices_created_at_id', 'created_at', 'id'),
+        # Open invoices of the aging report
+        db.Index('ix_sales_invoices_status_payment_status_invoice_date', 'status', 'payment_status', 'invoice_date'),
+        # Posted invoices of a date range (sales report, dashboard totals)
+        db.Index('ix_sales_invoices_status_invoice_date', 'status', 'invoice_date'),
+    )
+    
     def __repr__(self):
         return f'<SalesInvoice {self.invoice_number}>'
 
@@ -103,6 +112,7 @@ class SalesInvoiceItem(db.Model):
     tax_rate = db.Column(db.Float, default=15.0)
     tax_amount = db.Column(db.Float, default=0.0)
     total = db.Column(db.Float, default=0.0)
+    unit_cost = db.Column(db.Float)  # Product cost when the stock was issued
     
     product = db.relationship('Product')
     
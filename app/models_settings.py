@@ -78,3 +78,20 @@ class AccountingSettings(db.Model):
     def __repr__(self):
         return f'<AccountingSettings {self.id}>'
 
+
+class DocumentSequence(db.Model):
+    """Per-prefix, per-period counter used to allocate document numbers"""
+    __tablename__ = 'document_sequences'
+
+    id = db.Column(db.Integer, primary_key=True)
+    prefix = db.Column(db.String(20), nullable=False)  # INV, PINV, ORD, JE, POS
+    period = db.Column(db.String(20), nullable=False, default='')  # e.g. 202601 or 20260115
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('prefix', 'period', name='unique_sequence_prefix_period'),
+    )
+
+    def __repr__(self):
+        return f'<DocumentSequence {self.prefix}{self.period}:{self.last_value}>'
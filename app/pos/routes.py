@@ -3,26 +3,32 @@ from flask_login import login_required, current_user
 from flask_babel import gettext as _
 from app.pos import bp
 from app import db
-from app.models import POSSession, POSOrder, POSOrderItem, Product, Customer, Warehouse, Company
-from app.models import SalesInvoice, SalesInvoiceItem, Stock, StockMovement
+from app.models import POSSession, POSOrder, POSOrderItem, Product, Customer, Warehouse
+from app.models import SalesInvoice, SalesInvoiceItem
 from app.auth.decorators import permission_required, any_permission_required
-from datetime import datetime
+from app.utils.settings_helper import get_company
+from app.utils.sequence_helper import next_document_number
+from app.utils.stock_helper import get_stock_map
+from app.utils.rollup_helper import post_sales_invoice
+from app.utils.stock_mutation_helper import StockChange, change_stock, stock_transaction
+from app.utils.pagination_helper import keyset_paginate
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
+import logging
+
+logger = logging.getLogger(__name__)
 
 def _generate_invoice_number():
     """Generate unique invoice number for POS sales"""
-    today = datetime.utcnow()
-    prefix = f'INV{today.year}{today.month:02d}'
-    last_invoice = SalesInvoice.query.filter(
-        SalesInvoice.invoice_number.like(f'{prefix}%')
-    ).order_by(SalesInvoice.id.desc()).first()
+    return next_document_number('INV', column=SalesInvoice.invoice_number)
 
-    if last_invoice:
-        last_num = int(last_invoice.invoice_number[-4:])
-        invoice_number = f'{prefix}{(last_num + 1):04d}'
-    else:
-        invoice_number = f'{prefix}0001'
-
-    return invoice_number
+def _generate_order_number():
+    """Generate unique POS order number (pre-allocated in blocks per worker)"""
+    return next_document_number(
+        'ORD', period_format='%Y%m%d', column=POSOrder.order_number,
+        block_size=current_app.config.get('POS_ORDER_SEQUENCE_BLOCK_SIZE', 1)
+    )
 
 def _get_or_create_default_customer():
     """Get or create default walk-in customer"""
@@ -40,7 +46,7 @@ def _get_or_create_default_customer():
             is_active=True
         )
         db.session.add(default_customer)
-        db.session.commit()
+        db.session.flush()
 
     return default_customer.id
 
@@ -58,24 +64,34 @@ def index():
     if not open_session:
         return redirect(url_for('pos.open_session'))
 
-    products = Product.query.filter_by(is_active=True, is_sellable=True).all()
+    # Products are loaded by the page from the cached catalogue (inventory.api_catalogue)
     customers = Customer.query.filter_by(is_active=True).all()
 
     # Get company settings for currency and tax
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
     tax_rate = company.tax_rate if company else 15.0
 
     return render_template('pos/index.html',
                          pos_session=open_session,
-                         products=products,
                          customers=customers,
                          company=company,
                          currency_code=currency_code,
                          currency_symbol=currency_symbol,
                          tax_rate=tax_rate)
 
+@bp.route('/api/stock-levels')
+@login_required
+@permission_required('pos.access')
+def stock_levels():
+    """On-hand quantity per product for the POS grid (columnar JSON)"""
+    stock_map = get_stock_map(None)
+    return jsonify({
+        'ids': list(stock_map.keys()),
+        'quantities': [float(quantity) for quantity in stock_map.values()]
+    })
+
 @bp.route('/open-session', methods=['GET', 'POST'])
 @login_required
 @permission_required('pos.session.manage')
@@ -83,17 +99,9 @@ def open_session():
     """Open new POS session"""
     if request.method == 'POST':
         # Generate session number
-        today = datetime.utcnow()
-        prefix = f'POS{today.year}{today.month:02d}{today.day:02d}'
-        last_session = POSSession.query.filter(
-            POSSession.session_number.like(f'{prefix}%')
-        ).order_by(POSSession.id.desc()).first()
-        
-        if last_session:
-            last_num = int(last_session.session_number[-3:])
-            session_number = f'{prefix}{(last_num + 1):03d}'
-        else:
-            session_number = f'{prefix}001'
+        session_number = next_document_number(
+            'POS', period_format='%Y%m%d', width=3, column=POSSession.session_number
+        )
         
         session = POSSession(
             session_number=session_number,
@@ -143,13 +151,11 @@ def close_session(id):
 @permission_required('pos.access')
 def sessions():
     """List POS sessions"""
-    page = request.args.get('page', 1, type=int)
-    sessions = POSSession.query.order_by(POSSession.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    cursor = request.args.get('cursor')
+    sessions = keyset_paginate(POSSession.query, (POSSession.created_at, POSSession.id), cursor, per_page=20)
 
     # Get company settings for currency
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
 
@@ -163,7 +169,7 @@ def session_details(id):
     pos_session = POSSession.query.get_or_404(id)
 
     # Get company settings for currency
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
 
@@ -207,140 +213,335 @@ def create_order():
     try:
         data = request.get_json()
 
-        # Generate order number
-        today = datetime.utcnow()
-        prefix = f'ORD{today.year}{today.month:02d}{today.day:02d}'
-        last_order = POSOrder.query.filter(
-            POSOrder.order_number.like(f'{prefix}%')
-        ).order_by(POSOrder.id.desc()).first()
-
-        if last_order:
-            last_num = int(last_order.order_number[-4:])
-            order_number = f'{prefix}{(last_num + 1):04d}'
-        else:
-            order_number = f'{prefix}0001'
-
-        # Create order
-        order = POSOrder(
-            order_number=order_number,
-            session_id=data['session_id'],
-            customer_id=data.get('customer_id'),
-            subtotal=data['subtotal'],
-            discount_amount=data['discount_amount'],
-            tax_amount=data['tax_amount'],
-            total_amount=data['total_amount'],
-            payment_method=data['payment_method'],
-            cash_amount=data['cash_amount'],
-            card_amount=data['card_amount'],
-            change_amount=max(0, data['cash_amount'] - data['total_amount']) if data['payment_method'] == 'cash' else 0,
-            status='completed'
-        )
+        # A retried request for an order that was already saved returns it again
+        if data.get('client_uuid'):
+            existing = POSOrder.query.filter_by(client_uuid=data['client_uuid']).first()
+            if existing:
+                return jsonify(dict(success=True, duplicate=True, **_order_result(existing)))
+
+        try:
+            order, invoice = _create_order(data)
+        except IntegrityError:
+            # A concurrent retry of the same sale saved it first
+            db.session.rollback()
+            existing = POSOrder.query.filter_by(client_uuid=data.get('client_uuid')).first() \
+                if data.get('client_uuid') else None
+            if existing is None:
+                raise
+            return jsonify(dict(success=True, duplicate=True, **_order_result(existing)))
 
-        db.session.add(order)
-        db.session.flush()
-
-        # Add order items
-        session = POSSession.query.get(data['session_id'])
-
-        for item_data in data['items']:
-            item = POSOrderItem(
-                order_id=order.id,
-                product_id=item_data['productId'],
-                quantity=item_data['quantity'],
-                unit_price=item_data['price'],
-                total=item_data['price'] * item_data['quantity']
-            )
-            db.session.add(item)
-
-            # Update stock
-            stock = Stock.query.filter_by(
-                product_id=item_data['productId'],
-                warehouse_id=session.warehouse_id
-            ).first()
-
-            if stock:
-                stock.quantity -= item_data['quantity']
-
-                # Create stock movement
-                movement = StockMovement(
-                    product_id=item_data['productId'],
-                    warehouse_id=session.warehouse_id,
-                    movement_type='out',
-                    quantity=item_data['quantity'],
-                    reference_type='pos_order',
-                    reference_id=order.id,
-                    notes=f'بيع من نقطة البيع - طلب {order_number}'
-                )
-                db.session.add(movement)
-
-        # ✅ Create Sales Invoice automatically
-        invoice_number = _generate_invoice_number()
-
-        # Get customer_id or use default walk-in customer
-        customer_id = data.get('customer_id')
-        if not customer_id:
-            customer_id = _get_or_create_default_customer()
+        return jsonify({
+            'success': True,
+            'order_id': order.id,
+            'order_number': order.order_number,
+            'invoice_id': invoice.id,
+            'invoice_number': invoice.invoice_number
+        })
 
-        invoice = SalesInvoice(
-            invoice_number=invoice_number,
-            invoice_date=datetime.utcnow().date(),
-            customer_id=customer_id,
-            warehouse_id=session.warehouse_id,
-            subtotal=data['subtotal'],
-            discount_amount=data['discount_amount'],
-            tax_amount=data['tax_amount'],
-            total_amount=data['total_amount'],
-            paid_amount=data['total_amount'],  # Fully paid in POS
-            remaining_amount=0.0,  # No remaining amount
-            notes=f'فاتورة من نقطة البيع - طلب {order_number}',
-            pos_order_id=order.id,
-            user_id=current_user.id,
-            status='paid'  # Automatically mark as paid
-        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
 
-        db.session.add(invoice)
-        db.session.flush()
+@bp.route('/sync-orders', methods=['POST'])
+@login_required
+@permission_required('pos.sell')
+def sync_orders():
+    """
+    Ingest a batch of orders queued by a till
+
+    The till queues every checkout and sends it right away when online.
+    Orders that reach the server at least POS_OFFLINE_GRACE_SECONDS after
+    they were rung up (during their session) are offline sales: they are
+    booked even if stock goes negative, and flagged negative_stock for
+    review. Other orders are live checkouts and need the stock.
+    Each order carries a client-generated client_uuid; orders that were
+    already synced are reported back instead of being created twice. The
+    whole batch is written in one transaction, and if any order fails the
+    batch is rolled back and the failing client_uuid is returned so the
+    till can set it aside and resend the rest.
+    """
+    data = request.get_json(silent=True)
+    orders = data.get('orders') if isinstance(data, dict) else None
+    if not isinstance(orders, list) or not all(isinstance(order_data, dict) for order_data in orders):
+        return jsonify({
+            'success': False,
+            'message': 'يجب إرسال قائمة طلبات (orders)'
+        }), 400
 
-        # Add invoice items from POS order items
-        for item_data in data['items']:
-            product = Product.query.get(item_data['productId'])
-            item_total = item_data['price'] * item_data['quantity']
+    max_batch = current_app.config.get('POS_SYNC_MAX_BATCH', 200)
+    if len(orders) > max_batch:
+        return jsonify({
+            'success': False,
+            'message': f'الحد الأقصى {max_batch} طلب في الدفعة الواحدة'
+        }), 413
 
-            # Calculate tax for this item
-            tax_rate = product.tax_rate if product else 15.0
-            item_tax = item_total * (tax_rate / 100)
+    if any(not isinstance(order_data.get('client_uuid'), str) or not order_data['client_uuid']
+           for order_data in orders):
+        return jsonify({
+            'success': False,
+            'message': 'كل طلب يجب أن يحتوي على client_uuid'
+        }), 400
 
-            invoice_item = SalesInvoiceItem(
-                invoice_id=invoice.id,
-                product_id=item_data['productId'],
-                description=product.name if product else '',
-                quantity=item_data['quantity'],
-                unit_price=item_data['price'],
-                discount_percentage=0.0,
-                discount_amount=0.0,
-                tax_rate=tax_rate,
-                tax_amount=item_tax,
-                total=item_total
-            )
-            db.session.add(invoice_item)
+    received_at = datetime.utcnow()
 
-        db.session.commit()
+    # Orders with a missing or unknown session_id are rejected by _sync_batch
+    # with their client_uuid, so the till sets them aside
+    client_uuids = [order_data['client_uuid'] for order_data in orders]
+    session_ids = {order_data.get('session_id') for order_data in orders
+                   if isinstance(order_data.get('session_id'), int)}
+    pos_sessions = {
+        pos_session.id: pos_session
+        for pos_session in POSSession.query.filter(POSSession.id.in_(session_ids)).all()
+    }
 
-        return jsonify({
-            'success': True,
-            'order_id': order.id,
-            'order_number': order.order_number,
-            'invoice_id': invoice.id,
-            'invoice_number': invoice_number
-        })
+    try:
+        # A concurrent retry of the same orders may save some of them first:
+        # the batch is then run again with those reported as duplicates
+        for attempt in (1, 2):
+            existing = {
+                order.client_uuid: order
+                for order in POSOrder.query.filter(POSOrder.client_uuid.in_(client_uuids)).all()
+            }
+            try:
+                results = _sync_batch(orders, existing, pos_sessions, received_at)
+                break
+            except IntegrityError:
+                db.session.rollback()
+                saved = POSOrder.query.filter(POSOrder.client_uuid.in_(client_uuids)).count()
+                if attempt == 2 or saved == len(existing):
+                    raise
 
     except Exception as e:
         db.session.rollback()
         return jsonify({
             'success': False,
+            'failed_client_uuid': getattr(e, 'client_uuid', None),
             'message': str(e)
         }), 400
 
+    return jsonify({
+        'success': True,
+        'results': results
+    })
+
+@stock_transaction
+def _create_order(data):
+    """Check out one order from the till; committed and retried by @stock_transaction"""
+    pos_session = db.session.get(POSSession, data['session_id'])
+    if not pos_session:
+        raise ValueError('الوردية غير موجودة')
+    return _checkout(data, pos_session)
+
+@stock_transaction
+def _sync_batch(orders, existing, pos_sessions, received_at):
+    """
+    Write a batch of queued orders in one transaction (committed and
+    retried by @stock_transaction). Offline sales (see _is_offline_sale)
+    already happened, so their stock may go negative; live checkouts raise
+    InsufficientStock. An error carries the client_uuid of the failing order.
+    """
+    results = []
+    created = {}
+    for order_data in orders:
+        current_uuid = order_data['client_uuid']
+        try:
+            order = existing.get(current_uuid) or created.get(current_uuid)
+            if order:
+                results.append(dict(client_uuid=current_uuid, duplicate=True, **_order_result(order)))
+                continue
+
+            pos_session = pos_sessions.get(order_data.get('session_id'))
+            if not pos_session:
+                raise ValueError('الوردية غير موجودة')
+
+            order, invoice = _checkout(order_data, pos_session,
+                                       allow_negative=_is_offline_sale(order_data, pos_session, received_at))
+        except Exception as e:
+            e.client_uuid = current_uuid
+            raise
+
+        created[current_uuid] = order
+        results.append({
+            'client_uuid': current_uuid,
+            'duplicate': False,
+            'order_id': order.id,
+            'order_number': order.order_number,
+            'invoice_id': invoice.id,
+            'invoice_number': invoice.invoice_number
+        })
+    return results
+
+def _is_offline_sale(data, pos_session, received_at):
+    """
+    Whether a queued order was rung up offline: during its session and at
+    least POS_OFFLINE_GRACE_SECONDS before it reached the server (decided
+    here, never by a flag of the till)
+    """
+    order_date = _parse_order_date(data)
+    if order_date is None:
+        return False
+    grace = timedelta(seconds=current_app.config.get('POS_OFFLINE_GRACE_SECONDS', 120))
+    return pos_session.opening_time <= order_date <= received_at - grace
+
+def _parse_order_date(data):
+    """UTC order_date sent by the till (naive datetime), or None"""
+    if not data.get('order_date'):
+        return None
+    order_date = datetime.fromisoformat(data['order_date'].replace('Z', '+00:00'))
+    if order_date.tzinfo:
+        order_date = order_date.astimezone(timezone.utc).replace(tzinfo=None)
+    return order_date
+
+def _order_result(order):
+    """Response fields of an already saved POS order"""
+    invoice = SalesInvoice.query.filter_by(pos_order_id=order.id).first()
+    return {
+        'order_id': order.id,
+        'order_number': order.order_number,
+        'invoice_id': invoice.id if invoice else None,
+        'invoice_number': invoice.invoice_number if invoice else None
+    }
+
+def _checkout(data, pos_session, allow_negative=False):
+    """
+    Write a POS order with its sales invoice and stock movements
+
+    The cart is processed in bulk: products are loaded with one query, order
+    items and invoice items are inserted with one executemany per table and
+    the stock of tracked products is taken out with one change_stock call
+    (rows locked or version-checked in product order). The caller commits.
+
+    Returns:
+        tuple: (order, invoice)
+    """
+    items = data['items']
+    warehouse_id = pos_session.warehouse_id
+
+    # Quantity per product (the same product can appear on several cart lines)
+    quantities = {}
+    for item_data in items:
+        product_id = int(item_data['productId'])
+        quantities[product_id] = quantities.get(product_id, 0) + item_data['quantity']
+    product_ids = sorted(quantities)
+
+    products = {
+        product.id: product
+        for product in Product.query.filter(Product.id.in_(product_ids)).all()
+    }
+
+    # Get customer_id or use default walk-in customer
+    customer_id = data.get('customer_id')
+    invoice_customer_id = customer_id or _get_or_create_default_customer()
+
+    order_number = _generate_order_number()
+    invoice_number = _generate_invoice_number()
+
+    # Orders synced from an offline till keep the time they were rung up
+    order_date = _parse_order_date(data) or datetime.utcnow()
+
+    order = POSOrder(
+        order_number=order_number,
+        order_date=order_date,
+        client_uuid=data.get('client_uuid'),
+        session_id=pos_session.id,
+        customer_id=customer_id,
+        subtotal=data['subtotal'],
+        discount_amount=data['discount_amount'],
+        tax_amount=data['tax_amount'],
+        total_amount=data['total_amount'],
+        payment_method=data['payment_method'],
+        cash_amount=data['cash_amount'],
+        card_amount=data['card_amount'],
+        change_amount=max(0, data['cash_amount'] - data['total_amount']) if data['payment_method'] == 'cash' else 0,
+        status='completed'
+    )
+    db.session.add(order)
+    db.session.flush()
+
+    # ✅ Create Sales Invoice automatically
+    invoice = SalesInvoice(
+        invoice_number=invoice_number,
+        invoice_date=order_date.date(),
+        customer_id=invoice_customer_id,
+        warehouse_id=warehouse_id,
+        subtotal=data['subtotal'],
+        discount_amount=data['discount_amount'],
+        tax_amount=data['tax_amount'],
+        total_amount=data['total_amount'],
+        paid_amount=data['total_amount'],  # Fully paid in POS
+        remaining_amount=0.0,  # No remaining amount
+        notes=f'فاتورة من نقطة البيع - طلب {order_number}',
+        pos_order_id=order.id,
+        user_id=current_user.id,
+        status='paid'  # Automatically mark as paid
+    )
+    db.session.add(invoice)
+    db.session.flush()
+
+    order_items = []
+    invoice_items = []
+    rollup_lines = []
+    for item_data in items:
+        product = products.get(int(item_data['productId']))
+        item_total = item_data['price'] * item_data['quantity']
+
+        # Calculate tax for this item
+        tax_rate = product.tax_rate if product else 15.0
+        # Cost of the goods at the time of sale
+        unit_cost = (product.cost_price or 0) if product else 0
+
+        order_items.append({
+            'order_id': order.id,
+            'product_id': item_data['productId'],
+            'quantity': item_data['quantity'],
+            'unit_price': item_data['price'],
+            'total': item_total,
+            'unit_cost': unit_cost
+        })
+        invoice_items.append({
+            'invoice_id': invoice.id,
+            'product_id': item_data['productId'],
+            'description': product.name if product else '',
+            'quantity': item_data['quantity'],
+            'unit_price': item_data['price'],
+            'discount_percentage': 0.0,
+            'discount_amount': 0.0,
+            'tax_rate': tax_rate,
+            'tax_amount': item_total * (tax_rate / 100),
+            'total': item_total,
+            'unit_cost': unit_cost
+        })
+        rollup_lines.append({
+            'product_id': int(item_data['productId']),
+            'quantity': item_data['quantity'],
+            'total': item_total,
+            'cost': unit_cost * item_data['quantity']
+        })
+
+    db.session.execute(insert(POSOrderItem), order_items)
+    db.session.execute(insert(SalesInvoiceItem), invoice_items)
+
+    # Update stock
+    new_quantities = change_stock(
+        [StockChange(product_id, warehouse_id, -quantities[product_id]) for product_id in product_ids
+         if product_id in products and products[product_id].track_inventory],
+        reference_type='pos_order', reference_id=order.id, user_id=current_user.id,
+        notes=f'بيع من نقطة البيع - طلب {order_number}', allow_negative=allow_negative)
+    below_zero = sorted(product_id for (product_id, _warehouse_id), quantity in new_quantities.items()
+                        if quantity < -1e-9)
+    if below_zero:
+        order.negative_stock = True
+        logger.warning('POS order %s (offline sale) took stock below zero: products %s in warehouse %s',
+                       order_number, below_zero, warehouse_id)
+
+    # Add the sale to the daily rollup
+    post_sales_invoice(invoice, lines=rollup_lines)
+
+    return order, invoice
+
 @bp.route('/print-receipt/<int:order_id>')
 @login_required
 @permission_required('pos.access')
@@ -349,7 +550,7 @@ def print_receipt(order_id):
     order = POSOrder.query.get_or_404(order_id)
 
     # Get company settings
-    company = Company.query.first()
+    company = get_company()
 
     # Get currency settings
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
@@ -460,7 +661,7 @@ def print_quotation(quotation_id):
     quotation = Quotation.query.get_or_404(quotation_id)
 
     # Get company settings for currency
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
 
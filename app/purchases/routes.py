@@ -3,9 +3,13 @@ from flask_login import login_required, current_user
 from flask_babel import gettext as _
 from app.purchases import bp
 from app import db
-from app.models import Supplier, PurchaseInvoice, PurchaseInvoiceItem, Product, Warehouse, Stock, StockMovement
+from app.models import Supplier, PurchaseInvoice, PurchaseInvoiceItem, Warehouse
 from app.utils.accounting_helper import create_purchase_invoice_journal_entry
+from app.utils.sequence_helper import next_document_number
+from app.utils.rollup_helper import post_purchase_invoice
+from app.utils.stock_mutation_helper import StockChange, change_stock, stock_transaction
 from app.auth.decorators import permission_required, any_permission_required
+from app.utils.settings_helper import get_company
 from datetime import datetime
 
 @bp.route('/suppliers')
@@ -140,17 +144,7 @@ def add_invoice():
     """Add new purchase invoice"""
     if request.method == 'POST':
         # Generate invoice number
-        today = datetime.utcnow()
-        prefix = f'PINV{today.year}{today.month:02d}'
-        last_invoice = PurchaseInvoice.query.filter(
-            PurchaseInvoice.invoice_number.like(f'{prefix}%')
-        ).order_by(PurchaseInvoice.id.desc()).first()
-        
-        if last_invoice:
-            last_num = int(last_invoice.invoice_number[-4:])
-            invoice_number = f'{prefix}{(last_num + 1):04d}'
-        else:
-            invoice_number = f'{prefix}0001'
+        invoice_number = next_document_number('PINV', column=PurchaseInvoice.invoice_number)
         
         invoice = PurchaseInvoice(
             invoice_number=invoice_number,
@@ -223,19 +217,16 @@ def add_invoice():
     
     suppliers = Supplier.query.filter_by(is_active=True).all()
     warehouses = Warehouse.query.filter_by(is_active=True).all()
-    products = Product.query.filter_by(is_active=True, is_purchasable=True).all()
 
     # Get company settings for currency
-    from app.models import Company
     from flask import current_app
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
 
     return render_template('purchases/add_invoice.html',
                          suppliers=suppliers,
                          warehouses=warehouses,
-                         products=products,
                          currency_code=currency_code,
                          currency_symbol=currency_symbol)
 
@@ -247,6 +238,76 @@ def invoice_details(id):
     invoice = PurchaseInvoice.query.get_or_404(id)
     return render_template('purchases/invoice_details.html', invoice=invoice)
 
+@stock_transaction
+def _confirm_invoice(id, user_id):
+    """
+    Confirm a draft purchase invoice: receive its stock, post it to the
+    rollup and the ledger. Committed and retried by @stock_transaction.
+
+    Returns:
+        tuple: (journal entry or None, journal entry error or None)
+    """
+    invoice = db.session.get(PurchaseInvoice, id)
+    if invoice.status != 'draft':
+        raise ValueError(_('Cannot confirm this invoice'))
+
+    # Update invoice status and mark as paid
+    invoice.status = 'confirmed'
+    invoice.payment_status = 'paid'
+    invoice.paid_amount = invoice.total_amount
+    invoice.remaining_amount = 0
+
+    # Add stock for each item
+    change_stock([StockChange(item.product_id, invoice.warehouse_id, item.quantity) for item in invoice.items],
+                 reference_type='purchase_invoice', reference_id=invoice.id, user_id=user_id,
+                 notes=f'فاتورة شراء رقم {invoice.invoice_number}')
+
+    # Update supplier balance
+    invoice.supplier.current_balance += invoice.total_amount
+
+    # Add the purchase to the daily rollup
+    post_purchase_invoice(invoice)
+
+    # Create accounting journal entry; an error is reported but does not fail the invoice
+    try:
+        return create_purchase_invoice_journal_entry(invoice), None
+    except Exception as je:
+        return None, je
+
+def _remove_invoice_stock(invoice, user_id, reference_type, notes):
+    """Take the stock of a confirmed invoice out again and remove it from the supplier balance and the rollup"""
+    change_stock([StockChange(item.product_id, invoice.warehouse_id, -item.quantity) for item in invoice.items],
+                 reference_type=reference_type, reference_id=invoice.id, user_id=user_id, notes=notes)
+
+    # Update supplier balance
+    invoice.supplier.current_balance -= invoice.total_amount
+
+    # Remove the purchase from the daily rollup
+    post_purchase_invoice(invoice, sign=-1)
+
+@stock_transaction
+def _cancel_invoice(id, user_id):
+    invoice = db.session.get(PurchaseInvoice, id)
+    if invoice.status != 'confirmed':
+        raise ValueError(_('Cannot cancel this invoice'))
+
+    # Update invoice status
+    invoice.status = 'cancelled'
+    _remove_invoice_stock(invoice, user_id, 'purchase_invoice_cancel',
+                          f'إلغاء فاتورة شراء رقم {invoice.invoice_number}')
+
+@stock_transaction
+def _delete_invoice(id, user_id):
+    invoice = db.session.get(PurchaseInvoice, id)
+
+    # If invoice was confirmed, remove stock and update supplier balance
+    if invoice.status == 'confirmed':
+        _remove_invoice_stock(invoice, user_id, 'purchase_invoice_delete',
+                              f'حذف فاتورة مشتريات رقم {invoice.invoice_number}')
+
+    # Delete invoice
+    db.session.delete(invoice)
+
 @bp.route('/invoices/<int:id>/confirm', methods=['GET', 'POST'])
 @login_required
 @permission_required('purchases.edit')
@@ -260,57 +321,12 @@ def confirm_invoice(id):
 
     if request.method == 'POST':
         try:
-            # Update invoice status and mark as paid
-            invoice.status = 'confirmed'
-            invoice.payment_status = 'paid'
-            invoice.paid_amount = invoice.total_amount
-            invoice.remaining_amount = 0
-
-            # Add stock for each item
-            for item in invoice.items:
-                # Get or create stock record
-                stock = Stock.query.filter_by(
-                    product_id=item.product_id,
-                    warehouse_id=invoice.warehouse_id
-                ).first()
-
-                if not stock:
-                    stock = Stock(
-                        product_id=item.product_id,
-                        warehouse_id=invoice.warehouse_id,
-                        quantity=0
-                    )
-                    db.session.add(stock)
-
-                # Add quantity
-                stock.quantity += item.quantity
-
-                # Create stock movement record
-                movement = StockMovement(
-                    product_id=item.product_id,
-                    warehouse_id=invoice.warehouse_id,
-                    movement_type='in',
-                    quantity=item.quantity,
-                    reference_type='purchase_invoice',
-                    reference_id=invoice.id,
-                    notes=f'فاتورة شراء رقم {invoice.invoice_number}',
-                    user_id=current_user.id
-                )
-                db.session.add(movement)
+            journal_entry, journal_error = _confirm_invoice(id, current_user.id)
+            if journal_entry:
+                flash(_('Journal entry number %(number)s created', number=journal_entry.entry_number), 'info')
+            if journal_error is not None:
+                flash(_('Warning: Journal entry was not created: %(error)s', error=str(journal_error)), 'warning')
 
-            # Update supplier balance
-            invoice.supplier.current_balance += invoice.total_amount
-
-            # Create accounting journal entry
-            try:
-                journal_entry = create_purchase_invoice_journal_entry(invoice)
-                if journal_entry:
-                    flash(_('Journal entry number %(number)s created', number=journal_entry.entry_number), 'info')
-            except Exception as je:
-                # Log the error but don't fail the invoice confirmation
-                flash(_('Warning: Journal entry was not created: %(error)s', error=str(je)), 'warning')
-
-            db.session.commit()
             flash(_('Purchase invoice confirmed successfully'), 'success')
             return redirect(url_for('purchases.invoice_details', id=id))
 
@@ -320,9 +336,8 @@ def confirm_invoice(id):
             return redirect(url_for('purchases.invoice_details', id=id))
 
     # Get company settings for currency
-    from app.models import Company
     from flask import current_app
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
 
@@ -344,36 +359,7 @@ def cancel_invoice(id):
 
     if request.method == 'POST':
         try:
-            # Update invoice status
-            invoice.status = 'cancelled'
-
-            # Remove stock for each item
-            for item in invoice.items:
-                stock = Stock.query.filter_by(
-                    product_id=item.product_id,
-                    warehouse_id=invoice.warehouse_id
-                ).first()
-
-                if stock:
-                    stock.quantity -= item.quantity
-
-                    # Create stock movement record
-                    movement = StockMovement(
-                        product_id=item.product_id,
-                        warehouse_id=invoice.warehouse_id,
-                        movement_type='out',
-                        quantity=item.quantity,
-                        reference_type='purchase_invoice_cancel',
-                        reference_id=invoice.id,
-                        notes=f'إلغاء فاتورة شراء رقم {invoice.invoice_number}',
-                        user_id=current_user.id
-                    )
-                    db.session.add(movement)
-
-            # Update supplier balance
-            invoice.supplier.current_balance -= invoice.total_amount
-
-            db.session.commit()
+            _cancel_invoice(id, current_user.id)
             flash(_('Purchase invoice cancelled successfully'), 'success')
             return redirect(url_for('purchases.invoice_details', id=id))
 
@@ -393,36 +379,7 @@ def delete_invoice(id):
 
     if request.method == 'POST':
         try:
-            # If invoice was confirmed, remove stock and update supplier balance
-            if invoice.status == 'confirmed':
-                for item in invoice.items:
-                    stock = Stock.query.filter_by(
-                        product_id=item.product_id,
-                        warehouse_id=invoice.warehouse_id
-                    ).first()
-
-                    if stock:
-                        stock.quantity -= item.quantity
-
-                        # Create stock movement record
-                        movement = StockMovement(
-                            product_id=item.product_id,
-                            warehouse_id=invoice.warehouse_id,
-                            movement_type='out',
-                            quantity=item.quantity,
-                            reference_type='purchase_invoice_delete',
-                            reference_id=invoice.id,
-                            notes=f'حذف فاتورة مشتريات رقم {invoice.invoice_number}',
-                            user_id=current_user.id
-                        )
-                        db.session.add(movement)
-
-                # Update supplier balance
-                invoice.supplier.current_balance -= invoice.total_amount
-
-            # Delete invoice
-            db.session.delete(invoice)
-            db.session.commit()
+            _delete_invoice(id, current_user.id)
             flash(_('Purchase invoice deleted successfully'), 'success')
             return redirect(url_for('purchases.invoices'))
         except Exception as e:
@@ -1,9 +1,15 @@
-from flask import render_template, redirect, url_for, request, current_app
-from flask_login import login_required
-from app.auth.decorators import permission_required
+from flask import render_template, redirect, url_for, request, current_app, flash, abort
+from flask_login import login_required, current_user
+from flask_babel import gettext as _
+from app.auth.decorators import permission_required, admin_required
+from app.utils.settings_helper import get_company
 from app.reports import bp
 from app import db
 from app.models import *
+from app.utils.stock_helper import get_stock_levels
+from app.utils.rollup_helper import get_rollup_totals, get_monthly_rollup, get_rollup_years
+from app.utils.export_helper import get_export_format, iter_query, stream_export
+from app.utils.job_helper import enqueue_job
 from sqlalchemy import func
 from datetime import datetime, timedelta
 
@@ -14,6 +20,24 @@ def index():
     """Reports dashboard"""
     return render_template('reports/index.html')
 
+# Summary tables the reports read from, rebuilt by a background job
+REBUILD_JOBS = {
+    'rollups': 'reports.rebuild_rollups',
+    'account-balances': 'accounting.rebuild_account_balances',
+    'stock': 'inventory.verify_stock',
+}
+
+@bp.route('/rebuild/<kind>', methods=['POST'])
+@login_required
+@admin_required
+def rebuild_summaries(kind):
+    """Rebuild the daily rollups or the account balance snapshots, or verify stock against its ledger"""
+    if kind not in REBUILD_JOBS:
+        abort(404)
+    job = enqueue_job(REBUILD_JOBS[kind], {'back_url': url_for('reports.index')}, user_id=current_user.id)
+    flash(_('The rebuild has started; you can follow it on this page'), 'info')
+    return redirect(url_for('main.job_status', id=job.id))
+
 @bp.route('/sales')
 @login_required
 @permission_required('reports.sales')
@@ -29,14 +53,27 @@ def sales_report():
     if end_date:
         query = query.filter(SalesInvoice.invoice_date <= datetime.strptime(end_date, '%Y-%m-%d').date())
 
+    export_format = get_export_format()
+    if export_format:
+        rows = query.outerjoin(Customer, Customer.id == SalesInvoice.customer_id).outerjoin(
+            Warehouse, Warehouse.id == SalesInvoice.warehouse_id
+        ).with_entities(
+            SalesInvoice.invoice_number, SalesInvoice.invoice_date, Customer.name, Warehouse.name,
+            SalesInvoice.subtotal, SalesInvoice.tax_amount, SalesInvoice.total_amount,
+            SalesInvoice.payment_status
+        ).order_by(SalesInvoice.invoice_date, SalesInvoice.id)
+        return stream_export(export_format, 'sales_report',
+                             [_('Invoice Number'), _('Date'), _('Customer'), _('Warehouse'),
+                              _('Subtotal'), _('Tax'), _('Total'), _('Payment Status')],
+                             iter_query(rows))
+
     invoices = query.all()
 
     total_sales = sum(inv.total_amount for inv in invoices)
     total_tax = sum(inv.tax_amount for inv in invoices)
 
     # Get currency settings
-    from app.models import Company
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'EUR')
     currency_name = current_app.config['CURRENCIES'].get(currency_code, {}).get('name', 'Euro')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', '€')
@@ -66,6 +103,20 @@ def purchases_report():
     if end_date:
         query = query.filter(PurchaseInvoice.invoice_date <= datetime.strptime(end_date, '%Y-%m-%d').date())
 
+    export_format = get_export_format()
+    if export_format:
+        rows = query.outerjoin(Supplier, Supplier.id == PurchaseInvoice.supplier_id).outerjoin(
+            Warehouse, Warehouse.id == PurchaseInvoice.warehouse_id
+        ).with_entities(
+            PurchaseInvoice.invoice_number, PurchaseInvoice.invoice_date, Supplier.name, Warehouse.name,
+            PurchaseInvoice.subtotal, PurchaseInvoice.tax_amount, PurchaseInvoice.total_amount,
+            PurchaseInvoice.status
+        ).order_by(PurchaseInvoice.invoice_date, PurchaseInvoice.id)
+        return stream_export(export_format, 'purchases_report',
+                             [_('Invoice Number'), _('Date'), _('Supplier'), _('Warehouse'),
+                              _('Subtotal'), _('Tax'), _('Total'), _('Status')],
+                             iter_query(rows))
+
     invoices = query.all()
 
     total_purchases = sum(inv.total_amount for inv in invoices)
@@ -97,22 +148,18 @@ def purchases_report():
 @permission_required('reports.inventory')
 def inventory_report():
     """Inventory report"""
-    products = Product.query.filter_by(is_active=True, track_inventory=True).all()
-
     inventory_data = []
-    for product in products:
-        stock_qty = product.get_stock()
+    for level in get_stock_levels():
         inventory_data.append({
-            'product': product,
-            'stock': stock_qty,
-            'value': stock_qty * product.cost_price
+            'product': level['product'],
+            'stock': level['on_hand'],
+            'value': level['value']
         })
 
     total_value = sum(item['value'] for item in inventory_data)
 
     # Get company settings for currency
-    from app.models import Company
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
 
@@ -130,28 +177,15 @@ def profit_loss():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
-    # Calculate revenue
-    revenue_query = db.session.query(func.sum(SalesInvoice.total_amount)).filter(SalesInvoice.status != 'cancelled')
-    if start_date:
-        revenue_query = revenue_query.filter(SalesInvoice.invoice_date >= datetime.strptime(start_date, '%Y-%m-%d').date())
-    if end_date:
-        revenue_query = revenue_query.filter(SalesInvoice.invoice_date <= datetime.strptime(end_date, '%Y-%m-%d').date())
-
-    total_revenue = revenue_query.scalar() or 0
-
-    # Calculate cost of goods sold (COGS) - from sales invoice items
-    sales_query = SalesInvoice.query.filter(SalesInvoice.status != 'cancelled')
-    if start_date:
-        sales_query = sales_query.filter(SalesInvoice.invoice_date >= datetime.strptime(start_date, '%Y-%m-%d').date())
-    if end_date:
-        sales_query = sales_query.filter(SalesInvoice.invoice_date <= datetime.strptime(end_date, '%Y-%m-%d').date())
-
-    sales_invoices = sales_query.all()
-
-    total_cogs = 0
-    for invoice in sales_invoices:
-        for item in invoice.items:
-            total_cogs += item.product.cost_price * item.quantity
+    # Revenue and cost of goods sold (costs frozen at the time of sale)
+    # in one aggregate query over the daily rollup
+    totals = get_rollup_totals(
+        'sales',
+        datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None,
+        datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+    )
+    total_revenue = totals['total_amount']
+    total_cogs = totals['cost_amount']
 
     gross_profit = total_revenue - total_cogs
 
@@ -175,18 +209,15 @@ def profit_loss():
 @permission_required('reports.inventory')
 def low_stock_report():
     """Low stock products report"""
-    products = Product.query.filter_by(is_active=True, track_inventory=True).all()
-
     low_stock_products = []
-    for product in products:
-        stock_qty = product.get_stock()
-        if stock_qty <= product.min_stock:
-            low_stock_products.append({
-                'product': product,
-                'current_stock': stock_qty,
-                'min_stock': product.min_stock,
-                'shortage': product.min_stock - stock_qty
-            })
+    for level in get_stock_levels(low_stock_only=True):
+        product = level['product']
+        low_stock_products.append({
+            'product': product,
+            'current_stock': level['on_hand'],
+            'min_stock': product.min_stock,
+            'shortage': product.min_stock - level['on_hand']
+        })
 
     return render_template('reports/low_stock.html',
                          low_stock_products=low_stock_products)
@@ -212,6 +243,21 @@ def stock_movement_report():
     if warehouse_id:
         query = query.filter_by(warehouse_id=warehouse_id)
 
+    export_format = get_export_format()
+    if export_format:
+        rows = query.join(Product, Product.id == StockMovement.product_id).join(
+            Warehouse, Warehouse.id == StockMovement.warehouse_id
+        ).outerjoin(User, User.id == StockMovement.user_id).with_entities(
+            StockMovement.created_at, Product.code, Product.name, Warehouse.name,
+            StockMovement.movement_type, StockMovement.quantity,
+            StockMovement.reference_type, StockMovement.reference_id,
+            User.full_name, StockMovement.notes
+        ).order_by(StockMovement.created_at.desc(), StockMovement.id.desc())
+        return stream_export(export_format, 'stock_movements',
+                             [_('Date'), _('Code'), _('Product'), _('Warehouse'), _('Type'), _('Quantity'),
+                              _('Reference'), _('Reference ID'), _('User'), _('Notes')],
+                             iter_query(rows))
+
     movements = query.order_by(StockMovement.created_at.desc()).all()
 
     products = Product.query.filter_by(is_active=True).order_by(Product.name).all()
@@ -373,29 +419,18 @@ def purchases_monthly():
     if not year:
         year = datetime.now().year
 
-    # Get all invoices for the year
+    # Monthly totals for the year from the daily rollup (one grouped query)
     start_date = datetime(year, 1, 1).date()
     end_date = datetime(year, 12, 31).date()
 
-    invoices = PurchaseInvoice.query.filter(
-        PurchaseInvoice.status != 'cancelled',
-        PurchaseInvoice.invoice_date >= start_date,
-        PurchaseInvoice.invoice_date <= end_date
-    ).all()
-
-    # Group by month
-    monthly_dict = {}
-    for invoice in invoices:
-        month_num = invoice.invoice_date.month
-        if month_num not in monthly_dict:
-            monthly_dict[month_num] = {
-                'invoice_count': 0,
-                'total_amount': 0,
-                'total_tax': 0
-            }
-        monthly_dict[month_num]['invoice_count'] += 1
-        monthly_dict[month_num]['total_amount'] += invoice.total_amount
-        monthly_dict[month_num]['total_tax'] += invoice.tax_amount
+    monthly_dict = {
+        month_num: {
+            'invoice_count': int(totals['invoice_count'] or 0),
+            'total_amount': round(totals['total_amount'] or 0, 2),
+            'total_tax': round(totals['tax_amount'] or 0, 2)
+        }
+        for (_year, month_num), totals in get_monthly_rollup('purchases', start_date, end_date).items()
+    }
 
     # Create complete 12-month data
     months_data = []
@@ -434,16 +469,7 @@ def purchases_monthly():
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', '€')
 
     # Get available years
-    all_invoices = PurchaseInvoice.query.filter(
-        PurchaseInvoice.status != 'cancelled'
-    ).all()
-
-    years_set = set()
-    for inv in all_invoices:
-        if inv.invoice_date:
-            years_set.add(inv.invoice_date.year)
-
-    available_years = sorted(list(years_set), reverse=True)
+    available_years = get_rollup_years('purchases')
     if not available_years:
         available_years = [datetime.now().year]
 
@@ -479,8 +505,7 @@ def suppliers_list():
             suppliers_with_purchases += 1
 
     # Get currency settings
-    from app.models import Company
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'EUR')
     currency_name = current_app.config['CURRENCIES'].get(currency_code, {}).get('name', 'Euro')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', '€')
@@ -534,8 +559,7 @@ def suppliers_top():
     total_invoices = sum(s['invoice_count'] for s in suppliers_data)
 
     # Get currency settings
-    from app.models import Company
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'EUR')
     currency_name = current_app.config['CURRENCIES'].get(currency_code, {}).get('name', 'Euro')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', '€')
@@ -562,8 +586,7 @@ def suppliers_balances():
     net_balance = sum(s.current_balance or 0 for s in suppliers)
 
     # Get currency settings
-    from app.models import Company
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'EUR')
     currency_name = current_app.config['CURRENCIES'].get(currency_code, {}).get('name', 'Euro')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', '€')
@@ -596,8 +619,7 @@ def suppliers_history(supplier_id):
     total_remaining = sum(inv.remaining_amount or 0 for inv in invoices)
 
     # Get currency settings
-    from app.models import Company
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'EUR')
     currency_name = current_app.config['CURRENCIES'].get(currency_code, {}).get('name', 'Euro')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', '€')
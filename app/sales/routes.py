@@ -3,10 +3,15 @@ from flask_login import login_required, current_user
 from flask_babel import gettext as _
 from app.sales import bp
 from app import db
-from app.models import Customer, SalesInvoice, SalesInvoiceItem, Product, Warehouse, Stock, StockMovement
+from app.models import Customer, SalesInvoice, SalesInvoiceItem, Product, Warehouse
 from app.models_sales import Quotation, QuotationItem
 from app.utils.accounting_helper import create_sales_invoice_journal_entry
+from app.utils.sequence_helper import next_document_number
+from app.utils.rollup_helper import post_sales_invoice
+from app.utils.stock_mutation_helper import StockChange, InsufficientStock, change_stock, stock_transaction
+from app.utils.pagination_helper import keyset_paginate
 from app.auth.decorators import permission_required, any_permission_required
+from app.utils.settings_helper import get_company
 from datetime import datetime, timedelta
 
 @bp.route('/customers')
@@ -122,7 +127,7 @@ def add_customer_ajax():
 @permission_required('sales.view')
 def invoices():
     """List all sales invoices"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     search = request.args.get('search', '')
     status = request.args.get('status', '')
     
@@ -134,9 +139,7 @@ def invoices():
     if status:
         query = query.filter_by(status=status)
     
-    invoices = query.order_by(SalesInvoice.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    invoices = keyset_paginate(query, (SalesInvoice.created_at, SalesInvoice.id), cursor, per_page=20)
     
     return render_template('sales/invoices.html',
                          invoices=invoices,
@@ -154,17 +157,7 @@ def add_invoice():
             print("Form data:", request.form)
 
             # Generate invoice number
-            today = datetime.utcnow()
-            prefix = f'INV{today.year}{today.month:02d}'
-            last_invoice = SalesInvoice.query.filter(
-                SalesInvoice.invoice_number.like(f'{prefix}%')
-            ).order_by(SalesInvoice.id.desc()).first()
-
-            if last_invoice:
-                last_num = int(last_invoice.invoice_number[-4:])
-                invoice_number = f'{prefix}{(last_num + 1):04d}'
-            else:
-                invoice_number = f'{prefix}0001'
+            invoice_number = next_document_number('INV', column=SalesInvoice.invoice_number)
 
             print(f"Generated invoice number: {invoice_number}")
 
@@ -260,32 +253,20 @@ def add_invoice():
     
     customers = Customer.query.filter_by(is_active=True).all()
     warehouses = Warehouse.query.filter_by(is_active=True).all()
-    products_query = Product.query.filter_by(is_active=True, is_sellable=True).all()
-
-    # Convert products to dictionary for JSON serialization
-    products = [{
-        'id': p.id,
-        'name': p.name,
-        'code': p.code,
-        'selling_price': float(p.selling_price) if p.selling_price else 0,
-        'tax_rate': float(p.tax_rate) if p.tax_rate else 15
-    } for p in products_query]
 
     # Get today's date for default value
     from datetime import date
     today = date.today().strftime('%Y-%m-%d')
 
     # Get company settings for currency
-    from app.models import Company
     from flask import current_app
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
 
     return render_template('sales/add_invoice.html',
                          customers=customers,
                          warehouses=warehouses,
-                         products=products,
                          today=today,
                          currency_code=currency_code,
                          currency_symbol=currency_symbol)
@@ -314,6 +295,53 @@ def warehouse_paper(id):
     invoice = SalesInvoice.query.get_or_404(id)
     return render_template('sales/warehouse_paper.html', invoice=invoice)
 
+@stock_transaction
+def _post_invoice(id, user_id, paid=False):
+    """
+    Confirm a draft invoice (paid=True also marks it fully paid): issue its
+    stock, post it to the rollup and the ledger. Committed and retried by
+    @stock_transaction.
+
+    Returns:
+        tuple: (invoice, journal entry or None, journal entry error or None)
+    """
+    invoice = db.session.get(SalesInvoice, id)
+    if invoice.status != 'draft':
+        raise ValueError(_('Cannot confirm this invoice'))
+
+    # Update invoice status
+    invoice.status = 'confirmed'
+    if paid:
+        invoice.payment_status = 'paid'
+        invoice.paid_amount = invoice.total_amount
+        invoice.remaining_amount = 0
+
+    # Reduce stock of each item (locked / version-checked) and freeze the cost of the issued goods
+    note = f'بيع مكتمل - فاتورة رقم {invoice.invoice_number}' if paid else f'بيع - فاتورة رقم {invoice.invoice_number}'
+    change_stock([StockChange(item.product_id, invoice.warehouse_id, -item.quantity) for item in invoice.items],
+                 reference_type='sales_invoice', reference_id=invoice.id, user_id=user_id, notes=note)
+    for item in invoice.items:
+        item.unit_cost = item.product.cost_price or 0
+
+    # Update customer balance (cash sales leave it unchanged)
+    if not paid:
+        invoice.customer.current_balance += invoice.total_amount
+
+    # Add the sale to the daily rollup
+    post_sales_invoice(invoice)
+
+    # Create accounting journal entry; an error is reported but does not fail the invoice
+    try:
+        return invoice, create_sales_invoice_journal_entry(invoice), None
+    except Exception as je:
+        return invoice, None, je
+
+def _flash_journal_entry(journal_entry, journal_error):
+    if journal_entry:
+        flash(_('Journal entry number %(number)s created', number=journal_entry.entry_number), 'info')
+    if journal_error is not None:
+        flash(_('Warning: Journal entry was not created: %(error)s', error=str(journal_error)), 'warning')
+
 @bp.route('/invoices/<int:id>/confirm', methods=['POST', 'GET'])
 @login_required
 @permission_required('sales.edit')
@@ -326,59 +354,12 @@ def confirm_invoice(id):
         return redirect(url_for('sales.invoice_details', id=id))
 
     try:
-        # Update invoice status
-        invoice.status = 'confirmed'
-
-        # Update stock for each item
-        for item in invoice.items:
-            # Get stock for this product in the warehouse
-            stock = Stock.query.filter_by(
-                product_id=item.product_id,
-                warehouse_id=invoice.warehouse_id
-            ).first()
-
-            if not stock:
-                flash(_('Product %(name)s not found in warehouse', name=item.product.name), 'error')
-                db.session.rollback()
-                return redirect(url_for('sales.invoice_details', id=id))
-
-            # Check if enough quantity available
-            if stock.quantity < item.quantity:
-                flash(_('Insufficient quantity of %(name)s available. Available: %(qty)s', name=item.product.name, qty=stock.quantity), 'error')
-                db.session.rollback()
-                return redirect(url_for('sales.invoice_details', id=id))
-
-            # Reduce stock quantity
-            stock.quantity -= item.quantity
-
-            # Create stock movement record
-            movement = StockMovement(
-                product_id=item.product_id,
-                warehouse_id=invoice.warehouse_id,
-                movement_type='out',
-                quantity=item.quantity,
-                reference_type='sales_invoice',
-                reference_id=invoice.id,
-                notes=f'بيع - فاتورة رقم {invoice.invoice_number}',
-                user_id=current_user.id
-            )
-            db.session.add(movement)
-
-        # Update customer balance
-        invoice.customer.current_balance += invoice.total_amount
-
-        # Create accounting journal entry
-        try:
-            journal_entry = create_sales_invoice_journal_entry(invoice)
-            if journal_entry:
-                flash(_('Journal entry number %(number)s created', number=journal_entry.entry_number), 'info')
-        except Exception as je:
-            # Log the error but don't fail the invoice confirmation
-            flash(_('Warning: Journal entry was not created: %(error)s', error=str(je)), 'warning')
-
-        db.session.commit()
+        invoice, journal_entry, journal_error = _post_invoice(id, current_user.id)
+        _flash_journal_entry(journal_entry, journal_error)
         flash(_('Invoice confirmed successfully'), 'success')
 
+    except InsufficientStock as e:
+        flash(str(e), 'error')
     except Exception as e:
         db.session.rollback()
         flash(_('An error occurred while confirming the invoice: %(error)s', error=str(e)), 'error')
@@ -397,71 +378,14 @@ def complete_sale(id):
         return redirect(url_for('sales.invoice_details', id=id))
 
     try:
-        print(f"=== Completing sale for invoice {invoice.invoice_number} ===")
-
-        # Update invoice status to confirmed
-        invoice.status = 'confirmed'
-        invoice.payment_status = 'paid'
-        invoice.paid_amount = invoice.total_amount
-        invoice.remaining_amount = 0
-
-        # Update stock for each item
-        for item in invoice.items:
-            print(f"Processing item: {item.product.name}, Quantity: {item.quantity}")
-
-            # Get stock for this product in the warehouse
-            stock = Stock.query.filter_by(
-                product_id=item.product_id,
-                warehouse_id=invoice.warehouse_id
-            ).first()
-
-            if not stock:
-                flash(_('Product %(name)s not found in warehouse', name=item.product.name), 'error')
-                db.session.rollback()
-                return redirect(url_for('sales.invoice_details', id=id))
-
-            # Check if enough quantity available
-            if stock.quantity < item.quantity:
-                flash(_('Insufficient quantity of %(name)s available. Available: %(qty)s',
-                       name=item.product.name, qty=stock.quantity), 'error')
-                db.session.rollback()
-                return redirect(url_for('sales.invoice_details', id=id))
-
-            # Reduce stock quantity
-            old_quantity = stock.quantity
-            stock.quantity -= item.quantity
-            print(f"Stock updated: {item.product.name} - Old: {old_quantity}, New: {stock.quantity}")
-
-            # Create stock movement record
-            movement = StockMovement(
-                product_id=item.product_id,
-                warehouse_id=invoice.warehouse_id,
-                movement_type='out',
-                quantity=item.quantity,
-                reference_type='sales_invoice',
-                reference_id=invoice.id,
-                notes=f'بيع مكتمل - فاتورة رقم {invoice.invoice_number}',
-                user_id=current_user.id
-            )
-            db.session.add(movement)
-
-        # Update customer balance (no balance since it's paid)
-        # Customer balance remains unchanged for cash sales
-
-        # Create accounting journal entry
-        try:
-            journal_entry = create_sales_invoice_journal_entry(invoice)
-            if journal_entry:
-                flash(_('Journal entry number %(number)s created', number=journal_entry.entry_number), 'info')
-        except Exception as je:
-            # Log the error but don't fail the sale completion
-            print(f"Journal entry error: {str(je)}")
-            flash(_('Warning: Journal entry was not created: %(error)s', error=str(je)), 'warning')
-
-        db.session.commit()
-        print(f"=== Sale completed successfully for invoice {invoice.invoice_number} ===")
+        invoice, journal_entry, journal_error = _post_invoice(id, current_user.id, paid=True)
+        if journal_error is not None:
+            print(f"Journal entry error: {str(journal_error)}")
+        _flash_journal_entry(journal_entry, journal_error)
         flash(_('Sale completed successfully! Invoice confirmed and marked as paid.'), 'success')
 
+    except InsufficientStock as e:
+        flash(str(e), 'error')
     except Exception as e:
         db.session.rollback()
         print(f"ERROR completing sale: {str(e)}")
@@ -471,6 +395,42 @@ def complete_sale(id):
 
     return redirect(url_for('sales.invoice_details', id=id))
 
+def _restore_invoice_stock(invoice, user_id, reference_type, notes):
+    """Put the stock of a posted invoice back and remove it from the customer balance and the rollup"""
+    change_stock([StockChange(item.product_id, invoice.warehouse_id, item.quantity) for item in invoice.items],
+                 reference_type=reference_type, reference_id=invoice.id, user_id=user_id, notes=notes)
+
+    # Update customer balance
+    invoice.customer.current_balance -= invoice.total_amount
+
+    # Remove the sale from the daily rollup
+    post_sales_invoice(invoice, sign=-1)
+
+@stock_transaction
+def _delete_invoice(id, user_id):
+    invoice = db.session.get(SalesInvoice, id)
+
+    # If invoice was confirmed or paid, restore stock and update customer balance
+    if invoice.status in ['confirmed', 'paid']:
+        _restore_invoice_stock(invoice, user_id, 'sales_invoice_delete',
+                               f'حذف فاتورة مبيعات رقم {invoice.invoice_number}')
+
+    # Delete invoice
+    db.session.delete(invoice)
+
+@stock_transaction
+def _cancel_invoice(id, user_id):
+    invoice = db.session.get(SalesInvoice, id)
+
+    # If invoice was confirmed, restore stock
+    if invoice.status == 'confirmed':
+        _restore_invoice_stock(invoice, user_id, 'sales_invoice_cancel',
+                               f'إلغاء بيع - فاتورة رقم {invoice.invoice_number}')
+
+    # Update invoice status
+    invoice.status = 'cancelled'
+    invoice.payment_status = 'unpaid'
+
 @bp.route('/invoices/<int:id>/delete', methods=['POST', 'GET'])
 @login_required
 @permission_required('sales.delete')
@@ -479,36 +439,7 @@ def delete_invoice(id):
     invoice = SalesInvoice.query.get_or_404(id)
 
     try:
-        # If invoice was confirmed or paid, restore stock and update customer balance
-        if invoice.status in ['confirmed', 'paid']:
-            for item in invoice.items:
-                stock = Stock.query.filter_by(
-                    product_id=item.product_id,
-                    warehouse_id=invoice.warehouse_id
-                ).first()
-
-                if stock:
-                    stock.quantity += item.quantity
-
-                    # Create stock movement record
-                    movement = StockMovement(
-                        product_id=item.product_id,
-                        warehouse_id=invoice.warehouse_id,
-                        movement_type='in',
-                        quantity=item.quantity,
-                        reference_type='sales_invoice_delete',
-                        reference_id=invoice.id,
-                        notes=f'حذف فاتورة مبيعات رقم {invoice.invoice_number}',
-                        user_id=current_user.id
-                    )
-                    db.session.add(movement)
-
-            # Update customer balance
-            invoice.customer.current_balance -= invoice.total_amount
-
-        # Delete invoice
-        db.session.delete(invoice)
-        db.session.commit()
+        _delete_invoice(id, current_user.id)
         flash(_('Invoice deleted successfully'), 'success')
     except Exception as e:
         db.session.rollback()
@@ -528,38 +459,7 @@ def cancel_invoice(id):
         return redirect(url_for('sales.invoice_details', id=id))
 
     try:
-        # If invoice was confirmed, restore stock
-        if invoice.status == 'confirmed':
-            for item in invoice.items:
-                stock = Stock.query.filter_by(
-                    product_id=item.product_id,
-                    warehouse_id=invoice.warehouse_id
-                ).first()
-
-                if stock:
-                    stock.quantity += item.quantity
-
-                    # Create stock movement record
-                    movement = StockMovement(
-                        product_id=item.product_id,
-                        warehouse_id=invoice.warehouse_id,
-                        movement_type='in',
-                        quantity=item.quantity,
-                        reference_type='sales_invoice_cancel',
-                        reference_id=invoice.id,
-                        notes=f'إلغاء بيع - فاتورة رقم {invoice.invoice_number}',
-                        user_id=current_user.id
-                    )
-                    db.session.add(movement)
-
-            # Update customer balance
-            invoice.customer.current_balance -= invoice.total_amount
-
-        # Update invoice status
-        invoice.status = 'cancelled'
-        invoice.payment_status = 'unpaid'
-
-        db.session.commit()
+        _cancel_invoice(id, current_user.id)
         flash(_('Invoice cancelled successfully'), 'success')
 
     except Exception as e:
@@ -687,31 +587,19 @@ def add_quotation():
         return redirect(url_for('sales.quotations'))
 
     customers = Customer.query.filter_by(is_active=True).all()
-    products_query = Product.query.filter_by(is_active=True, is_sellable=True).all()
-
-    # Convert products to dictionary for JSON serialization
-    products = [{
-        'id': p.id,
-        'name': p.name,
-        'code': p.code,
-        'selling_price': float(p.selling_price) if p.selling_price else 0,
-        'tax_rate': float(p.tax_rate) if p.tax_rate else 15
-    } for p in products_query]
 
     # Get today's date for default value
     from datetime import date
     today = date.today().strftime('%Y-%m-%d')
 
     # Get company settings for currency
-    from app.models import Company
     from flask import current_app
-    company = Company.query.first()
+    company = get_company()
     currency_code = company.currency if company else current_app.config.get('DEFAULT_CURRENCY', 'SAR')
     currency_symbol = current_app.config['CURRENCIES'].get(currency_code, {}).get('symbol', 'ر.س')
 
     return render_template('sales/add_quotation.html',
                          customers=customers,
-                         products=products,
                          today=today,
                          currency_code=currency_code,
                          currency_symbol=currency_symbol)
@@ -745,17 +633,7 @@ def convert_quotation_to_invoice(id):
 
     try:
         # Generate invoice number
-        today = datetime.utcnow()
-        prefix = f'INV{today.year}{today.month:02d}'
-        last_invoice = SalesInvoice.query.filter(
-            SalesInvoice.invoice_number.like(f'{prefix}%')
-        ).order_by(SalesInvoice.id.desc()).first()
-
-        if last_invoice:
-            last_num = int(last_invoice.invoice_number[-4:])
-            invoice_number = f'{prefix}{(last_num + 1):04d}'
-        else:
-            invoice_number = f'{prefix}0001'
+        invoice_number = next_document_number('INV', column=SalesInvoice.invoice_number)
 
         # Create invoice from quotation
         invoice = SalesInvoice(
@@ -5,6 +5,7 @@ from app import db
 from app.security import bp
 from app.models import SecurityLog, IPWhitelist, SessionLog, User
 from app.auth.decorators import admin_required, permission_required
+from app.utils.pagination_helper import keyset_paginate
 from datetime import datetime, timedelta
 from sqlalchemy import func, desc
 
@@ -57,7 +58,7 @@ def dashboard():
 @permission_required('security.view')
 def logs():
     """View security logs"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     event_type = request.args.get('event_type', '')
     severity = request.args.get('severity', '')
     
@@ -68,9 +69,7 @@ def logs():
     if severity:
         query = query.filter_by(severity=severity)
     
-    logs = query.order_by(desc(SecurityLog.created_at)).paginate(
-        page=page, per_page=50, error_out=False
-    )
+    logs = keyset_paginate(query, (SecurityLog.created_at, SecurityLog.id), cursor, per_page=50)
     
     return render_template('security/logs.html', logs=logs)
 
@@ -7,6 +7,9 @@ from app.models import Company, Branch, User, Role, Permission, RolePermission
 from app.models_settings import AccountingSettings
 from app.models_accounting import Account, BankAccount
 from app.auth.decorators import admin_required, permission_required, any_permission_required
+from app.utils.settings_helper import invalidate_settings_cache
+from app.utils.permission_helper import bump_role_permissions_version, forget_role_permissions
+from sqlalchemy.orm import selectinload
 import os
 from werkzeug.utils import secure_filename
 
@@ -66,6 +69,7 @@ def update_company():
                 company.logo = filename
 
         db.session.commit()
+        invalidate_settings_cache()
         flash('تم تحديث بيانات الشركة بنجاح', 'success')
     except Exception as e:
         db.session.rollback()
@@ -96,6 +100,7 @@ def create_company():
 
         db.session.add(company)
         db.session.commit()
+        invalidate_settings_cache()
         flash('تم إنشاء بيانات الشركة بنجاح', 'success')
     except Exception as e:
         db.session.rollback()
@@ -133,6 +138,7 @@ def update_invoice_template():
 
         company.invoice_template = template
         db.session.commit()
+        invalidate_settings_cache()
 
         template_names = {
             'modern': 'عصري (Modern)',
@@ -368,7 +374,7 @@ def get_user_permissions(id):
 @permission_required('settings.roles.view')
 def roles():
     """Roles management"""
-    roles = Role.query.all()
+    roles = Role.query.options(selectinload(Role.permissions)).all()
     permissions = Permission.query.all()
     return render_template('settings/roles.html', roles=roles, permissions=permissions)
 
@@ -413,6 +419,7 @@ def edit_role(id):
 
         role.name_ar = request.form.get('name_ar')
         role.description = request.form.get('description')
+        bump_role_permissions_version(role)
 
         db.session.commit()
         flash('تم تحديث الدور بنجاح', 'success')
@@ -437,6 +444,7 @@ def delete_role(id):
 
         db.session.delete(role)
         db.session.commit()
+        forget_role_permissions(id)
         flash('تم حذف الدور بنجاح', 'success')
     except Exception as e:
         db.session.rollback()
@@ -466,6 +474,7 @@ def update_role_permissions(id):
             )
             db.session.add(role_permission)
 
+        bump_role_permissions_version(role)
         db.session.commit()
         flash('تم تحديث صلاحيات الدور بنجاح', 'success')
     except Exception as e:
@@ -648,6 +657,7 @@ def save_accounting_settings():
         settings.auto_post_journal_entries = 'auto_post_journal_entries' in request.form
 
         db.session.commit()
+        invalidate_settings_cache()
         flash('تم حفظ إعدادات الحسابات المحاسبية بنجاح', 'success')
 
     except Exception as e:
@@ -683,6 +693,7 @@ def save_tax_settings():
         company.tax_number = tax_number
 
         db.session.commit()
+        invalidate_settings_cache()
         flash('تم حفظ إعدادات الضرائب بنجاح', 'success')
 
     except Exception as e:
@@ -0,0 +1,165 @@
+/**
+ * POS offline queue
+ * طابور الطلبات المحلي لنقطة البيع
+ *
+ * Completed sales are written to localStorage first and synced to
+ * /pos/sync-orders in batches, so the till keeps selling while the
+ * network (or the portable USB server) is unavailable. Every order
+ * carries a client-generated UUID, which makes resending a batch safe.
+ */
+(function (window) {
+    'use strict';
+
+    const QUEUE_KEY = 'posOrderQueue';
+    const REJECTED_KEY = 'posRejectedOrders';
+    const SYNC_URL = '/pos/sync-orders';
+    const BATCH_SIZE = 50;
+    const SYNC_INTERVAL_MS = 15000;
+
+    let syncing = false;
+    const listeners = [];
+
+    function load(key) {
+        try {
+            return JSON.parse(localStorage.getItem(key) || '[]');
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function save(key, value) {
+        localStorage.setItem(key, JSON.stringify(value));
+    }
+
+    function uuid() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        // Fallback for older browsers (RFC 4122 version 4 layout)
+        return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function (c) {
+            const r = Math.random() * 16 | 0;
+            return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+        });
+    }
+
+    function notify(event) {
+        const state = {
+            pending: load(QUEUE_KEY).length,
+            rejected: load(REJECTED_KEY).length,
+            online: navigator.onLine
+        };
+        listeners.forEach(listener => listener(state, event || {}));
+    }
+
+    /**
+     * Add a completed sale to the local queue and return its client UUID.
+     * The server treats sales that reach it well after order_date as
+     * offline sales (booked even if stock goes negative).
+     */
+    function enqueue(orderData) {
+        const order = Object.assign({}, orderData, {
+            client_uuid: orderData.client_uuid || uuid(),
+            order_date: orderData.order_date || new Date().toISOString()
+        });
+        const queue = load(QUEUE_KEY);
+        queue.push(order);
+        save(QUEUE_KEY, queue);
+        notify();
+        return order.client_uuid;
+    }
+
+    /** Move a rejected sale back to the queue (sent with the next flush) */
+    function retryRejected(clientUuid) {
+        const rejected = load(REJECTED_KEY);
+        const order = rejected.find(item => item.client_uuid === clientUuid);
+        if (!order) {
+            return;
+        }
+        save(REJECTED_KEY, rejected.filter(item => item.client_uuid !== clientUuid));
+        const retried = Object.assign({}, order);
+        delete retried.error;
+        const queue = load(QUEUE_KEY);
+        queue.push(retried);
+        save(QUEUE_KEY, queue);
+        notify();
+    }
+
+    /** Drop a rejected sale for good */
+    function discardRejected(clientUuid) {
+        save(REJECTED_KEY, load(REJECTED_KEY).filter(item => item.client_uuid !== clientUuid));
+        notify();
+    }
+
+    function removeFromQueue(clientUuids) {
+        const done = new Set(clientUuids);
+        save(QUEUE_KEY, load(QUEUE_KEY).filter(order => !done.has(order.client_uuid)));
+    }
+
+    /**
+     * Send queued orders in batches until the queue is empty or the
+     * server is unreachable. Resolves to a map of client UUID -> result.
+     */
+    async function flush() {
+        if (syncing || !navigator.onLine) {
+            return {};
+        }
+        syncing = true;
+        const synced = {};
+
+        try {
+            let queue = load(QUEUE_KEY);
+            while (queue.length) {
+                const batch = queue.slice(0, BATCH_SIZE);
+                const response = await fetch(SYNC_URL, {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({orders: batch})
+                });
+
+                if (response.status >= 500 || response.status === 0) {
+                    break;  // Server unavailable, keep the queue for the next attempt
+                }
+                if (response.redirected || response.status === 401 || response.status === 403) {
+                    break;  // Session expired, the cashier has to sign in again
+                }
+
+                const result = await response.json();
+                if (result.success) {
+                    result.results.forEach(item => { synced[item.client_uuid] = item; });
+                    removeFromQueue(batch.map(order => order.client_uuid));
+                } else if (result.failed_client_uuid) {
+                    // Set the rejected order aside for review and resend the rest
+                    const rejected = load(REJECTED_KEY);
+                    const failed = batch.find(order => order.client_uuid === result.failed_client_uuid);
+                    rejected.push(Object.assign({}, failed, {error: result.message}));
+                    save(REJECTED_KEY, rejected);
+                    removeFromQueue([result.failed_client_uuid]);
+                    notify({rejected: failed, message: result.message});
+                } else {
+                    break;
+                }
+                queue = load(QUEUE_KEY);
+            }
+        } catch (error) {
+            console.warn('POS sync postponed:', error);
+        } finally {
+            syncing = false;
+            notify({synced: synced});
+        }
+        return synced;
+    }
+
+    window.addEventListener('online', () => { notify(); flush(); });
+    window.addEventListener('offline', () => notify());
+    setInterval(flush, SYNC_INTERVAL_MS);
+
+    window.POSOffline = {
+        enqueue: enqueue,
+        flush: flush,
+        pending: () => load(QUEUE_KEY).length,
+        rejected: () => load(REJECTED_KEY),
+        retryRejected: retryRejected,
+        discardRejected: discardRejected,
+        onChange: listener => { listeners.push(listener); notify(); }
+    };
+})(window);
@@ -0,0 +1,103 @@
+/**
+ * Product catalogue cache
+ * نسخة محلية من قائمة المنتجات
+ *
+ * Keeps the last snapshot of /inventory/api/catalogue in localStorage and
+ * refreshes it with a conditional delta request, so product lists are
+ * built from the browser copy instead of being embedded in every page.
+ * When the server cannot be reached the stored copy is used as is.
+ */
+(function (window) {
+    'use strict';
+
+    const CATALOGUE_URL = '/inventory/api/catalogue';
+    const KEY_PREFIX = 'productCatalogue.';
+
+    function load(scope) {
+        try {
+            return JSON.parse(localStorage.getItem(KEY_PREFIX + scope) || 'null');
+        } catch (e) {
+            return null;
+        }
+    }
+
+    function save(scope, cache) {
+        try {
+            localStorage.setItem(KEY_PREFIX + scope, JSON.stringify(cache));
+        } catch (e) {
+            console.warn('Product catalogue not stored locally:', e);
+        }
+    }
+
+    function toList(cache) {
+        return cache ? Object.values(cache.products) : [];
+    }
+
+    /** Merge a columnar full/delta payload into the stored copy */
+    function apply(cache, payload) {
+        const products = (payload.mode === 'delta' && cache) ? cache.products : {};
+        payload.removed.forEach(id => { delete products[id]; });
+
+        const rows = payload.values.length ? payload.values[0].length : 0;
+        for (let i = 0; i < rows; i++) {
+            const product = {};
+            payload.columns.forEach((column, j) => { product[column] = payload.values[j][i]; });
+            products[product.id] = product;
+        }
+        return {version: payload.version, count: payload.count, products: products};
+    }
+
+    async function request(scope, cache) {
+        const params = new URLSearchParams({scope: scope});
+        const headers = {};
+        if (cache) {
+            params.set('since', cache.version);
+            headers['If-None-Match'] = `W/"${scope}-${cache.version}"`;
+        }
+
+        const response = await fetch(`${CATALOGUE_URL}?${params}`, {headers: headers, credentials: 'same-origin'});
+        if (response.status === 304) {
+            return cache;
+        }
+        if (!response.ok || response.redirected) {
+            throw new Error(`Catalogue request failed (${response.status})`);
+        }
+        return apply(cache, await response.json());
+    }
+
+    /**
+     * Get the product list of a scope ('sales' or 'purchases'), brought up
+     * to date with the server. Resolves to [{id, code, barcode, name, price, tax, image}]
+     */
+    async function fetchCatalogue(scope) {
+        scope = scope || 'sales';
+        const cached = load(scope);
+
+        try {
+            let cache = await request(scope, cached);
+            if (Object.keys(cache.products).length !== cache.count) {
+                // Products were deleted outright; start again from a full snapshot
+                cache = await request(scope, null);
+            }
+            if (cache !== cached) {
+                save(scope, cache);
+            }
+            return toList(cache);
+        } catch (error) {
+            console.warn('Using the stored product catalogue:', error);
+            return toList(cached);
+        }
+    }
+
+    function escapeHtml(value) {
+        return String(value === null || value === undefined ? '' : value)
+            .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+    }
+
+    window.ProductCatalogue = {
+        load: fetchCatalogue,
+        cached: scope => toList(load(scope || 'sales')),
+        escape: escapeHtml
+    };
+})(window);
@@ -5,8 +5,10 @@ Functions to automatically create journal entries for various transactions
 
 from app import db
 from app.models_accounting import JournalEntry, JournalEntryItem
-from app.models_settings import AccountingSettings
-from datetime import datetime
+from app.utils.settings_helper import get_accounting_settings
+from app.utils.sequence_helper import next_document_number
+from app.utils.balance_helper import post_entry_balances
+from app.utils.cost_center_helper import default_cost_center_id
 
 def create_sales_invoice_journal_entry(invoice):
     """
@@ -16,7 +18,7 @@ def create_sales_invoice_journal_entry(invoice):
     Credit: Sales Revenue
     Credit: Sales Tax Payable
     """
-    settings = AccountingSettings.query.first()
+    settings = get_accounting_settings()
     
     if not settings or not settings.auto_create_journal_entries:
         return None
@@ -26,17 +28,7 @@ def create_sales_invoice_journal_entry(invoice):
         raise ValueError('إعدادات الحسابات المحاسبية غير مكتملة')
     
     # Generate entry number
-    today = datetime.utcnow()
-    prefix = f'JE{today.year}{today.month:02d}'
-    last_entry = JournalEntry.query.filter(
-        JournalEntry.entry_number.like(f'{prefix}%')
-    ).order_by(JournalEntry.id.desc()).first()
-    
-    if last_entry:
-        last_num = int(last_entry.entry_number[-4:])
-        entry_number = f'{prefix}{(last_num + 1):04d}'
-    else:
-        entry_number = f'{prefix}0001'
+    entry_number = next_document_number('JE', column=JournalEntry.entry_number)
     
     # Create journal entry
     entry = JournalEntry(
@@ -54,9 +46,13 @@ def create_sales_invoice_journal_entry(invoice):
     db.session.add(entry)
     db.session.flush()
     
+    # Lines are charged to the cost center of the invoice's warehouse / branch
+    cost_center_id = default_cost_center_id(warehouse_id=invoice.warehouse_id)
+    
     # Debit: Accounts Receivable
     debit_item = JournalEntryItem(
         journal_entry_id=entry.id,
+        cost_center_id=cost_center_id,
         account_id=settings.accounts_receivable_account_id,
         description=f'مبيعات للعميل: {invoice.customer.name}',
         debit=invoice.total_amount,
@@ -67,6 +63,7 @@ def create_sales_invoice_journal_entry(invoice):
     # Credit: Sales Revenue
     credit_revenue = JournalEntryItem(
         journal_entry_id=entry.id,
+        cost_center_id=cost_center_id,
         account_id=settings.sales_revenue_account_id,
         description=f'إيرادات مبيعات - فاتورة {invoice.invoice_number}',
         debit=0,
@@ -78,6 +75,7 @@ def create_sales_invoice_journal_entry(invoice):
     if invoice.tax_amount > 0 and settings.sales_tax_account_id:
         credit_tax = JournalEntryItem(
             journal_entry_id=entry.id,
+            cost_center_id=cost_center_id,
             account_id=settings.sales_tax_account_id,
             description=f'ضريبة مبيعات - فاتورة {invoice.invoice_number}',
             debit=0,
@@ -99,7 +97,7 @@ def create_purchase_invoice_journal_entry(invoice):
     Debit: Purchase Tax (if applicable)
     Credit: Accounts Payable (Supplier)
     """
-    settings = AccountingSettings.query.first()
+    settings = get_accounting_settings()
     
     if not settings or not settings.auto_create_journal_entries:
         return None
@@ -109,17 +107,7 @@ def create_purchase_invoice_journal_entry(invoice):
         raise ValueError('إعدادات الحسابات المحاسبية غير مكتملة')
     
     # Generate entry number
-    today = datetime.utcnow()
-    prefix = f'JE{today.year}{today.month:02d}'
-    last_entry = JournalEntry.query.filter(
-        JournalEntry.entry_number.like(f'{prefix}%')
-    ).order_by(JournalEntry.id.desc()).first()
-    
-    if last_entry:
-        last_num = int(last_entry.entry_number[-4:])
-        entry_number = f'{prefix}{(last_num + 1):04d}'
-    else:
-        entry_number = f'{prefix}0001'
+    entry_number = next_document_number('JE', column=JournalEntry.entry_number)
     
     # Create journal entry
     entry = JournalEntry(
@@ -137,9 +125,13 @@ def create_purchase_invoice_journal_entry(invoice):
     db.session.add(entry)
     db.session.flush()
     
+    # Lines are charged to the cost center of the invoice's warehouse / branch
+    cost_center_id = default_cost_center_id(warehouse_id=invoice.warehouse_id)
+    
     # Debit: Purchase Expense
     debit_expense = JournalEntryItem(
         journal_entry_id=entry.id,
+        cost_center_id=cost_center_id,
         account_id=settings.purchase_expense_account_id,
         description=f'مشتريات من المورد: {invoice.supplier.name}',
         debit=invoice.subtotal,
@@ -151,6 +143,7 @@ def create_purchase_invoice_journal_entry(invoice):
     if invoice.tax_amount > 0 and settings.purchase_tax_account_id:
         debit_tax = JournalEntryItem(
             journal_entry_id=entry.id,
+            cost_center_id=cost_center_id,
             account_id=settings.purchase_tax_account_id,
             description=f'ضريبة مشتريات - فاتورة {invoice.invoice_number}',
             debit=invoice.tax_amount,
@@ -161,6 +154,7 @@ def create_purchase_invoice_journal_entry(invoice):
     # Credit: Accounts Payable
     credit_payable = JournalEntryItem(
         journal_entry_id=entry.id,
+        cost_center_id=cost_center_id,
         account_id=settings.accounts_payable_account_id,
         description=f'مستحق للمورد: {invoice.supplier.name}',
         debit=0,
@@ -186,23 +180,13 @@ def create_payment_journal_entry(payment):
     Debit: Cash/Bank
     Credit: Accounts Receivable
     """
-    settings = AccountingSettings.query.first()
+    settings = get_accounting_settings()
 
     if not settings or not settings.auto_create_journal_entries:
         return None
 
     # Generate entry number
-    today = datetime.utcnow()
-    prefix = f'JE{today.year}{today.month:02d}'
-    last_entry = JournalEntry.query.filter(
-        JournalEntry.entry_number.like(f'{prefix}%')
-    ).order_by(JournalEntry.id.desc()).first()
-
-    if last_entry:
-        last_num = int(last_entry.entry_number[-4:])
-        entry_number = f'{prefix}{(last_num + 1):04d}'
-    else:
-        entry_number = f'{prefix}0001'
+    entry_number = next_document_number('JE', column=JournalEntry.entry_number)
 
     # Determine cash/bank account
     cash_account_id = payment.bank_account.account_id if payment.bank_account else settings.cash_account_id
@@ -223,11 +207,15 @@ def create_payment_journal_entry(payment):
     db.session.add(entry)
     db.session.flush()
 
+    # Lines are charged to the cost center of the branch of the user recording the payment
+    cost_center_id = default_cost_center_id(branch_id=payment.user.branch_id if payment.user else None)
+
     if payment.payment_type == 'receipt':
         # Receipt from customer
         # Debit: Cash/Bank
         debit_cash = JournalEntryItem(
             journal_entry_id=entry.id,
+            cost_center_id=cost_center_id,
             account_id=cash_account_id,
             description=f'تحصيل من العميل',
             debit=payment.amount,
@@ -238,6 +226,7 @@ def create_payment_journal_entry(payment):
         # Credit: Accounts Receivable
         credit_receivable = JournalEntryItem(
             journal_entry_id=entry.id,
+            cost_center_id=cost_center_id,
             account_id=settings.accounts_receivable_account_id,
             description=f'تحصيل من العميل',
             debit=0,
@@ -250,6 +239,7 @@ def create_payment_journal_entry(payment):
         # Debit: Accounts Payable
         debit_payable = JournalEntryItem(
             journal_entry_id=entry.id,
+            cost_center_id=cost_center_id,
             account_id=settings.accounts_payable_account_id,
             description=f'دفع للمورد',
             debit=payment.amount,
@@ -260,6 +250,7 @@ def create_payment_journal_entry(payment):
         # Credit: Cash/Bank
         credit_cash = JournalEntryItem(
             journal_entry_id=entry.id,
+            cost_center_id=cost_center_id,
             account_id=cash_account_id,
             description=f'دفع للمورد',
             debit=0,
@@ -274,19 +265,5 @@ def create_payment_journal_entry(payment):
     return entry
 
 def update_account_balances(entry):
-    """Update account balances after posting journal entry"""
-    from app.models_accounting import Account
-
-    for item in entry.items:
-        account = Account.query.get(item.account_id)
-        if account:
-            account.debit_balance += item.debit
-            account.credit_balance += item.credit
-
-            # Calculate current balance based on account type
-            if account.account_type in ['asset', 'expense']:
-                account.current_balance = account.debit_balance - account.credit_balance
-            else:  # liability, equity, revenue
-                account.current_balance = account.credit_balance - account.debit_balance
-
-
+    """Update account balances and monthly snapshots after posting journal entry"""
+    post_entry_balances(entry)
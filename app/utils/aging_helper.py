@@ -0,0 +1,148 @@
+"""
+Aging Helper Functions
+Receivables/payables aging of open sales and purchase invoices
+
+An invoice is open while it is confirmed, not fully paid and has a
+remaining amount. It is due payment_terms days (of its customer or
+supplier) after the invoice date, and its remaining amount is put in a
+bucket by the number of days it is past due as of the report date (not
+yet due counts as current). Each report is one grouped query with a CASE
+expression per bucket over the (status, payment_status, invoice_date)
+index, so it does not load invoices.
+"""
+
+from collections import namedtuple
+from datetime import date, timedelta
+from sqlalchemy import func, case, cast, literal, Date, Integer
+from app import db
+from app.models_sales import Customer, SalesInvoice
+from app.models_purchases import Supplier, PurchaseInvoice
+
+AGING_TYPES = ('receivables', 'payables')
+
+# (key, first day past due, last day past due) - keys match the report columns
+AGING_BUCKETS = (
+    ('current', None, 30),
+    ('days_31_60', 31, 60),
+    ('days_61_90', 61, 90),
+    ('days_91_120', 91, 120),
+    ('over_120', 121, None),
+)
+BUCKET_KEYS = tuple(bucket[0] for bucket in AGING_BUCKETS)
+
+OPEN_STATUS = 'confirmed'
+OPEN_PAYMENT_STATUSES = ('unpaid', 'partial')
+
+# Open invoice of an aging detail
+AgingInvoice = namedtuple('AgingInvoice', [
+    'id', 'invoice_number', 'invoice_date', 'due_date', 'days_overdue',
+    'total_amount', 'remaining_amount', 'bucket'
+])
+
+
+def get_aging(report_type='receivables', as_of=None):
+    """
+    Open balances per customer (receivables) or supplier (payables) by age
+
+    Args:
+        report_type: 'receivables' or 'payables'
+        as_of: Report date (today by default); later invoices are ignored
+
+    Returns:
+        tuple: (rows, totals) where rows are dicts with id, code, name,
+            invoice_count, total and one key per bucket ordered by name,
+            and totals holds total and the bucket sums
+    """
+    as_of = as_of or date.today()
+    invoice, party = _models(report_type)
+    days_overdue = _days_overdue(invoice, party, as_of)
+    amount = func.coalesce(invoice.remaining_amount, 0)
+
+    bucket_sums = [func.coalesce(func.sum(case((condition, amount), else_=0)), 0).label(key)
+                   for key, condition in _bucket_conditions(days_overdue)]
+    query = db.session.query(
+        party.id, party.code, party.name,
+        func.count(invoice.id).label('invoice_count'),
+        func.coalesce(func.sum(amount), 0).label('total'),
+        *bucket_sums
+    ).join(party, party.id == _party_column(invoice))
+    query = _open_invoices(query, invoice, as_of).group_by(party.id, party.code, party.name).order_by(party.name)
+
+    rows = [row._asdict() for row in query]
+    totals = {key: sum(row[key] for row in rows) for key in ('total',) + BUCKET_KEYS}
+    return rows, totals
+
+
+def get_aging_invoices(report_type, party_id, as_of=None, limit=None):
+    """
+    Open invoices of one customer or supplier, oldest due first
+
+    Returns:
+        list: AgingInvoice tuples
+    """
+    as_of = as_of or date.today()
+    invoice, party = _models(report_type)
+    days_overdue = _days_overdue(invoice, party, as_of)
+    bucket = case(*[(condition, key) for key, condition in _bucket_conditions(days_overdue)])
+
+    query = db.session.query(
+        invoice.id, invoice.invoice_number, invoice.invoice_date,
+        func.coalesce(party.payment_terms, 0), days_overdue,
+        invoice.total_amount, invoice.remaining_amount, bucket
+    ).join(party, party.id == _party_column(invoice)).filter(_party_column(invoice) == party_id)
+    query = _open_invoices(query, invoice, as_of).order_by(days_overdue.desc(), invoice.id)
+    if limit:
+        query = query.limit(limit)
+
+    return [AgingInvoice(row[0], row[1], row[2], row[2] + timedelta(days=int(row[3])), int(row[4]),
+                         row[5] or 0, row[6] or 0, row[7])
+            for row in query]
+
+
+def _models(report_type):
+    if report_type not in AGING_TYPES:
+        raise ValueError(f'Unknown aging report type: {report_type}')
+    return (SalesInvoice, Customer) if report_type == 'receivables' else (PurchaseInvoice, Supplier)
+
+
+def _party_column(invoice):
+    return invoice.customer_id if invoice is SalesInvoice else invoice.supplier_id
+
+
+def _open_invoices(query, invoice, as_of):
+    """Filter on open invoices dated up to as_of (matches the aging index)"""
+    return query.filter(
+        invoice.status == OPEN_STATUS,
+        invoice.payment_status.in_(OPEN_PAYMENT_STATUSES),
+        invoice.invoice_date <= as_of,
+        invoice.remaining_amount > 0
+    )
+
+
+def _days_overdue(invoice, party, as_of):
+    """SQL expression: days between the due date and as_of (negative when not yet due)"""
+    return _days_between(invoice.invoice_date, as_of) - func.coalesce(party.payment_terms, 0)
+
+
+def _days_between(column, as_of):
+    """Whole days from a date column to a date, in the current database's dialect"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return cast(func.julianday(as_of.isoformat()) - func.julianday(column), Integer)
+    if dialect == 'postgresql':
+        return literal(as_of, Date) - column
+    return func.datediff(as_of, column)
+
+
+def _bucket_conditions(days_overdue):
+    """(key, condition) per bucket, for CASE expressions"""
+    conditions = []
+    for key, first, last in AGING_BUCKETS:
+        if first is None:
+            condition = days_overdue <= last
+        elif last is None:
+            condition = days_overdue >= first
+        else:
+            condition = days_overdue.between(first, last)
+        conditions.append((key, condition))
+    return conditions
@@ -0,0 +1,350 @@
+"""
+Balance Helper Functions
+Account balance engine: per-account monthly debit/credit snapshots kept up
+to date when journal entries are posted, and balance queries built on them
+
+Balances as of a date are the snapshots of the months before that date's
+month plus the posted lines of that month up to the date, so no query has
+to scan the whole journal_entry_items history. The debit_balance,
+credit_balance and current_balance columns of Account keep the all-time
+totals for the screens that show them.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func, case, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models_accounting import Account, JournalEntry, JournalEntryItem, AccountPeriodBalance
+from app.utils.pagination_helper import keyset_paginate
+from app.utils.job_helper import job_handler
+
+# Account types whose balance is debit minus credit
+DEBIT_NATURE_TYPES = ('asset', 'expense')
+
+# Account with its balance over a period; attribute names match Account so
+# templates can render either
+AccountBalance = namedtuple('AccountBalance', [
+    'id', 'code', 'name', 'name_en', 'account_type', 'parent_id',
+    'debit_balance', 'credit_balance', 'current_balance'
+])
+
+# Statement of one account over a date window; balances are debit - credit
+# and lines is a KeysetPagination of statement rows
+AccountStatement = namedtuple('AccountStatement', [
+    'opening_balance', 'total_debit', 'total_credit', 'closing_balance', 'lines'
+])
+
+
+def post_entry_balances(entry, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) a posted journal entry from the
+    monthly snapshots and the account totals, in the current transaction
+
+    Args:
+        entry: JournalEntry whose lines are already added to the session
+        sign: 1 when posting, -1 when reversing
+    """
+    totals = db.session.query(
+        JournalEntryItem.account_id,
+        func.coalesce(func.sum(JournalEntryItem.debit), 0),
+        func.coalesce(func.sum(JournalEntryItem.credit), 0)
+    ).filter(JournalEntryItem.journal_entry_id == entry.id).group_by(JournalEntryItem.account_id).all()
+
+    period = month_start(entry.entry_date)
+    rows = [{'account_id': account_id, 'period_start': period,
+             'debit': sign * debit, 'credit': sign * credit}
+            for account_id, debit, credit in totals]
+    _apply_snapshot_rows(rows)
+    _apply_account_totals(rows)
+
+
+def rebuild_account_balances():
+    """
+    Recompute the snapshots and the account totals from all posted journal
+    lines (initial backfill or repair). Runs in the caller's transaction.
+
+    Returns:
+        int: Number of snapshot rows written
+    """
+    db.session.query(AccountPeriodBalance).delete(synchronize_session=False)
+
+    # Grouped by day in SQL (portable), folded into months here
+    daily = db.session.query(
+        JournalEntryItem.account_id, JournalEntry.entry_date,
+        func.coalesce(func.sum(JournalEntryItem.debit), 0),
+        func.coalesce(func.sum(JournalEntryItem.credit), 0)
+    ).join(JournalEntry).filter(
+        JournalEntry.status == 'posted'
+    ).group_by(JournalEntryItem.account_id, JournalEntry.entry_date).yield_per(5000)
+
+    snapshots = {}
+    for account_id, entry_date, debit, credit in daily:
+        key = (account_id, month_start(entry_date))
+        row = snapshots.get(key)
+        if row is None:
+            snapshots[key] = row = {'account_id': key[0], 'period_start': key[1], 'debit': 0, 'credit': 0}
+        row['debit'] += debit
+        row['credit'] += credit
+
+    rows = list(snapshots.values())
+    if rows:
+        db.session.execute(AccountPeriodBalance.__table__.insert(), rows)
+
+    db.session.execute(Account.__table__.update().values(debit_balance=0, credit_balance=0, current_balance=0))
+    totals = {}
+    for row in rows:
+        total = totals.setdefault(row['account_id'], {'account_id': row['account_id'], 'debit': 0, 'credit': 0})
+        total['debit'] += row['debit']
+        total['credit'] += row['credit']
+    _apply_account_totals(list(totals.values()))
+    return len(rows)
+
+
+@job_handler('accounting.rebuild_account_balances')
+def rebuild_account_balances_job(job):
+    return {'rows': rebuild_account_balances()}
+
+
+def account_balances_need_backfill():
+    """True when posted journal entries exist but no snapshot has been written yet"""
+    if db.session.query(AccountPeriodBalance.id).first() is not None:
+        return False
+    return db.session.query(JournalEntry.id).filter(JournalEntry.status == 'posted').first() is not None
+
+
+# Queries
+
+def get_account_totals(as_of=None, start_date=None, account_ids=None):
+    """
+    Debit and credit totals per account of the posted lines dated in
+    [start_date, as_of] (either bound may be None)
+
+    Returns:
+        dict: account_id -> (debit, credit)
+    """
+    totals = _totals_until(as_of, account_ids)
+    if start_date is not None:
+        for account_id, (debit, credit) in _totals_until(start_date - timedelta(days=1), account_ids).items():
+            current_debit, current_credit = totals.get(account_id, (0, 0))
+            totals[account_id] = (current_debit - debit, current_credit - credit)
+    return totals
+
+
+def get_account_balances(as_of=None, start_date=None, account_type=None, active_only=True):
+    """
+    Accounts with their debit/credit totals and balance over a period
+
+    Args:
+        as_of: Last date included (None for all posted lines)
+        start_date: First date included (None for everything before as_of),
+            e.g. the start of the period of an income statement
+        account_type: Restrict to one account type
+        active_only: Skip inactive accounts
+
+    Returns:
+        list: AccountBalance tuples ordered by account code
+    """
+    query = db.session.query(Account.id, Account.code, Account.name, Account.name_en,
+                             Account.account_type, Account.parent_id)
+    if active_only:
+        query = query.filter(Account.is_active.is_(True))
+    if account_type:
+        query = query.filter(Account.account_type == account_type)
+    accounts = query.order_by(Account.code).all()
+
+    totals = get_account_totals(as_of, start_date)
+    balances = []
+    for account in accounts:
+        debit, credit = totals.get(account.id, (0, 0))
+        balance = debit - credit if account.account_type in DEBIT_NATURE_TYPES else credit - debit
+        balances.append(AccountBalance(*account, debit, credit, balance))
+    return balances
+
+
+def get_monthly_account_totals(start_date, end_date=None, account_type=None):
+    """
+    Debit/credit totals per month for whole months, read from the snapshots only
+
+    Returns:
+        dict: (year, month) -> (debit, credit)
+    """
+    query = db.session.query(
+        AccountPeriodBalance.period_start,
+        func.sum(AccountPeriodBalance.debit),
+        func.sum(AccountPeriodBalance.credit)
+    ).filter(AccountPeriodBalance.period_start >= month_start(start_date))
+    if end_date is not None:
+        query = query.filter(AccountPeriodBalance.period_start <= month_start(end_date))
+    if account_type:
+        query = query.join(Account).filter(Account.account_type == account_type)
+    return {(row[0].year, row[0].month): (row[1] or 0, row[2] or 0)
+            for row in query.group_by(AccountPeriodBalance.period_start)}
+
+
+def get_opening_balance(account_id, start_date):
+    """Balance (debit - credit) of an account before start_date (0 without a start date)"""
+    if start_date is None:
+        return 0
+    debit, credit = _totals_until(start_date - timedelta(days=1), [account_id]).get(account_id, (0, 0))
+    return debit - credit
+
+
+def statement_lines_query(account_id, start_date=None, end_date=None):
+    """
+    Column query of the posted lines of an account in a date window
+    (entry_date, journal_entry_id, id, entry_number, description, debit,
+    credit), unordered
+    """
+    query = db.session.query(
+        JournalEntry.entry_date,
+        JournalEntry.id.label('journal_entry_id'),
+        JournalEntryItem.id,
+        JournalEntry.entry_number,
+        func.coalesce(func.nullif(JournalEntryItem.description, ''), JournalEntry.description).label('description'),
+        func.coalesce(JournalEntryItem.debit, 0).label('debit'),
+        func.coalesce(JournalEntryItem.credit, 0).label('credit')
+    ).join(JournalEntry, JournalEntry.id == JournalEntryItem.journal_entry_id).filter(
+        JournalEntryItem.account_id == account_id,
+        JournalEntry.status == 'posted'
+    )
+    if start_date is not None:
+        query = query.filter(JournalEntry.entry_date >= start_date)
+    if end_date is not None:
+        query = query.filter(JournalEntry.entry_date <= end_date)
+    return query
+
+
+def get_account_statement(account_id, start_date=None, end_date=None, cursor=None, per_page=50):
+    """
+    One page of an account statement
+
+    The opening balance comes from the monthly snapshots, the window totals
+    from one aggregate, and each line's running balance from a SUM() OVER
+    the lines of the window, so a page costs the same however long the
+    account's history is.
+
+    Args:
+        account_id: Account
+        start_date: First date of the window (None for the whole history)
+        end_date: Last date of the window (None for no limit)
+        cursor: Keyset cursor of the page (None for the first page)
+        per_page: Lines per page
+
+    Returns:
+        AccountStatement: lines are rows of statement_lines_query plus balance
+    """
+    opening_balance = get_opening_balance(account_id, start_date)
+    lines = statement_lines_query(account_id, start_date, end_date)
+
+    total_debit, total_credit, line_count = lines.with_entities(
+        func.coalesce(func.sum(JournalEntryItem.debit), 0),
+        func.coalesce(func.sum(JournalEntryItem.credit), 0),
+        func.count(JournalEntryItem.id)
+    ).one()
+
+    balance = opening_balance + func.sum(
+        func.coalesce(JournalEntryItem.debit, 0) - func.coalesce(JournalEntryItem.credit, 0)
+    ).over(order_by=(JournalEntry.entry_date, JournalEntry.id, JournalEntryItem.id), rows=(None, 0))
+    statement = lines.add_columns(balance.label('balance')).subquery()
+
+    page = keyset_paginate(db.session.query(statement),
+                           (statement.c.entry_date, statement.c.journal_entry_id, statement.c.id),
+                           cursor, per_page=per_page, descending=False, count=False)
+    page.total = line_count
+
+    return AccountStatement(opening_balance, total_debit, total_credit,
+                            opening_balance + total_debit - total_credit, page)
+
+
+def month_start(value):
+    """First day of the month of a date or datetime"""
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.replace(day=1)
+
+
+def _totals_until(as_of, account_ids=None):
+    """Totals up to and including as_of: earlier months' snapshots + this month's lines"""
+    snapshot_query = db.session.query(
+        AccountPeriodBalance.account_id,
+        func.sum(AccountPeriodBalance.debit),
+        func.sum(AccountPeriodBalance.credit)
+    )
+    if as_of is not None:
+        snapshot_query = snapshot_query.filter(AccountPeriodBalance.period_start < month_start(as_of))
+    if account_ids is not None:
+        snapshot_query = snapshot_query.filter(AccountPeriodBalance.account_id.in_(account_ids))
+    totals = {account_id: (debit or 0, credit or 0)
+              for account_id, debit, credit in snapshot_query.group_by(AccountPeriodBalance.account_id)}
+
+    if as_of is not None:
+        delta_query = db.session.query(
+            JournalEntryItem.account_id,
+            func.coalesce(func.sum(JournalEntryItem.debit), 0),
+            func.coalesce(func.sum(JournalEntryItem.credit), 0)
+        ).join(JournalEntry).filter(
+            JournalEntry.status == 'posted',
+            JournalEntry.entry_date >= month_start(as_of),
+            JournalEntry.entry_date <= as_of
+        )
+        if account_ids is not None:
+            delta_query = delta_query.filter(JournalEntryItem.account_id.in_(account_ids))
+        for account_id, debit, credit in delta_query.group_by(JournalEntryItem.account_id):
+            current_debit, current_credit = totals.get(account_id, (0, 0))
+            totals[account_id] = (current_debit + debit, current_credit + credit)
+    return totals
+
+
+# Maintenance
+
+def _apply_snapshot_rows(rows):
+    """Increment monthly snapshots (upsert per account and month)"""
+    if not rows:
+        return
+
+    table = AccountPeriodBalance.__table__
+    dialect = db.engine.dialect.name
+    now = datetime.utcnow()
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert(table) if dialect == 'postgresql' else sqlite.insert(table)
+        statement = insert.on_conflict_do_update(
+            index_elements=['account_id', 'period_start'],
+            set_={'debit': table.c.debit + insert.excluded.debit,
+                  'credit': table.c.credit + insert.excluded.credit,
+                  'updated_at': now}
+        )
+        db.session.execute(statement, rows)
+        return
+
+    for row in rows:
+        updated = db.session.execute(table.update().where(
+            table.c.account_id == row['account_id'], table.c.period_start == row['period_start']
+        ).values(debit=table.c.debit + row['debit'], credit=table.c.credit + row['credit'], updated_at=now))
+        if updated.rowcount == 0:
+            db.session.execute(table.insert().values(**row))
+
+
+def _apply_account_totals(rows):
+    """Increment Account debit/credit totals and recompute current_balance in one executemany"""
+    if not rows:
+        return
+
+    table = Account.__table__
+    debit = func.coalesce(table.c.debit_balance, 0) + bindparam('delta_debit')
+    credit = func.coalesce(table.c.credit_balance, 0) + bindparam('delta_credit')
+    statement = table.update().where(table.c.id == bindparam('target_id')).values(
+        debit_balance=debit,
+        credit_balance=credit,
+        # Plain comparisons: IN (...) cannot be used in an executemany
+        current_balance=case(
+            {account_type: debit - credit for account_type in DEBIT_NATURE_TYPES},
+            value=table.c.account_type,
+            else_=credit - debit
+        )
+    )
+    db.session.execute(statement, [
+        {'target_id': row['account_id'], 'delta_debit': row['debit'], 'delta_credit': row['credit']}
+        for row in rows
+    ])
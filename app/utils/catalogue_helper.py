@@ -0,0 +1,116 @@
+"""
+Catalogue Helper Functions
+Compact, versioned product catalogue snapshots for the POS and invoice forms
+
+A catalogue version is built from the newest Product.updated_at and the
+number of products in the scope, so any create, edit, deactivation or
+delete produces a new version. Clients keep the last snapshot in the
+browser and ask only for rows changed since their version.
+"""
+
+import calendar
+from datetime import datetime, timedelta
+from sqlalchemy import func, case
+from app import db
+from app.models_inventory import Product
+
+# Scope -> (filter flag, price column)
+CATALOGUE_SCOPES = {
+    'sales': (Product.is_sellable, Product.selling_price),
+    'purchases': (Product.is_purchasable, Product.cost_price),
+}
+
+CATALOGUE_COLUMNS = ('id', 'code', 'barcode', 'name', 'price', 'tax', 'image')
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def get_catalogue_version(scope='sales'):
+    """
+    Get the current catalogue version of a scope in one query
+
+    Args:
+        scope: Catalogue scope, or None to count every product (active or not)
+
+    Returns:
+        str: '<newest updated_at in microseconds>-<product count>'
+    """
+    if scope is None:
+        counted = func.count(Product.id)
+    else:
+        flag = CATALOGUE_SCOPES[scope][0]
+        counted = func.coalesce(func.sum(case((Product.is_active.is_(True) & flag.is_(True), 1), else_=0)), 0)
+    newest, count = db.session.query(func.max(Product.updated_at), counted).one()
+    return f'{_to_micros(newest)}-{int(count)}'
+
+
+def get_catalogue_snapshot(scope='sales', since=None, version=None):
+    """
+    Build a columnar catalogue snapshot
+
+    Args:
+        scope: 'sales' (sellable, selling price) or 'purchases'
+            (purchasable, cost price)
+        since: Version held by the client; when valid only rows changed
+            since then are returned, plus the ids that left the scope
+        version: Current version, if the caller already computed it
+
+    Returns:
+        dict: version, mode ('full' or 'delta'), count (products in the
+            scope), columns, values (one list per column) and removed ids
+    """
+    flag, price = CATALOGUE_SCOPES[scope]
+    if version is None:
+        version = get_catalogue_version(scope)
+    since_time = parse_catalogue_version(since)
+
+    query = db.session.query(
+        Product.id, Product.code, Product.barcode, Product.name,
+        price.label('price'), Product.tax_rate, Product.image,
+        (Product.is_active.is_(True) & flag.is_(True)).label('listed')
+    )
+    if since_time is None:
+        query = query.filter(Product.is_active.is_(True), flag.is_(True))
+    else:
+        # >= so rows written in the same microsecond are sent again rather than missed
+        query = query.filter(Product.updated_at >= since_time)
+
+    values = [[] for _ in CATALOGUE_COLUMNS]
+    removed = []
+    for row in query.order_by(Product.id):
+        if not row.listed:
+            removed.append(row.id)
+            continue
+        for column, value in zip(values, (
+                row.id, row.code, row.barcode or '', row.name,
+                float(row.price or 0), float(row.tax_rate if row.tax_rate is not None else 15),
+                row.image or '')):
+            column.append(value)
+
+    return {
+        'scope': scope,
+        'version': version,
+        'mode': 'full' if since_time is None else 'delta',
+        'count': int(version.rsplit('-', 1)[1]),
+        'columns': list(CATALOGUE_COLUMNS),
+        'values': values,
+        'removed': removed
+    }
+
+
+def _to_micros(value):
+    """Naive UTC datetime -> integer microseconds since the epoch (0 for None)"""
+    if value is None:
+        return 0
+    return calendar.timegm(value.utctimetuple()) * 1000000 + value.microsecond
+
+
+def parse_catalogue_version(version):
+    """Version string -> datetime of its newest update (None when invalid or empty)"""
+    try:
+        micros = int(str(version).split('-', 1)[0])
+    except (TypeError, ValueError):
+        return None
+    if micros <= 0:
+        return None
+    return _EPOCH + timedelta(microseconds=micros)
@@ -0,0 +1,112 @@
+"""
+Cost Center Helper Functions
+Default cost center of automatic journal entries and the cost center
+profit and loss rolled up the cost center tree
+
+Automatic entries are tagged with the cost center linked to the document's
+warehouse, or else to its branch. The report adds every center's own lines
+to all of its ancestors with a recursive CTE over parent_id, so the whole
+tree is computed in one query.
+"""
+
+from sqlalchemy import func, case, select
+from sqlalchemy.orm import aliased
+from app import db
+from app.models_accounting import Account, JournalEntry, JournalEntryItem, CostCenter
+from app.models_inventory import Warehouse
+
+
+def default_cost_center_id(warehouse_id=None, branch_id=None):
+    """
+    Cost center of an automatic entry: the active center linked to the
+    warehouse, else the one linked to the branch (of the warehouse when no
+    branch is given), else None
+    """
+    if warehouse_id:
+        center_id = db.session.query(CostCenter.id).filter(
+            CostCenter.warehouse_id == warehouse_id, CostCenter.is_active.is_(True)
+        ).order_by(CostCenter.id).limit(1).scalar()
+        if center_id is not None:
+            return center_id
+        if not branch_id:
+            branch_id = db.session.query(Warehouse.branch_id).filter(Warehouse.id == warehouse_id).scalar()
+
+    if branch_id:
+        return db.session.query(CostCenter.id).filter(
+            CostCenter.branch_id == branch_id, CostCenter.is_active.is_(True)
+        ).order_by(CostCenter.id).limit(1).scalar()
+    return None
+
+
+def get_cost_center_report(start_date=None, end_date=None):
+    """
+    Revenue and expenses of posted lines per cost center, each center
+    including its descendants
+
+    Args:
+        start_date: First entry date included (None for no limit)
+        end_date: Last entry date included (None for no limit)
+
+    Returns:
+        list: dicts with id, code, name, parent_id, depth, revenue, expenses
+            and net_profit, in tree order (each center followed by its
+            children, by code)
+    """
+    # Every (ancestor, descendant) pair of the tree, a center being its own descendant
+    tree = select(CostCenter.id.label('root_id'), CostCenter.id.label('center_id')).cte('tree', recursive=True)
+    child = aliased(CostCenter)
+    tree = tree.union_all(select(tree.c.root_id, child.id).join(child, child.parent_id == tree.c.center_id))
+
+    # Posted revenue/expense lines summed per cost center
+    revenue = case((Account.account_type == 'revenue',
+                    func.coalesce(JournalEntryItem.credit, 0) - func.coalesce(JournalEntryItem.debit, 0)), else_=0)
+    expenses = case((Account.account_type == 'expense',
+                     func.coalesce(JournalEntryItem.debit, 0) - func.coalesce(JournalEntryItem.credit, 0)), else_=0)
+    lines = select(
+        JournalEntryItem.cost_center_id,
+        func.sum(revenue).label('revenue'),
+        func.sum(expenses).label('expenses')
+    ).join(JournalEntry, JournalEntry.id == JournalEntryItem.journal_entry_id).join(
+        Account, Account.id == JournalEntryItem.account_id
+    ).where(
+        JournalEntry.status == 'posted',
+        JournalEntryItem.cost_center_id.isnot(None),
+        Account.account_type.in_(('revenue', 'expense'))
+    )
+    if start_date is not None:
+        lines = lines.where(JournalEntry.entry_date >= start_date)
+    if end_date is not None:
+        lines = lines.where(JournalEntry.entry_date <= end_date)
+    lines = lines.group_by(JournalEntryItem.cost_center_id).subquery('lines')
+
+    query = select(
+        CostCenter.id, CostCenter.code, CostCenter.name, CostCenter.parent_id,
+        func.coalesce(func.sum(lines.c.revenue), 0).label('revenue'),
+        func.coalesce(func.sum(lines.c.expenses), 0).label('expenses')
+    ).join(tree, tree.c.root_id == CostCenter.id).outerjoin(
+        lines, lines.c.cost_center_id == tree.c.center_id
+    ).where(CostCenter.is_active.is_(True)).group_by(
+        CostCenter.id, CostCenter.code, CostCenter.name, CostCenter.parent_id
+    ).order_by(CostCenter.code)
+
+    rows = {}
+    for row in db.session.execute(query):
+        rows[row.id] = dict(row._asdict(), net_profit=row.revenue - row.expenses, depth=0)
+    return _tree_order(rows)
+
+
+def _tree_order(rows):
+    """Order centers depth-first (children under their parent) and set their depth"""
+    children = {}
+    for row in rows.values():
+        parent_id = row['parent_id'] if row['parent_id'] in rows else None
+        children.setdefault(parent_id, []).append(row)
+
+    ordered = []
+    stack = [(row, 0) for row in reversed(children.get(None, []))]
+    while stack:
+        row, depth = stack.pop()
+        row['depth'] = depth
+        ordered.append(row)
+        stack.extend((child, depth + 1) for child in reversed(children.get(row['id'], [])))
+    return ordered
@@ -0,0 +1,473 @@
+"""
+Import Helper Functions
+Bulk product import from CSV and XLSX files
+
+Rows are streamed from the file (csv reader / openpyxl read-only mode),
+checked against the codes, SKUs and barcodes of all products preloaded in
+one query, and written in chunks: new products with one executemany
+INSERT, existing ones (matched by code) with one executemany UPDATE, and
+the opening Stock and StockMovement rows of new products in bulk. Each
+chunk is committed on its own, so a bad row only costs its own line in the
+error list and memory does not grow with the size of the file.
+
+Uploads are saved under UPLOAD_FOLDER/imports and imported by an
+'inventory.import_products' background job, which removes the file when
+it is done.
+"""
+
+import csv
+import io
+import os
+import re
+import uuid
+from datetime import datetime
+from flask import current_app
+from flask_babel import gettext as _
+from openpyxl import load_workbook
+from sqlalchemy import insert, update
+from app import db
+from app.models_inventory import Product, Category, Unit, Warehouse, Stock, StockMovement
+from app.utils.job_helper import job_handler, JobError
+
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+# Rows written per executemany / transaction
+IMPORT_CHUNK_SIZE = 1000
+
+# Errors kept for the report (the total is always counted)
+MAX_REPORTED_ERRORS = 500
+
+# Field -> accepted column titles (compared case-insensitively)
+IMPORT_COLUMNS = {
+    'code': ('code', 'product code', 'كود المنتج', 'الكود'),
+    'name': ('name', 'product name', 'اسم المنتج', 'الاسم'),
+    'name_en': ('name_en', 'english name', 'الاسم بالإنجليزية'),
+    'barcode': ('barcode', 'الباركود'),
+    'sku': ('sku',),
+    'category': ('category', 'الفئة'),
+    'unit': ('unit', 'الوحدة'),
+    'description': ('description', 'الوصف'),
+    'cost_price': ('cost_price', 'cost price', 'سعر التكلفة'),
+    'selling_price': ('selling_price', 'selling price', 'سعر البيع'),
+    'min_price': ('min_price', 'min price', 'أقل سعر'),
+    'min_stock': ('min_stock', 'min stock', 'الحد الأدنى'),
+    'max_stock': ('max_stock', 'max stock', 'الحد الأقصى'),
+    'reorder_level': ('reorder_level', 'reorder level', 'حد إعادة الطلب'),
+    'tax_rate': ('tax_rate', 'tax rate', 'نسبة الضريبة'),
+    'is_active': ('is_active', 'active', 'نشط'),
+    'is_sellable': ('is_sellable', 'sellable', 'قابل للبيع'),
+    'is_purchasable': ('is_purchasable', 'purchasable', 'قابل للشراء'),
+    'track_inventory': ('track_inventory', 'track inventory', 'تتبع المخزون'),
+    'quantity': ('quantity', 'opening quantity', 'الكمية', 'الرصيد الافتتاحي'),
+    'warehouse': ('warehouse', 'warehouse code', 'المستودع'),
+}
+
+NUMERIC_FIELDS = ('cost_price', 'selling_price', 'min_price', 'min_stock', 'max_stock',
+                  'reorder_level', 'tax_rate', 'quantity')
+FLAG_FIELDS = ('is_active', 'is_sellable', 'is_purchasable', 'track_inventory')
+TEXT_FIELDS = ('name', 'name_en', 'barcode', 'sku', 'description')
+
+# Values of new products when the column is missing or empty
+PRODUCT_DEFAULTS = {
+    'name_en': None, 'barcode': None, 'sku': None, 'category_id': None, 'unit_id': None,
+    'description': None, 'cost_price': 0.0, 'selling_price': 0.0, 'min_price': 0.0,
+    'min_stock': 0.0, 'max_stock': 0.0, 'reorder_level': 0.0, 'tax_rate': 15.0,
+    'is_active': True, 'is_sellable': True, 'is_purchasable': True, 'track_inventory': True,
+}
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'y', 'نعم')
+_FALSE_VALUES = ('0', 'false', 'no', 'n', 'لا')
+
+
+class ImportResult:
+    """Counters and per-row errors of an import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.stock_rows = 0
+        self.error_count = 0
+        self.errors = []        # (row number, message), at most MAX_REPORTED_ERRORS
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'stock_rows': self.stock_rows,
+            'error_count': self.error_count,
+            'errors': [{'row': row, 'message': message} for row, message in self.errors],
+        }
+
+
+def get_import_format(filename):
+    """'csv' or 'xlsx' from a file name (None when unsupported)"""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def read_import_rows(stream, import_format):
+    """
+    Stream the rows of an import file
+
+    Args:
+        stream: Binary file object (e.g. an uploaded file's stream)
+        import_format: 'csv' or 'xlsx'
+
+    Yields:
+        tuple: (row number in the file, dict of field -> raw value)
+
+    Raises:
+        ValueError: Unsupported format, or no name/code column in the header
+    """
+    if import_format == 'xlsx':
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+    elif import_format == 'csv':
+        workbook = None
+        rows = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    else:
+        raise ValueError(_('Unsupported file format: %(format)s', format=import_format))
+
+    try:
+        columns = _map_columns(next(rows, None) or [])
+        for row_number, values in enumerate(rows, start=2):
+            if not any(value not in (None, '') for value in values):
+                continue
+            yield row_number, {field: values[index] if index < len(values) else None
+                               for field, index in columns.items()}
+    finally:
+        if workbook is not None:
+            workbook.close()
+
+
+def save_import_file(upload, import_format):
+    """Store an uploaded import file for the import job and return its path"""
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'imports')
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f'{uuid.uuid4().hex}.{import_format}')
+    upload.save(path)
+    return path
+
+
+def count_import_rows(path, import_format):
+    """Rough number of data rows of an import file, for progress reporting"""
+    if import_format == 'xlsx':
+        workbook = load_workbook(path, read_only=True)
+        try:
+            return max((workbook.active.max_row or 1) - 1, 0)
+        finally:
+            workbook.close()
+    with open(path, 'rb') as stream:
+        return max(sum(block.count(b'\n') for block in iter(lambda: stream.read(1 << 20), b'')) - 1, 0)
+
+
+def import_products(rows, warehouse_id=None, user_id=None, update_existing=True,
+                    chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Import products from rows of read_import_rows
+
+    Args:
+        rows: Iterable of (row number, field dict)
+        warehouse_id: Warehouse of opening quantities without a warehouse column
+        user_id: User recorded on the opening stock movements
+        update_existing: Update products whose code already exists (else
+            report them as errors)
+        chunk_size: Rows per executemany and transaction
+        progress: Optional callable(result) called after every chunk
+
+    Returns:
+        ImportResult
+    """
+    return _ProductImporter(warehouse_id, user_id, update_existing, chunk_size, progress).run(rows)
+
+
+class _ProductImporter:
+
+    def __init__(self, warehouse_id, user_id, update_existing, chunk_size, progress):
+        self.warehouse_id = warehouse_id
+        self.user_id = user_id
+        self.update_existing = update_existing
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.result = ImportResult()
+
+        # Every product's keys in one query
+        self.codes, self.skus, self.barcodes = {}, {}, {}
+        for product_id, code, sku, barcode in db.session.query(Product.id, Product.code, Product.sku,
+                                                                Product.barcode).yield_per(10000):
+            self.codes[code] = product_id
+            if sku:
+                self.skus[sku] = product_id
+            if barcode:
+                self.barcodes.setdefault(barcode, product_id)
+
+        self.categories = _lookup(Category)
+        self.units = _lookup(Unit)
+        self.warehouses = _lookup(Warehouse, code=True)
+
+        today = datetime.utcnow()
+        self.code_prefix = f'PRD-{today.year}{today.month:02d}'
+        self.next_code = _next_number(self.codes, rf'{re.escape(self.code_prefix)}-(\d+)')
+        self.next_sku = _next_number(self.skus, r'SKU-(\d+)')
+
+        self.seen_codes = set()
+        self._reset_chunk()
+
+    def _reset_chunk(self):
+        self.new_rows, self.update_rows, self.opening_stock = [], [], []
+        self.chunk_lines = []       # Row numbers of the chunk
+
+    def run(self, rows):
+        for row_number, values in rows:
+            self.result.rows += 1
+            try:
+                self._add_row(row_number, values)
+            except ValueError as e:
+                self.result.add_error(row_number, str(e))
+            if len(self.new_rows) + len(self.update_rows) >= self.chunk_size:
+                self._flush()
+        self._flush()
+        return self.result
+
+    # Validation
+
+    def _add_row(self, row_number, values):
+        fields = {}
+        for field in TEXT_FIELDS:
+            fields[field] = _text(values.get(field))
+        for field in NUMERIC_FIELDS:
+            fields[field] = _number(values.get(field), field)
+        for field in FLAG_FIELDS:
+            fields[field] = _flag(values.get(field), field)
+        fields['category_id'] = _reference(self.categories, values.get('category'), 'category')
+        fields['unit_id'] = _reference(self.units, values.get('unit'), 'unit')
+
+        code = _text(values.get('code'))
+        if code is not None and code in self.seen_codes:
+            raise ValueError(_('Duplicate product code in file: %(code)s', code=code))
+        product_id = self.codes.get(code) if code is not None else None
+        if product_id is not None and not self.update_existing:
+            raise ValueError(_('Product code already exists: %(code)s', code=code))
+        if product_id is None and not fields['name']:
+            raise ValueError(_('Product name is required'))
+
+        # SKUs and barcodes may not belong to another product (or an earlier row)
+        if fields['sku'] is not None and self.skus.get(fields['sku'], product_id) != product_id:
+            raise ValueError(_('SKU already exists: %(sku)s', sku=fields['sku']))
+        if fields['barcode'] is not None and self.barcodes.get(fields['barcode'], product_id) != product_id:
+            raise ValueError(_('Barcode already exists: %(barcode)s', barcode=fields['barcode']))
+
+        quantity = fields.pop('quantity')
+        warehouse_id = None
+        if quantity:
+            warehouse_id = _reference(self.warehouses, values.get('warehouse'), 'warehouse') or self.warehouse_id
+            if warehouse_id is None:
+                raise ValueError(_('A warehouse is required for the opening quantity'))
+
+        if code is None:
+            code = f'{self.code_prefix}-{self.next_code:04d}'
+            self.next_code += 1
+        self.seen_codes.add(code)
+
+        now = datetime.utcnow()
+        if product_id is None:
+            if fields['sku'] is None:
+                fields['sku'] = f'SKU-{self.next_sku:04d}'
+                self.next_sku += 1
+            row = dict(PRODUCT_DEFAULTS)
+            row.update((field, value) for field, value in fields.items() if value is not None)
+            row.update(code=code, created_at=now, updated_at=now)
+            self.new_rows.append(row)
+            if quantity and quantity > 0:
+                self.opening_stock.append((len(self.new_rows) - 1, warehouse_id, quantity))
+            product_key = code
+        else:
+            # Existing products: only the columns given in the file change
+            row = {field: value for field, value in fields.items() if value is not None}
+            row.update(id=product_id, updated_at=now)
+            self.update_rows.append(row)
+            product_key = product_id
+        self.chunk_lines.append(row_number)
+
+        for field, owners in (('sku', self.skus), ('barcode', self.barcodes)):
+            if fields[field] is not None:
+                owners[fields[field]] = product_key
+
+    # Writing
+
+    def _flush(self):
+        if not self.new_rows and not self.update_rows:
+            return
+        try:
+            if self.new_rows:
+                ids = db.session.scalars(
+                    insert(Product).returning(Product.id, sort_by_parameter_order=True), self.new_rows
+                ).all()
+                for row, product_id in zip(self.new_rows, ids):
+                    self.codes[row['code']] = product_id
+                    for field, owners in (('sku', self.skus), ('barcode', self.barcodes)):
+                        if row[field] is not None:
+                            owners[row[field]] = product_id
+                self._insert_opening_stock(ids)
+
+            if self.update_rows:
+                db.session.execute(update(Product), self.update_rows)
+
+            db.session.commit()
+            self.result.created += len(self.new_rows)
+            self.result.updated += len(self.update_rows)
+        except Exception as e:
+            db.session.rollback()
+            for row in self.new_rows:
+                self.seen_codes.discard(row['code'])
+                for field, owners in (('sku', self.skus), ('barcode', self.barcodes)):
+                    if row[field] is not None and owners.get(row[field]) == row['code']:
+                        del owners[row[field]]
+            message = _('Rows not saved: %(error)s', error=str(e))
+            for row_number in self.chunk_lines:
+                self.result.add_error(row_number, message)
+        finally:
+            self._reset_chunk()
+
+        if self.progress is not None:
+            self.progress(self.result)
+
+    def _insert_opening_stock(self, ids):
+        if not self.opening_stock:
+            return
+        now = datetime.utcnow()
+        stocks, movements = {}, []
+        for position, warehouse_id, quantity in self.opening_stock:
+            product_id = ids[position]
+            stock = stocks.setdefault((product_id, warehouse_id), {
+                'product_id': product_id, 'warehouse_id': warehouse_id, 'quantity': 0.0,
+                'reserved_quantity': 0.0, 'damaged_quantity': 0.0, 'available_quantity': 0.0,
+                'last_updated': now
+            })
+            stock['quantity'] += quantity
+            stock['available_quantity'] += quantity
+            movements.append({
+                'product_id': product_id, 'warehouse_id': warehouse_id, 'movement_type': 'in',
+                'quantity': quantity, 'reference_type': 'initial_stock', 'reference_id': product_id,
+                'notes': 'رصيد افتتاحي - استيراد المنتجات', 'user_id': self.user_id, 'created_at': now
+            })
+        db.session.execute(insert(Stock), list(stocks.values()))
+        db.session.execute(insert(StockMovement), movements)
+        self.result.stock_rows += len(stocks)
+
+
+def _map_columns(header):
+    """Header row -> {field: column index}"""
+    titles = {}
+    for field, names in IMPORT_COLUMNS.items():
+        for name in names:
+            titles[name.casefold()] = field
+
+    columns = {}
+    for index, title in enumerate(header):
+        field = titles.get(str(title or '').strip().casefold())
+        if field is not None and field not in columns:
+            columns[field] = index
+    if 'name' not in columns and 'code' not in columns:
+        raise ValueError(_('The file needs a header row with at least a name or code column'))
+    return columns
+
+
+def _lookup(model, code=False):
+    """Lower-cased names (and codes) and ids -> id of the rows of a model"""
+    columns = [model.id, model.name] + ([model.code] if code else [])
+    keys = {}
+    for row in db.session.query(*columns):
+        keys[str(row[0])] = row[0]
+        for value in row[1:]:
+            if value:
+                keys[value.strip().casefold()] = row[0]
+    return keys
+
+
+def _reference(keys, value, field):
+    value = _text(value)
+    if value is None:
+        return None
+    key = keys.get(value.casefold())
+    if key is None:
+        raise ValueError(_('Unknown %(field)s: %(value)s', field=field, value=value))
+    return key
+
+
+def _next_number(values, pattern):
+    """One more than the highest number of the keys matching pattern"""
+    pattern = re.compile(pattern)
+    highest = 0
+    for value in values:
+        match = pattern.fullmatch(value)
+        if match:
+            highest = max(highest, int(match.group(1)))
+    return highest + 1
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # Codes typed as numbers in Excel
+    value = str(value).strip()
+    return value or None
+
+
+def _number(value, field):
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        return float(value.replace(',', ''))
+    except ValueError:
+        raise ValueError(_('Invalid number in %(field)s: %(value)s', field=field, value=value))
+
+
+def _flag(value, field):
+    value = _text(value)
+    if value is None:
+        return None
+    value = value.casefold()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    raise ValueError(_('Invalid yes/no value in %(field)s: %(value)s', field=field, value=value))
+
+
+@job_handler('inventory.import_products')
+def import_products_job(job):
+    path, import_format = job.payload['path'], job.payload['format']
+    if not os.path.exists(path):
+        raise JobError(_('The import file is no longer available'))
+
+    total = count_import_rows(path, import_format)
+
+    def progress(result):
+        job.progress(result.rows, total, _('%(rows)s rows processed', rows=result.rows))
+
+    finished = False
+    try:
+        with open(path, 'rb') as stream:
+            result = import_products(read_import_rows(stream, import_format),
+                                     warehouse_id=job.payload.get('warehouse_id'),
+                                     user_id=job.payload.get('user_id'),
+                                     update_existing=job.payload.get('update_existing', True),
+                                     progress=progress)
+        finished = True
+    except ValueError as e:
+        finished = True
+        raise JobError(str(e))
+    finally:
+        if finished or job.is_last_attempt:
+            os.remove(path)
+    return result.to_dict()
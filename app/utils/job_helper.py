@@ -0,0 +1,297 @@
+"""
+Job Helper Functions
+Background job queue in the background_jobs table and the worker threads
+that run it
+
+Heavy operations (payroll, product imports, report rebuilds) are enqueued
+by the web request, which returns at once with a link to the job status
+page. Handlers are registered with @job_handler under a job type and get a
+JobContext with the payload and a progress() callback. Workers claim a job
+with a conditional UPDATE (only one worker can move it out of 'queued'),
+run it in its own app context and either store the JSON result or, when it
+raises, queue it again with an exponential delay until max_attempts is
+reached (JobError fails it at once). Jobs whose worker stopped sending heartbeats are claimed again.
+
+Workers are threads started with the first request of each process (so
+they are not forked or started by CLI commands); `flask run-jobs` runs a
+dedicated worker process instead.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from time import monotonic
+from flask import current_app, has_request_context
+from flask_babel import force_locale, get_locale
+from sqlalchemy import update, or_, and_
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models_jobs import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+# job_type -> (handler, max_attempts)
+JOB_HANDLERS = {}
+
+# Seconds between two progress writes of a job
+PROGRESS_INTERVAL = 1.0
+
+
+class JobError(Exception):
+    """Raised by a handler when retrying cannot help (bad payload, nothing to do)"""
+
+
+class JobContext:
+    """What a handler gets: the job id, its payload and a progress callback"""
+
+    def __init__(self, job_id, payload, attempt, max_attempts):
+        self.job_id = job_id
+        self.payload = payload
+        self.attempt = attempt
+        self.max_attempts = max_attempts
+        self._last_progress = 0.0
+
+    @property
+    def is_last_attempt(self):
+        return self.attempt >= self.max_attempts
+
+    def progress(self, done, total=None, message=None, force=False):
+        """
+        Report progress (done out of total, or a percent when total is None)
+        and refresh the heartbeat. Writes at most once per PROGRESS_INTERVAL
+        on a separate connection, so it does not touch the handler's
+        transaction; call it between commits, as SQLite lets only one
+        connection write at a time.
+        """
+        now = monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+
+        percent = done if total is None else (done * 100 // total if total else 100)
+        values = {'progress': max(0, min(int(percent), 99)), 'heartbeat_at': datetime.utcnow()}
+        if message is not None:
+            values['message'] = message[:255]
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(update(BackgroundJob).where(BackgroundJob.id == self.job_id).values(**values))
+        except OperationalError:
+            logger.warning('Could not record the progress of job %s', self.job_id)
+
+
+def job_handler(job_type, max_attempts=None):
+    """Register the decorated function(context) as the handler of job_type"""
+    def decorator(func):
+        JOB_HANDLERS[job_type] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue_job(job_type, payload=None, user_id=None, message=None, max_attempts=None):
+    """
+    Queue a job and wake the workers. Commits the session.
+
+    Returns:
+        BackgroundJob: The queued job (already finished when JOB_RUN_INLINE
+            is set, e.g. in tests)
+    """
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job type: {job_type}')
+
+    handler_attempts = JOB_HANDLERS[job_type][1]
+    job = BackgroundJob(
+        job_type=job_type,
+        payload=json.dumps(payload or {}),
+        created_by=user_id,
+        message=message,
+        locale=str(get_locale()) if has_request_context() else current_app.config['BABEL_DEFAULT_LOCALE'],
+        max_attempts=max_attempts or handler_attempts or current_app.config['JOB_MAX_ATTEMPTS']
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    if current_app.config.get('JOB_RUN_INLINE'):
+        job_id = claim_next_job('inline', job_id=job.id)
+        if job_id is not None:
+            run_job(job_id)
+        db.session.refresh(job)
+    else:
+        pool = current_app.extensions.get('job_workers')
+        if pool is not None:
+            pool.start()
+            pool.wake()
+    return job
+
+
+def claim_next_job(worker_name, job_id=None):
+    """
+    Move the next due job (or job_id) to 'running' for this worker
+
+    Returns:
+        int: The claimed job id, or None when nothing is due
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config['JOB_STALE_SECONDS'])
+    stale = and_(BackgroundJob.status == 'running', BackgroundJob.heartbeat_at < stale_before)
+    claimable = or_(
+        and_(BackgroundJob.status == 'queued', BackgroundJob.run_after <= now),
+        and_(stale, BackgroundJob.attempts < BackgroundJob.max_attempts)
+    )
+
+    # Jobs of dead workers that have no attempt left
+    db.session.execute(
+        update(BackgroundJob).where(stale, BackgroundJob.attempts >= BackgroundJob.max_attempts).values(
+            status='failed', error='The worker running this job stopped', finished_at=now
+        ).execution_options(synchronize_session=False)
+    )
+
+    query = db.session.query(BackgroundJob.id).filter(claimable)
+    if job_id is not None:
+        query = query.filter(BackgroundJob.id == job_id)
+    candidates = [row.id for row in query.order_by(BackgroundJob.run_after, BackgroundJob.id).limit(5)]
+    db.session.commit()
+
+    for candidate in candidates:
+        claimed = db.session.execute(
+            update(BackgroundJob).where(BackgroundJob.id == candidate, claimable).values(
+                status='running', worker=worker_name, attempts=BackgroundJob.attempts + 1,
+                started_at=now, heartbeat_at=now, error=None
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed == 1:
+            return candidate
+    return None
+
+
+def run_job(job_id):
+    """Run a claimed job and record its result, or queue it again on failure"""
+    job = db.session.get(BackgroundJob, job_id)
+    job_type, locale = job.job_type, job.locale or current_app.config['BABEL_DEFAULT_LOCALE']
+    context = JobContext(job.id, job.payload_data, job.attempts, job.max_attempts)
+    handler = JOB_HANDLERS.get(job_type)
+    db.session.rollback()
+
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job type {job_type}')
+        with force_locale(locale):
+            result = handler[0](context)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if isinstance(e, JobError):
+            logger.warning('Job %s (%s) failed: %s', job_id, job_type, e)
+        else:
+            logger.exception('Job %s (%s) failed on attempt %s', job_id, job_type, context.attempt)
+        _finish(job_id, error=str(e) or e.__class__.__name__,
+                retry=handler is not None and not isinstance(e, JobError) and not context.is_last_attempt, attempt=context.attempt)
+        return False
+
+    _finish(job_id, result=result)
+    return True
+
+
+def run_pending_jobs(worker_name, limit=None):
+    """Run due jobs one after the other until none is left (or limit is reached)"""
+    count = 0
+    while limit is None or count < limit:
+        job_id = claim_next_job(worker_name)
+        if job_id is None:
+            break
+        run_job(job_id)
+        count += 1
+    return count
+
+
+def _finish(job_id, result=None, error=None, retry=False, attempt=1):
+    now = datetime.utcnow()
+    if error is None:
+        values = {'status': 'done', 'progress': 100, 'result': json.dumps(result, default=str),
+                  'finished_at': now, 'heartbeat_at': now}
+    elif retry:
+        delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (attempt - 1)
+        values = {'status': 'queued', 'error': error, 'run_after': now + timedelta(seconds=delay),
+                  'heartbeat_at': now}
+    else:
+        values = {'status': 'failed', 'error': error, 'finished_at': now, 'heartbeat_at': now}
+    db.session.execute(update(BackgroundJob).where(BackgroundJob.id == job_id).values(**values)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+class JobWorkerPool:
+    """Worker threads of one process, started once on demand"""
+
+    def __init__(self, app, size, poll_seconds):
+        self.app = app
+        self.size = size
+        self.poll_seconds = poll_seconds
+        self.threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        # A forked process inherits the pool but none of its threads
+        if self._pid == os.getpid() or self.size <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self.threads = []
+            for number in range(self.size):
+                name = f'{socket.gethostname()}:{self._pid}:{number}'
+                thread = threading.Thread(target=self._run, args=(name,), name=f'job-worker-{number}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self, name):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    ran = run_pending_jobs(name)
+            except Exception:
+                logger.exception('Job worker %s crashed; restarting its loop', name)
+                ran = 0
+            if not ran:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+
+def init_jobs(app):
+    """Create the app's worker pool; threads start with the first request"""
+    pool = JobWorkerPool(app, app.config['JOB_WORKERS'], app.config['JOB_POLL_SECONDS'])
+    app.extensions['job_workers'] = pool
+
+    if app.config['JOB_WORKERS'] > 0 and not app.config.get('JOB_RUN_INLINE'):
+        @app.before_request
+        def start_job_workers():
+            pool.start()
+
+
+def get_user_jobs(user, limit=50):
+    """Latest jobs of a user (all jobs for admins)"""
+    query = BackgroundJob.query
+    if not user.is_admin:
+        query = query.filter(BackgroundJob.created_by == user.id)
+    return query.order_by(BackgroundJob.id.desc()).limit(limit).all()
+
+
+def can_view_job(user, job):
+    return user.is_admin or job.created_by == user.id
@@ -0,0 +1,165 @@
+"""
+Pagination Helper Functions
+Keyset (cursor) pagination for high-volume list views
+
+Pages are fetched with a row comparison on the sort key, e.g.
+(created_at, id) < (:last_created_at, :last_id), instead of OFFSET, so
+every page costs the same index range scan however deep it is. Cursors are
+opaque URL-safe strings holding the key of the boundary row. Totals are
+counted up to KEYSET_COUNT_LIMIT rows only and shown as "N+" above that.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import func, select, tuple_
+
+
+class KeysetPagination:
+    """One page of a keyset-paginated query (template API close to Pagination)"""
+
+    def __init__(self, items, per_page, offset, next_cursor, prev_cursor, total, total_is_estimate):
+        self.items = items
+        self.per_page = per_page
+        self.offset = offset                # Rows before this page (for row numbers)
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total                  # None when not counted
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def page(self):
+        return self.offset // self.per_page + 1
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def total_display(self):
+        if self.total is None:
+            return ''
+        return f'{self.total}+' if self.total_is_estimate else str(self.total)
+
+
+def keyset_paginate(query, order_by, cursor=None, per_page=20, descending=True, count=True):
+    """
+    Fetch one page of a query ordered on a unique key
+
+    Args:
+        query: Filtered query without ORDER BY
+        order_by: Columns forming a unique sort key, e.g.
+            (Model.created_at, Model.id); the last one should be the primary key
+        cursor: Cursor from a previous page (None or invalid for the first page)
+        per_page: Rows per page
+        descending: Sort direction of every key column
+        count: Count the matching rows (up to KEYSET_COUNT_LIMIT)
+
+    Returns:
+        KeysetPagination
+    """
+    order_by = list(order_by)
+    direction, values, offset = _decode_cursor(cursor, len(order_by))
+    backwards = direction == 'prev'
+
+    page_query = query
+    if values is not None:
+        key, boundary = tuple_(*order_by), tuple_(*values)
+        # Forward on a descending sort (or backward on an ascending one) goes to smaller keys
+        page_query = page_query.filter(key < boundary if descending != backwards else key > boundary)
+
+    reverse = descending != backwards
+    page_query = page_query.order_by(*[column.desc() if reverse else column.asc() for column in order_by])
+    items = page_query.limit(per_page + 1).all()
+
+    more = len(items) > per_page
+    items = items[:per_page]
+    if backwards:
+        items.reverse()
+        offset = max(offset - per_page, 0) if more else 0
+
+    # Rows fetched backwards always have a following page; a first page has no previous one
+    has_next = (more or values is not None) if backwards else more
+    has_prev = more if backwards else values is not None and offset > 0
+
+    next_cursor = prev_cursor = None
+    if items:
+        if has_next:
+            next_cursor = _encode_cursor('next', _row_key(items[-1], order_by), offset + per_page)
+        if has_prev:
+            prev_cursor = _encode_cursor('prev', _row_key(items[0], order_by), offset)
+
+    total, total_is_estimate = None, False
+    if count:
+        limit = current_app.config.get('KEYSET_COUNT_LIMIT', 10000)
+        total = _count_rows(query, limit + 1)
+        total_is_estimate = total > limit
+        total = min(total, limit)
+
+    return KeysetPagination(items, per_page, offset, next_cursor, prev_cursor, total, total_is_estimate)
+
+
+def _count_rows(query, limit):
+    """COUNT(*) of a query that stops after `limit` rows"""
+    subquery = query.order_by(None).limit(limit).subquery()
+    return query.session.execute(select(func.count()).select_from(subquery)).scalar()
+
+
+def _row_key(item, order_by):
+    """Sort key values of an ORM row for the given order columns"""
+    return [getattr(_entity_for(item, column), column.key) for column in order_by]
+
+
+def _entity_for(item, column):
+    """The object holding a column: the row itself or a related object loaded with it"""
+    table = getattr(column, 'table', None)
+    if table is None or getattr(item, '__table__', None) is table or hasattr(item, '_mapping'):
+        # Column query rows (Row) expose the key columns by name
+        return item
+    for value in vars(item).values():
+        if getattr(value, '__table__', None) is table:
+            return value
+    raise ValueError(f'Cannot read sort key {column} from {item!r}')
+
+
+def _encode_cursor(direction, values, offset):
+    payload = [direction, offset, [_encode_value(value) for value in values]]
+    data = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, size):
+    """Cursor -> (direction, key values, offset); (None, None, 0) when missing or invalid"""
+    if not cursor:
+        return None, None, 0
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, offset, values = json.loads(data)
+        if direction not in ('next', 'prev') or len(values) != size:
+            raise ValueError(cursor)
+        return direction, [_decode_value(value) for value in values], max(int(offset), 0)
+    except (ValueError, TypeError):
+        return None, None, 0
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'t': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 't' in value:
+            return datetime.fromisoformat(value['t'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        raise ValueError(value)
+    return value
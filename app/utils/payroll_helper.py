@@ -0,0 +1,119 @@
+"""
+Payroll Helper Functions
+Monthly payroll generation (run as a background job) and the monthly
+attendance summary
+
+The generate payroll page enqueues an 'hr.generate_payroll' job; the
+worker creates one draft payroll per active employee with the overtime of
+the month taken from the attendance records. Attendance is summed for all
+employees in one grouped query over an attendance_date range (which the
+(employee_id, attendance_date) unique index serves, unlike month/year
+extracts), and the payrolls are written with one executemany INSERT.
+"""
+
+from collections import namedtuple
+from datetime import date, datetime
+from sqlalchemy import func, case, insert
+from app import db
+from app.models_hr import Employee, Attendance, Payroll
+from app.utils.job_helper import job_handler, JobError
+
+WORKING_HOURS_PER_MONTH = 240  # Hourly rate of overtime = basic salary / this
+
+# Attendance of one employee over a month
+AttendanceSummary = namedtuple('AttendanceSummary', [
+    'present_days', 'absent_days', 'late_days', 'total_hours', 'overtime_hours'
+])
+EMPTY_ATTENDANCE = AttendanceSummary(0, 0, 0, 0.0, 0.0)
+
+
+def month_range(month, year):
+    """First day of the month and first day of the next month"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def payroll_exists(month, year):
+    return db.session.query(Payroll.id).filter_by(month=month, year=year).first() is not None
+
+
+def attendance_totals(month, year):
+    """Subquery: attendance counts and hours per employee_id over the month"""
+    start, end = month_range(month, year)
+
+    def days(status):
+        return func.coalesce(func.sum(case((Attendance.status == status, 1), else_=0)), 0)
+
+    return db.session.query(
+        Attendance.employee_id.label('employee_id'),
+        days('present').label('present_days'),
+        days('absent').label('absent_days'),
+        days('late').label('late_days'),
+        func.coalesce(func.sum(Attendance.working_hours), 0).label('total_hours'),
+        func.coalesce(func.sum(Attendance.overtime_hours), 0).label('overtime_hours')
+    ).filter(
+        Attendance.attendance_date >= start,
+        Attendance.attendance_date < end
+    ).group_by(Attendance.employee_id).subquery('attendance_totals')
+
+
+def get_attendance_summary(month, year):
+    """
+    Attendance of the month per employee in one grouped query
+
+    Returns:
+        dict: employee_id -> AttendanceSummary (employees without records
+            are missing; use EMPTY_ATTENDANCE)
+    """
+    totals = attendance_totals(month, year)
+    return {row.employee_id: AttendanceSummary(row.present_days, row.absent_days, row.late_days,
+                                               row.total_hours, row.overtime_hours)
+            for row in db.session.query(totals)}
+
+
+def generate_payroll(month, year):
+    """
+    Create the draft payrolls of a month for all active employees. Runs in
+    the caller's transaction.
+
+    Returns:
+        int: Number of payrolls created
+    """
+    totals = attendance_totals(month, year)
+    employees = db.session.query(
+        Employee.id, Employee.basic_salary,
+        func.coalesce(totals.c.overtime_hours, 0)
+    ).outerjoin(totals, totals.c.employee_id == Employee.id).filter(Employee.is_active.is_(True))
+
+    now = datetime.utcnow()
+    rows = []
+    for employee_id, basic_salary, overtime_hours in employees:
+        basic_salary = basic_salary or 0
+        overtime_amount = overtime_hours * (basic_salary / WORKING_HOURS_PER_MONTH)
+        allowances = 0  # Can be customized
+        deductions = 0  # Can be customized
+        rows.append({
+            'employee_id': employee_id,
+            'month': month,
+            'year': year,
+            'basic_salary': basic_salary,
+            'allowances': allowances,
+            'deductions': deductions,
+            'overtime': overtime_amount,
+            'net_salary': basic_salary + allowances + overtime_amount - deductions,
+            'status': 'draft',
+            'created_at': now
+        })
+
+    if rows:
+        db.session.execute(insert(Payroll), rows)
+    return len(rows)
+
+
+@job_handler('hr.generate_payroll')
+def generate_payroll_job(job):
+    month, year = job.payload['month'], job.payload['year']
+    if payroll_exists(month, year):
+        raise JobError(f'Payroll for {month}/{year} already exists')
+    return {'month': month, 'year': year, 'created': generate_payroll(month, year)}
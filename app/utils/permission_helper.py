@@ -0,0 +1,45 @@
+"""
+Permission Helper Functions
+Process-wide cache of the permission names of each role
+
+Permission checks run many times per request (decorators, menus in
+base.html), so each role's permissions are compiled once into a frozenset
+and kept per process, keyed by role id and Role.permissions_version. Routes
+that change a role's permissions call bump_role_permissions_version() in
+the same transaction; every worker then sees the new version with the next
+user load and rebuilds the set.
+"""
+
+import threading
+from app import db
+from app.models import Role, Permission, RolePermission
+
+# role_id -> (permissions_version, frozenset of permission names)
+_role_permissions = {}
+_cache_lock = threading.Lock()
+
+
+def get_role_permissions(role_id, version):
+    """Permission names of a role at a version (one query per process and version)"""
+    cached = _role_permissions.get(role_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    names = frozenset(name for (name,) in db.session.query(Permission.name).join(
+        RolePermission, RolePermission.permission_id == Permission.id
+    ).filter(RolePermission.role_id == role_id))
+    with _cache_lock:
+        _role_permissions[role_id] = (version, names)
+    return names
+
+
+def bump_role_permissions_version(role):
+    """Invalidate the cached permissions of a role everywhere (in the caller's transaction)"""
+    role.permissions_version = Role.permissions_version + 1
+    forget_role_permissions(role.id)
+
+
+def forget_role_permissions(role_id):
+    """Drop a role from this process's cache"""
+    with _cache_lock:
+        _role_permissions.pop(role_id, None)
@@ -0,0 +1,148 @@
+"""
+Query Plan Helper Functions
+EXPLAIN checks of the hot report and dashboard queries
+
+Each HotQuery builds a statement with the same shape as the query a route
+runs (filters, joins, order) and names the tables that must be read through
+an index. check_query_plans() explains every one on the configured database
+and reports the queries that fall back to a full scan of such a table, e.g.
+after an index was dropped or a filter changed. Run it with
+`flask check-query-plans` (exits non-zero on a full scan).
+
+On PostgreSQL sequential scans are disabled while explaining, so a
+sequential scan in the plan means no usable index exists (on small tables
+the planner would otherwise prefer one anyway).
+"""
+
+import json
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, select
+from app import db
+from app.models import SecurityLog
+from app.models_accounting import JournalEntry, JournalEntryItem
+from app.models_hr import Attendance, Payroll
+from app.models_inventory import Stock, StockMovement
+from app.models_pos import POSOrder
+from app.models_sales import SalesInvoice
+
+# name: label in the report; tables: tables that must not be fully scanned;
+# build: function returning the statement to explain
+HotQuery = namedtuple('HotQuery', ['name', 'tables', 'build'])
+
+# Result of one check; plan is the list of plan lines
+PlanCheck = namedtuple('PlanCheck', ['name', 'ok', 'full_scans', 'plan'])
+
+
+def _since(days):
+    return datetime.utcnow() - timedelta(days=days)
+
+
+HOT_QUERIES = [
+    HotQuery('reports.stock_movement (product, warehouse, dates)', ('stock_movements',), lambda: select(StockMovement).where(
+        StockMovement.product_id == 1, StockMovement.warehouse_id == 1, StockMovement.created_at >= _since(30)
+    ).order_by(StockMovement.created_at.desc())),
+    HotQuery('reports.stock_movement (warehouse, dates)', ('stock_movements',), lambda: select(StockMovement).where(
+        StockMovement.warehouse_id == 1, StockMovement.created_at >= _since(30)
+    ).order_by(StockMovement.created_at.desc())),
+    HotQuery('reports.stock_movement (dates)', ('stock_movements',), lambda: select(StockMovement).where(
+        StockMovement.created_at >= _since(30)
+    ).order_by(StockMovement.created_at.desc())),
+    HotQuery('reports.sales (posted, dates)', ('sales_invoices',), lambda: select(SalesInvoice).where(
+        SalesInvoice.status == 'confirmed', SalesInvoice.invoice_date >= date.today() - timedelta(days=30),
+        SalesInvoice.invoice_date <= date.today()
+    )),
+    HotQuery('accounting.account_details', ('journal_entry_items', 'journal_entries'), lambda: select(JournalEntryItem).join(
+        JournalEntry, JournalEntry.id == JournalEntryItem.journal_entry_id
+    ).where(
+        JournalEntryItem.account_id == 1, JournalEntry.status == 'posted'
+    ).order_by(JournalEntry.entry_date.desc()).limit(50)),
+    HotQuery('hr.attendance (employee, month)', ('attendance',), lambda: select(Attendance).where(
+        Attendance.employee_id == 1, Attendance.attendance_date >= date.today().replace(day=1),
+        Attendance.attendance_date < date.today() + timedelta(days=1)
+    )),
+    HotQuery('hr.attendance_summary (month)', ('attendance',), lambda: select(
+        Attendance.employee_id, func.sum(Attendance.working_hours)
+    ).where(
+        Attendance.attendance_date >= date.today().replace(day=1),
+        Attendance.attendance_date < date.today() + timedelta(days=1)
+    ).group_by(Attendance.employee_id)),
+    HotQuery('hr.payroll (month)', ('payrolls',), lambda: select(Payroll).where(
+        Payroll.year == date.today().year, Payroll.month == date.today().month
+    )),
+    HotQuery('inventory.warehouse_details (stock)', ('stocks',), lambda: select(Stock).where(
+        Stock.warehouse_id == 1
+    )),
+    HotQuery('security.dashboard (failed logins)', ('security_logs',), lambda: select(func.count(SecurityLog.id)).where(
+        SecurityLog.event_type == 'failed_login_wrong_password', SecurityLog.created_at >= _since(1)
+    )),
+    HotQuery('security.dashboard (failed logins by type)', ('security_logs',), lambda: select(func.count(SecurityLog.id)).where(
+        SecurityLog.event_type.in_(['failed_login_wrong_password', 'failed_login_unknown_user']),
+        SecurityLog.created_at >= _since(7)
+    )),
+    HotQuery('pos.close_session (orders)', ('pos_orders',), lambda: select(POSOrder).where(
+        POSOrder.session_id == 1, POSOrder.status == 'completed'
+    )),
+]
+
+
+def explain(statement):
+    """
+    Query plan of a statement on the configured database
+
+    Returns:
+        tuple: (plan lines, set of fully scanned table names)
+    """
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+        lines = [row[-1] for row in rows]
+        # "SCAN <table>" reads every row (or every entry of an index with
+        # "USING INDEX"); "SEARCH <table> USING INDEX" seeks the filter
+        scans = {line.split()[1] for line in lines if line.startswith('SCAN ')}
+        return lines, scans
+
+    if db.engine.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        document = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', params).scalar()
+        plan = (document if isinstance(document, list) else json.loads(document))[0]['Plan']
+        lines, scans = [], set()
+
+        def walk(node, depth):
+            relation = node.get('Relation Name')
+            lines.append('  ' * depth + node['Node Type'] + (f' on {relation}' if relation else ''))
+            if node['Node Type'] == 'Seq Scan':
+                scans.add(relation)
+            for child in node.get('Plans', ()):
+                walk(child, depth + 1)
+
+        walk(plan, 0)
+        return lines, scans
+
+    rows = connection.exec_driver_sql(f'EXPLAIN {compiled}', params).all()
+    return [' '.join(str(value) for value in row) for row in rows], set()
+
+
+def check_query_plans(queries=None):
+    """
+    Explain the hot queries (HOT_QUERIES by default)
+
+    Returns:
+        list: PlanCheck per query, ok is False when one of its tables is
+            fully scanned
+    """
+    checks = []
+    try:
+        for query in queries or HOT_QUERIES:
+            plan, scans = explain(query.build())
+            full_scans = sorted(scans & set(query.tables))
+            checks.append(PlanCheck(query.name, not full_scans, full_scans, plan))
+    finally:
+        db.session.rollback()
+    return checks
@@ -0,0 +1,173 @@
+"""
+Query Stats Helper Functions
+Per-request SQL instrumentation: query count and database time, N+1
+detection and the slow query log
+
+Engine events time every statement. Inside a request the totals are kept
+on the request (admins get them as X-DB-Queries / X-DB-Time headers), and
+a statement executed SQL_N_PLUS_ONE_THRESHOLD times with different
+parameters - typically a lazy load per row of a list, like
+`invoice.customer` in a template loop - is logged once with the route and
+the template (or Python) line that issued it. Statements slower than
+SQL_SLOW_QUERY_MS go to a rotating log file (without their parameters),
+requests or not.
+
+Routes have a query budget (SQL_QUERY_BUDGET, or @query_budget(n) on the
+view); with SQL_QUERY_BUDGET_ASSERT (testing) a request over its budget
+raises AssertionError so the test fails, otherwise it is logged.
+"""
+
+import logging
+import os
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger('app.slow_queries')
+
+_STATS_KEY = 'app.query_stats'
+_START_KEY = 'app.query_start'
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_THIS_FILE = os.path.abspath(__file__)
+
+
+class QueryStats:
+    """Statements of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0  # Seconds
+        self.statements = {}  # SQL -> executions
+        self.origins = {}  # SQL -> where its N+1 threshold was reached
+
+    def add(self, statement, duration, threshold):
+        self.count += 1
+        self.duration += duration
+        executions = self.statements.get(statement, 0) + 1
+        self.statements[statement] = executions
+        if executions == threshold:
+            self.origins[statement] = find_query_origin()
+
+    def repeated(self):
+        """(statement, executions, origin) of the statements that reached the N+1 threshold"""
+        return [(statement, self.statements[statement], origin) for statement, origin in self.origins.items()]
+
+
+def query_budget(limit):
+    """Set the query budget of a view (instead of SQL_QUERY_BUDGET)"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def get_query_stats():
+    """QueryStats of the current request (None outside requests or before its first query)"""
+    if not has_request_context():
+        return None
+    return request.environ.get(_STATS_KEY)
+
+
+def find_query_origin():
+    """Template line or application code line that issued the current statement"""
+    frame = sys._getframe(1)
+    code_line = None
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return f'{template.name or template.filename}:{template.get_corresponding_lineno(frame.f_lineno)}'
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if code_line is None and filename.startswith(_APP_DIR) and filename != _THIS_FILE:
+            code_line = f'{os.path.relpath(filename, os.path.dirname(_APP_DIR))}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return code_line or 'unknown'
+
+
+def init_query_stats(app):
+    """Time statements on every engine and report them per request"""
+    if not app.config.get('SQL_INSTRUMENTATION', True):
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    log_path = app.config.get('SQL_SLOW_QUERY_LOG')
+    if log_path and not any(getattr(handler, 'baseFilename', None) == os.path.abspath(log_path)
+                            for handler in slow_query_logger.handlers):
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        handler = RotatingFileHandler(log_path, maxBytes=app.config.get('SQL_SLOW_QUERY_LOG_BYTES', 5 * 1024 * 1024),
+                                      backupCount=app.config.get('SQL_SLOW_QUERY_LOG_BACKUPS', 5), encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_logger.addHandler(handler)
+        slow_query_logger.setLevel(logging.INFO)
+        slow_query_logger.propagate = False
+
+    app.after_request(_report_request_queries)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_START_KEY, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get(_START_KEY)
+    if not starts:
+        return
+    # Popped first: outside an app context the statement is not reported,
+    # but its start must not stay on the connection's stack
+    duration = time.perf_counter() - starts.pop()
+    if not has_app_context():
+        return
+    config = current_app.config
+
+    if has_request_context():
+        stats = request.environ.get(_STATS_KEY)
+        if stats is None:
+            stats = request.environ[_STATS_KEY] = QueryStats()
+        stats.add(statement, duration, config.get('SQL_N_PLUS_ONE_THRESHOLD', 10))
+
+    slow_ms = config.get('SQL_SLOW_QUERY_MS')
+    if slow_ms is not None and duration * 1000 >= slow_ms:
+        where = f'{request.method} {request.path} ({request.endpoint})' if has_request_context() else 'no request'
+        # Statement only: parameters can hold password hashes and personal data
+        slow_query_logger.info('%.1fms %s\n%s', duration * 1000, where, statement)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get(_START_KEY):
+        connection.info[_START_KEY].pop()
+
+
+def _report_request_queries(response):
+    from flask_login import current_user
+
+    show_headers = current_user.is_authenticated and current_user.is_admin
+    stats = request.environ.get(_STATS_KEY)
+    if stats is None:
+        return response
+
+    if show_headers:
+        response.headers['X-DB-Queries'] = str(stats.count)
+        response.headers['X-DB-Time'] = f'{stats.duration * 1000:.1f}ms'
+
+    for statement, executions, origin in stats.repeated():
+        logger.warning('Possible N+1 in %s (%s): %s executions of the same statement from %s: %s',
+                       request.endpoint, request.path, executions, origin, ' '.join(statement.split())[:300])
+
+    config = current_app.config
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', config.get('SQL_QUERY_BUDGET'))
+    if budget is not None and stats.count > budget:
+        message = f'{request.endpoint} ({request.path}) ran {stats.count} queries, over its budget of {budget}'
+        if config.get('SQL_QUERY_BUDGET_ASSERT'):
+            raise AssertionError(message)
+        logger.warning(message)
+    return response
@@ -0,0 +1,214 @@
+"""
+Rate Limit Helper Functions
+Sliding window counters with fixed memory per key and pluggable storage
+
+Each key holds three numbers: the start of the current fixed window and
+the hit counts of the current and previous windows. The count over the last
+window_seconds is estimated by weighting the previous window by the part of
+it still inside the sliding window, so a key never grows with its traffic
+(unlike a list of timestamps) and bursts at a window boundary are still
+limited.
+
+Backends (RATE_LIMIT_BACKEND):
+    memory: counters in this process, an LRU dict of at most
+        RATE_LIMIT_MAX_KEYS keys. With N worker processes a client may get N
+        times the limit, so use it for single-process deployments (portable
+        mode, development).
+    sqlite: counters in a SQLite file (RATE_LIMIT_SQLITE_PATH) shared by all
+        workers on the host. Every hit is one short IMMEDIATE transaction,
+        and keys beyond RATE_LIMIT_MAX_KEYS are evicted least recently used.
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# allowed: whether the hit was counted; remaining: hits left in the window;
+# reset_time: epoch seconds when a hit will be allowed again (if denied) or
+# the window ends (if allowed)
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'remaining', 'reset_time'])
+
+
+def sliding_window(counters, now, limit, window_seconds):
+    """
+    Apply one hit to a key's counters
+
+    Args:
+        counters: (window_start, current, previous) of the key, or None
+        now: Current epoch seconds
+        limit: Hits allowed per window_seconds
+        window_seconds: Length of the window
+
+    Returns:
+        tuple: (RateLimitResult, new counters)
+    """
+    window_start = math.floor(now / window_seconds) * window_seconds
+    current = previous = 0
+    if counters is not None:
+        stored_start, stored_current, stored_previous = counters
+        if stored_start == window_start:
+            current, previous = stored_current, stored_previous
+        elif stored_start == window_start - window_seconds:
+            previous = stored_current
+
+    elapsed = (now - window_start) / window_seconds
+    estimate = previous * (1 - elapsed) + current
+    window_end = window_start + window_seconds
+
+    if estimate + 1 > limit:
+        if current + 1 > limit:
+            # Not before the next window, where this one counts as previous
+            reset_time = window_end + window_seconds * (1 - max(limit - 1, 0) / current if current else 0)
+        else:
+            # When enough of the previous window has slid out
+            reset_time = window_start + window_seconds * (1 - (limit - 1 - current) / previous)
+        return RateLimitResult(False, 0, reset_time), (window_start, current, previous)
+
+    current += 1
+    remaining = max(0, int(limit - estimate - 1))
+    return RateLimitResult(True, remaining, window_end), (window_start, current, previous)
+
+
+class MemoryRateLimitBackend:
+    """Counters of this process, least recently used keys evicted beyond max_keys"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window_seconds, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            result, counters = sliding_window(self._counters.get(key), now, limit, window_seconds)
+            self._counters[key] = counters
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        return result
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._counters.clear()
+            else:
+                self._counters.pop(key, None)
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class SQLiteRateLimitBackend:
+    """Counters in a SQLite file shared by the worker processes of a host"""
+
+    # Inserting a key evicts least recently used keys once the table exceeds
+    # max_keys; checked every PRUNE_EVERY inserts of a process
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_keys=10000, timeout=5.0):
+        self.path = path
+        self.max_keys = max_keys
+        self.timeout = timeout
+        self._local = threading.local()
+        self._inserts = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().execute('PRAGMA journal_mode=WAL')
+        with self._transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limits ('
+                'key TEXT PRIMARY KEY, window_start REAL NOT NULL, current INTEGER NOT NULL, '
+                'previous INTEGER NOT NULL, last_seen REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_rate_limits_last_seen ON rate_limits (last_seen)')
+
+    def _connection(self):
+        # One connection per thread, never shared with a forked child
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def hit(self, key, limit, window_seconds, now=None):
+        now = time.time() if now is None else now
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT window_start, current, previous FROM rate_limits WHERE key = ?', (key,)
+            ).fetchone()
+            result, counters = sliding_window(row, now, limit, window_seconds)
+            if row is None:
+                connection.execute(
+                    'INSERT INTO rate_limits (key, window_start, current, previous, last_seen) VALUES (?, ?, ?, ?, ?)',
+                    (key, *counters, now)
+                )
+                self._inserts += 1
+                if self._inserts % self.PRUNE_EVERY == 0:
+                    self._evict(connection)
+            else:
+                connection.execute(
+                    'UPDATE rate_limits SET window_start = ?, current = ?, previous = ?, last_seen = ? WHERE key = ?',
+                    (*counters, now, key)
+                )
+        return result
+
+    def _evict(self, connection):
+        excess = connection.execute('SELECT COUNT(*) FROM rate_limits').fetchone()[0] - self.max_keys
+        if excess > 0:
+            connection.execute(
+                'DELETE FROM rate_limits WHERE key IN (SELECT key FROM rate_limits ORDER BY last_seen LIMIT ?)',
+                (excess,)
+            )
+            logger.info('Evicted %s rate limit keys', excess)
+
+    def reset(self, key=None):
+        with self._transaction() as connection:
+            if key is None:
+                connection.execute('DELETE FROM rate_limits')
+            else:
+                connection.execute('DELETE FROM rate_limits WHERE key = ?', (key,))
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM rate_limits').fetchone()[0]
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so concurrent read-modify-writes of a key serialize"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def create_rate_limit_backend(config):
+    """Backend configured by RATE_LIMIT_BACKEND"""
+    name = config.get('RATE_LIMIT_BACKEND', 'memory')
+    max_keys = config.get('RATE_LIMIT_MAX_KEYS', 10000)
+    if name == 'memory':
+        return MemoryRateLimitBackend(max_keys)
+    if name == 'sqlite':
+        return SQLiteRateLimitBackend(config['RATE_LIMIT_SQLITE_PATH'], max_keys)
+    raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {name}')
+
+
+def init_rate_limiter(app):
+    """Create the configured backend (app.extensions['rate_limiter'])"""
+    app.extensions['rate_limiter'] = create_rate_limit_backend(app.config)
@@ -0,0 +1,259 @@
+"""
+Rollup Helper Functions
+Incremental maintenance of the daily_rollups fact table and the grouped
+queries the dashboard and reports read from it
+
+Posting routes call post_sales_invoice / post_purchase_invoice with sign=1
+when an invoice is confirmed (or created paid by the POS) and sign=-1 when
+a posted invoice is cancelled or deleted, inside the same transaction.
+Invoice-level totals are spread over the lines in proportion to the line
+totals, so summing any slice of the table gives the invoice totals back.
+The cost of sales is taken from the unit cost frozen on each line when the
+stock was issued, so cost_amount is the COGS of any date range.
+"""
+
+from datetime import datetime
+from sqlalchemy import func, extract
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import selectinload
+from app import db
+from app.models_inventory import Product, Warehouse
+from app.models_sales import SalesInvoice
+from app.models_purchases import PurchaseInvoice
+from app.models_reports import DailyRollup
+from app.utils.job_helper import job_handler
+
+ROLLUP_KEY = ('kind', 'rollup_date', 'branch_id', 'warehouse_id', 'product_id')
+ROLLUP_MEASURES = ('invoice_count', 'quantity', 'net_amount', 'tax_amount', 'total_amount', 'cost_amount')
+
+# Invoice statuses that are included in the rollup
+POSTED_STATUSES = ('confirmed', 'paid')
+
+
+def post_sales_invoice(invoice, sign=1, lines=None):
+    """
+    Add (sign=1) or remove (sign=-1) a sales invoice from the daily rollup
+
+    Args:
+        invoice: SalesInvoice
+        sign: 1 when posting, -1 when cancelling or deleting
+        lines: Optional list of dicts (product_id, quantity, total and
+            optionally cost) when the items are not loaded as ORM objects
+    """
+    _apply_rows(_invoice_rows('sales', invoice, lines), sign)
+
+
+def post_purchase_invoice(invoice, sign=1, lines=None):
+    """Add (sign=1) or remove (sign=-1) a purchase invoice from the daily rollup"""
+    _apply_rows(_invoice_rows('purchases', invoice, lines), sign)
+
+
+def rebuild_rollups():
+    """
+    Recompute the whole rollup table from posted invoices (initial backfill
+    or repair). Runs in the caller's transaction.
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    db.session.query(DailyRollup).delete(synchronize_session=False)
+
+    merged = {}
+    for kind, model in (('sales', SalesInvoice), ('purchases', PurchaseInvoice)):
+        invoices = model.query.options(selectinload(model.items)).filter(
+            model.status.in_(POSTED_STATUSES)
+        ).order_by(model.id).yield_per(500)
+        for invoice in invoices:
+            _merge_rows(merged, _invoice_rows(kind, invoice), 1)
+
+    rows = list(merged.values())
+    if rows:
+        db.session.execute(DailyRollup.__table__.insert(), rows)
+    return len(rows)
+
+
+@job_handler('reports.rebuild_rollups')
+def rebuild_rollups_job(job):
+    return {'rows': rebuild_rollups()}
+
+
+def rollup_needs_backfill():
+    """True when posted invoices exist but the rollup table is still empty"""
+    if db.session.query(DailyRollup.id).first() is not None:
+        return False
+    return any(
+        db.session.query(model.id).filter(model.status.in_(POSTED_STATUSES)).first() is not None
+        for model in (SalesInvoice, PurchaseInvoice)
+    )
+
+
+# Queries
+
+def get_rollup_totals(kind, start_date, end_date, warehouse_id=None):
+    """
+    Sum every measure over a date range (inclusive)
+
+    Returns:
+        dict: invoice_count, quantity, net_amount, tax_amount, total_amount, cost_amount
+    """
+    query = db.session.query(*[func.coalesce(func.sum(getattr(DailyRollup, measure)), 0)
+                               for measure in ROLLUP_MEASURES])
+    query = _filter(query, kind, start_date, end_date, warehouse_id)
+    return dict(zip(ROLLUP_MEASURES, query.one()))
+
+
+def get_monthly_rollup(kind, start_date, end_date, warehouse_id=None):
+    """
+    Sum every measure per calendar month in one grouped query
+
+    Returns:
+        dict: (year, month) -> dict of measures (months without data are missing)
+    """
+    year = extract('year', DailyRollup.rollup_date)
+    month = extract('month', DailyRollup.rollup_date)
+    query = db.session.query(year, month, *[func.sum(getattr(DailyRollup, measure))
+                                            for measure in ROLLUP_MEASURES])
+    query = _filter(query, kind, start_date, end_date, warehouse_id).group_by(year, month)
+    return {(int(row[0]), int(row[1])): dict(zip(ROLLUP_MEASURES, row[2:])) for row in query}
+
+
+def get_top_products(kind, start_date, end_date, limit=5):
+    """
+    Products with the highest quantity in a date range
+
+    Returns:
+        list: (name, total_qty, net_amount) rows
+    """
+    query = db.session.query(
+        Product.name,
+        func.sum(DailyRollup.quantity).label('total_qty'),
+        func.sum(DailyRollup.net_amount).label('net_amount')
+    ).join(Product, Product.id == DailyRollup.product_id)
+    query = _filter(query, kind, start_date, end_date)
+    return query.group_by(Product.id, Product.name).order_by(func.sum(DailyRollup.quantity).desc()).limit(limit).all()
+
+
+def get_rollup_years(kind):
+    """Years that have rollup data, newest first"""
+    year = extract('year', DailyRollup.rollup_date)
+    rows = db.session.query(year).filter(
+        DailyRollup.kind == kind, DailyRollup.invoice_count != 0
+    ).group_by(year).order_by(year.desc())
+    return [int(row[0]) for row in rows]
+
+
+def _filter(query, kind, start_date, end_date, warehouse_id=None):
+    query = query.filter(DailyRollup.kind == kind)
+    if start_date is not None:
+        query = query.filter(DailyRollup.rollup_date >= start_date)
+    if end_date is not None:
+        query = query.filter(DailyRollup.rollup_date <= end_date)
+    if warehouse_id:
+        query = query.filter(DailyRollup.warehouse_id == warehouse_id)
+    return query
+
+
+# Maintenance
+
+def _invoice_rows(kind, invoice, lines=None):
+    """Split an invoice into rollup rows keyed by (date, branch, warehouse, product)"""
+    if lines is None:
+        lines = [{'product_id': item.product_id, 'quantity': item.quantity, 'total': item.total,
+                  'cost': _frozen_cost(item)}
+                 for item in invoice.items]
+
+    if kind == 'sales':
+        # Lines posted before costs were frozen fall back to the current cost price
+        missing = {line['product_id'] for line in lines if line.get('cost') is None}
+        cost_prices = dict(
+            db.session.query(Product.id, Product.cost_price).filter(Product.id.in_(missing))
+        ) if missing else {}
+
+    warehouse = db.session.get(Warehouse, invoice.warehouse_id) if invoice.warehouse_id else None
+    key = {
+        'kind': kind,
+        'rollup_date': invoice.invoice_date,
+        'branch_id': (warehouse.branch_id if warehouse else None) or 0,
+        'warehouse_id': invoice.warehouse_id or 0,
+    }
+    total_amount = invoice.total_amount or 0
+    tax_amount = invoice.tax_amount or 0
+
+    if not lines:
+        return [dict(key, product_id=0, invoice_count=1, quantity=0,
+                     net_amount=total_amount - tax_amount, tax_amount=tax_amount,
+                     total_amount=total_amount, cost_amount=0)]
+
+    weights = [max(line['total'] or 0, 0) for line in lines]
+    total_weight = sum(weights)
+
+    rows = []
+    for position, (line, weight) in enumerate(zip(lines, weights)):
+        share = weight / total_weight if total_weight else 1 / len(lines)
+        quantity = line['quantity'] or 0
+        cost = 0
+        if kind == 'sales':
+            cost = line.get('cost')
+            if cost is None:
+                cost = (cost_prices.get(line['product_id']) or 0) * quantity
+        rows.append(dict(
+            key,
+            product_id=line['product_id'] or 0,
+            invoice_count=1 if position == 0 else 0,
+            quantity=quantity,
+            net_amount=(total_amount - tax_amount) * share,
+            tax_amount=tax_amount * share,
+            total_amount=total_amount * share,
+            cost_amount=cost
+        ))
+    return rows
+
+
+def _frozen_cost(item):
+    """Cost of a sales line from its frozen unit cost (None when not recorded)"""
+    unit_cost = getattr(item, 'unit_cost', None)
+    if unit_cost is None:
+        return None
+    return unit_cost * (item.quantity or 0)
+
+
+def _merge_rows(merged, rows, sign):
+    """Add rows into a dict keyed by the rollup key, multiplying measures by sign"""
+    for row in rows:
+        key = tuple(row[column] for column in ROLLUP_KEY)
+        target = merged.get(key)
+        if target is None:
+            merged[key] = target = {column: row[column] for column in ROLLUP_KEY}
+            target.update(dict.fromkeys(ROLLUP_MEASURES, 0))
+        for measure in ROLLUP_MEASURES:
+            target[measure] += sign * row[measure]
+    return merged
+
+
+def _apply_rows(rows, sign):
+    """Increment rollup rows in the current transaction (upsert per key)"""
+    rows = list(_merge_rows({}, rows, sign).values())
+    if not rows:
+        return
+
+    table = DailyRollup.__table__
+    dialect = db.engine.dialect.name
+    now = datetime.utcnow()
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert(table) if dialect == 'postgresql' else sqlite.insert(table)
+        statement = insert.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY),
+            set_=dict({measure: table.c[measure] + insert.excluded[measure] for measure in ROLLUP_MEASURES},
+                      updated_at=now)
+        )
+        db.session.execute(statement, rows)
+        return
+
+    for row in rows:
+        condition = [table.c[column] == row[column] for column in ROLLUP_KEY]
+        updated = db.session.execute(table.update().where(*condition).values(
+            dict({measure: table.c[measure] + row[measure] for measure in ROLLUP_MEASURES}, updated_at=now)
+        ))
+        if updated.rowcount == 0:
+            db.session.execute(table.insert().values(**row))
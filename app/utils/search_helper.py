@@ -0,0 +1,449 @@
+"""
+Search Helper Functions
+In-process product search index: exact code/barcode lookup, prefix search
+over normalized Arabic/English names and trigram substring matching
+
+Each worker builds its index in a background thread started with its first
+request; until the index is ready searches run as SQL LIKE queries. The
+index is kept in sync with ORM changes to Product when the session
+commits, and the thread picks up changes made by other processes (or by
+bulk SQL statements) by comparing the catalogue version every
+PRODUCT_SEARCH_REFRESH_SECONDS. A full rebuild is built aside and swapped
+in, so searches never wait for it. With PRODUCT_SEARCH_BUILD_INLINE
+(tests) the index is built and refreshed inside the request instead.
+"""
+
+import gc
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict, namedtuple
+from flask import current_app, has_app_context
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import event, or_
+from app import db
+from app.models_inventory import Product
+from app.utils.catalogue_helper import get_catalogue_version, parse_catalogue_version
+
+ProductEntry = namedtuple('ProductEntry', [
+    'id', 'code', 'barcode', 'name', 'name_en', 'selling_price', 'cost_price', 'tax_rate',
+    'category_id', 'is_active', 'is_sellable', 'is_purchasable'
+])
+
+_ENTRY_COLUMNS = [getattr(Product, field) for field in ProductEntry._fields]
+
+# Tashkeel, superscript alef and tatweel are dropped; letter variants and digits are unified
+_CHAR_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    **{chr(mark): None for mark in range(0x064B, 0x0653)},
+    '\u0670': None, '\u0640': None,
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+})
+_SEPARATORS = re.compile(r'[\s\-_/\\.,;:()\[\]]+')
+
+_PENDING_KEY = 'product_search_pending'
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(value):
+    """Normalize text for matching (case, Arabic letter variants, digits, spacing)"""
+    if not value:
+        return ''
+    value = str(value).casefold()
+    if not value.isascii():
+        value = value.translate(_CHAR_MAP)
+    return _SEPARATORS.sub(' ', value).strip()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductSearchIndex:
+    """Code/barcode hash maps, a sorted prefix list and a trigram map over products"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}      # id -> ProductEntry
+        self._texts = {}        # id -> normalized texts used for substring matching
+        self._codes = {}        # normalized code -> id
+        self._barcodes = {}     # normalized barcode -> set of ids (barcodes are not unique)
+        self._prefixes = []     # sorted (token, id)
+        self._trigram_map = defaultdict(set)  # trigram -> set of ids
+        self.version = None
+        self._checked_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Maintenance
+
+    @property
+    def ready(self):
+        """Whether the index has been built"""
+        return self.version is not None
+
+    def refresh(self, max_age=0):
+        """Bring the index up to date with the database if it may be stale"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < max_age:
+            return
+
+        version = get_catalogue_version(None)
+        if version != self.version:
+            count = int(version.rsplit('-', 1)[1])
+            since = parse_catalogue_version(self.version)
+            if since is None:
+                self._rebuild()
+            else:
+                # >= so rows written in the same microsecond are reloaded rather than missed
+                self.apply({row.id: ProductEntry(*row) for row in
+                            db.session.query(*_ENTRY_COLUMNS).filter(Product.updated_at >= since)})
+                if len(self._entries) != count:
+                    self._rebuild()  # Products were deleted outside the ORM
+            # Changes committed during a rebuild are newer than this version
+            # and are reloaded by the next refresh
+            self.version = version
+        self._checked_at = now
+
+    def _rebuild(self):
+        """Build a new index aside (searches keep using the current one) and swap it in"""
+        fresh = ProductSearchIndex()
+
+        # The build allocates millions of small objects; pausing the cyclic
+        # garbage collector meanwhile makes the build much faster
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            prefixes = []
+            for row in db.session.query(*_ENTRY_COLUMNS).yield_per(5000):
+                prefixes.extend(fresh._add(ProductEntry(*row), sort=False))
+            prefixes.sort()
+            fresh._prefixes = prefixes
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        with self._lock:
+            self._entries = fresh._entries
+            self._texts = fresh._texts
+            self._codes = fresh._codes
+            self._barcodes = fresh._barcodes
+            self._prefixes = fresh._prefixes
+            self._trigram_map = fresh._trigram_map
+
+    def apply(self, changes):
+        """Apply product changes: id -> ProductEntry, or None for a deleted product"""
+        with self._lock:
+            for product_id, entry in changes.items():
+                self._remove(product_id)
+                if entry is not None:
+                    self._add(entry)
+
+    @staticmethod
+    def _keys(entry):
+        """Normalized code, barcode, match texts, prefix tokens and trigrams of a product"""
+        code = normalize_text(entry.code)
+        barcode = normalize_text(entry.barcode)
+        # Names and code are matched anywhere; barcodes only exactly or by prefix
+        texts = tuple(text for text in (normalize_text(entry.name), normalize_text(entry.name_en), code) if text)
+
+        tokens = set(texts)
+        tokens.add(barcode)
+        trigrams = set()
+        for text in texts:
+            tokens.update(text.split(' '))
+            trigrams.update(_trigrams(text))
+        tokens.discard('')
+        return code, barcode, texts, tokens, trigrams
+
+    def _add(self, entry, sort=True):
+        code, barcode, texts, tokens, trigrams = self._keys(entry)
+        product_id = entry.id
+        self._entries[product_id] = entry
+        self._texts[product_id] = texts
+
+        if code:
+            self._codes[code] = product_id
+        if barcode:
+            self._barcodes.setdefault(barcode, set()).add(product_id)
+
+        trigram_map = self._trigram_map
+        for trigram in trigrams:
+            trigram_map[trigram].add(product_id)
+
+        prefixes = [(token, product_id) for token in tokens]
+        if sort:
+            for prefix in prefixes:
+                insort(self._prefixes, prefix)
+        return prefixes
+
+    def _remove(self, product_id):
+        entry = self._entries.pop(product_id, None)
+        if entry is None:
+            return
+        del self._texts[product_id]
+        code, barcode, _texts, tokens, trigrams = self._keys(entry)
+
+        if self._codes.get(code) == product_id:
+            del self._codes[code]
+        if barcode in self._barcodes:
+            self._barcodes[barcode].discard(product_id)
+            if not self._barcodes[barcode]:
+                del self._barcodes[barcode]
+
+        for trigram in trigrams:
+            ids = self._trigram_map.get(trigram)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._trigram_map[trigram]
+
+        for token in tokens:
+            position = bisect_left(self._prefixes, (token, product_id))
+            if position < len(self._prefixes) and self._prefixes[position] == (token, product_id):
+                del self._prefixes[position]
+
+    # Queries
+
+    def lookup(self, code):
+        """Exact code or barcode match (code first)"""
+        key = normalize_text(code)
+        product_id = self._codes.get(key)
+        if product_id is None:
+            ids = self._barcodes.get(key)
+            product_id = min(ids) if ids else None
+        return self._entries.get(product_id)
+
+    def search(self, query, limit=20, predicate=None):
+        """
+        Rank products for a query: exact code/barcode, then name/code prefix,
+        then substring (trigram) matches
+
+        Returns:
+            list: product ids, best match first (all matches when limit is None)
+        """
+        text = normalize_text(query)
+        if not text:
+            return []
+
+        results = []
+        seen = set()
+
+        def collect(product_id):
+            if product_id in seen:
+                return False
+            seen.add(product_id)
+            entry = self._entries.get(product_id)
+            if entry is not None and (predicate is None or predicate(entry)):
+                results.append(product_id)
+            return limit is not None and len(results) >= limit
+
+        with self._lock:
+            exact = [self._codes[text]] if text in self._codes else []
+            exact.extend(sorted(self._barcodes.get(text, ())))
+            for product_id in exact:
+                if collect(product_id):
+                    return results
+
+            position = bisect_left(self._prefixes, (text,))
+            while position < len(self._prefixes) and self._prefixes[position][0].startswith(text):
+                if collect(self._prefixes[position][1]):
+                    return results
+                position += 1
+
+            if len(text) >= 3:
+                sets = sorted((self._trigram_map.get(trigram, set()) for trigram in _trigrams(text)), key=len)
+                candidates = sets[0].intersection(*sets[1:]) if sets[0] else set()
+                for product_id in sorted(candidates - seen):
+                    if any(text in candidate for candidate in self._texts[product_id]):
+                        if collect(product_id):
+                            return results
+
+        return results
+
+    def entries(self, ids):
+        return [self._entries[product_id] for product_id in ids if product_id in self._entries]
+
+
+def get_product_index():
+    """Get the current app's product search index, or None while it is being built"""
+    index = current_app.extensions['product_search']
+    if current_app.config.get('PRODUCT_SEARCH_BUILD_INLINE'):
+        index.refresh(current_app.config.get('PRODUCT_SEARCH_REFRESH_SECONDS', 10))
+    return index if index.ready else None
+
+
+def search_products(query, limit=20, scope=None, category_id=None, include_inactive=False):
+    """
+    Search products through the in-process index (SQL until it is ready)
+
+    Args:
+        query: Name (Arabic or English), code or barcode, or a part of them
+        limit: Maximum number of results (None for all matches)
+        scope: 'sales' or 'purchases' to keep sellable/purchasable products only
+        category_id: Restrict to a category
+        include_inactive: Also return inactive products
+
+    Returns:
+        list: ProductEntry tuples, best match first
+    """
+    index = get_product_index()
+    if index is None:
+        return _search_products_sql(query, limit, scope, category_id, include_inactive)
+
+    def predicate(entry):
+        if not include_inactive and not entry.is_active:
+            return False
+        if scope == 'sales' and not entry.is_sellable:
+            return False
+        if scope == 'purchases' and not entry.is_purchasable:
+            return False
+        return category_id is None or entry.category_id == category_id
+
+    return index.entries(index.search(query, limit, predicate))
+
+
+def lookup_product(code, include_inactive=False):
+    """Find a product by exact code or barcode (ProductEntry or None)"""
+    index = get_product_index()
+    if index is not None:
+        entry = index.lookup(code)
+    else:
+        entry = None
+        if code:
+            row = db.session.query(*_ENTRY_COLUMNS).filter(Product.code == code).first() or \
+                db.session.query(*_ENTRY_COLUMNS).filter(Product.barcode == code).order_by(Product.id).first()
+            entry = ProductEntry(*row) if row is not None else None
+    if entry is None or (not include_inactive and not entry.is_active):
+        return None
+    return entry
+
+
+def _search_products_sql(query, limit, scope, category_id, include_inactive):
+    """LIKE search used while the index is not ready (no Arabic normalization or ranking)"""
+    query = (query or '').strip()
+    if not query:
+        return []
+
+    rows = db.session.query(*_ENTRY_COLUMNS).filter(or_(
+        Product.code.contains(query, autoescape=True),
+        Product.barcode.contains(query, autoescape=True),
+        Product.name.contains(query, autoescape=True),
+        Product.name_en.contains(query, autoescape=True)
+    ))
+    if not include_inactive:
+        rows = rows.filter(Product.is_active.is_(True))
+    if scope == 'sales':
+        rows = rows.filter(Product.is_sellable.is_(True))
+    elif scope == 'purchases':
+        rows = rows.filter(Product.is_purchasable.is_(True))
+    if category_id is not None:
+        rows = rows.filter(Product.category_id == category_id)
+    rows = rows.order_by(Product.code)
+    if limit is not None:
+        rows = rows.limit(limit)
+    return [ProductEntry(*row) for row in rows]
+
+
+class ProductSearchPagination(Pagination):
+    """Paginate ranked search results, loading only the products of the current page"""
+
+    def _query_items(self):
+        ids = self._query_args['ids'][self._query_offset:self._query_offset + self.per_page]
+        products = {product.id: product for product in Product.query.filter(Product.id.in_(ids))}
+        return [products[product_id] for product_id in ids if product_id in products]
+
+    def _query_count(self):
+        return len(self._query_args['ids'])
+
+
+def paginate_search_results(entries, page, per_page=20):
+    """Pagination object (like Query.paginate) over a list of ProductEntry results"""
+    return ProductSearchPagination(page=page, per_page=per_page, error_out=False,
+                                   ids=[entry.id for entry in entries])
+
+
+class ProductSearchRefresher:
+    """Daemon thread of one process building and refreshing the search index, started once on demand"""
+
+    def __init__(self, app, index, interval):
+        self.app = app
+        self.index = index
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # A forked process inherits the refresher (and maybe an index) but not its thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='product-search', daemon=True).start()
+
+    def _run(self):
+        stop = threading.Event()
+        while True:
+            try:
+                with self.app.app_context():
+                    started = time.perf_counter()
+                    building = not self.index.ready
+                    self.index.refresh()
+                    if building:
+                        logger.info('Product search index built: %s products in %.1fs',
+                                    len(self.index), time.perf_counter() - started)
+            except Exception:
+                logger.exception('Product search index refresh failed')
+            if stop.wait(self.interval):
+                return
+
+
+def init_product_search(app):
+    """Create the app's search index, built in the background and kept in sync with committed product changes"""
+    index = app.extensions['product_search'] = ProductSearchIndex()
+
+    if not app.config.get('PRODUCT_SEARCH_BUILD_INLINE'):
+        refresher = ProductSearchRefresher(app, index, app.config.get('PRODUCT_SEARCH_REFRESH_SECONDS', 10))
+        app.extensions['product_search_refresher'] = refresher
+        app.before_request(refresher.start)
+
+    if not event.contains(db.session, 'after_flush', _collect_product_changes):
+        event.listen(db.session, 'after_flush', _collect_product_changes)
+        event.listen(db.session, 'after_commit', _apply_product_changes)
+        event.listen(db.session, 'after_rollback', _discard_product_changes)
+
+
+def _collect_product_changes(session, flush_context):
+    """Remember flushed product rows until the transaction commits"""
+    pending = None
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(instance, Product):
+            continue
+        if pending is None:
+            pending = session.info.setdefault(_PENDING_KEY, {})
+        if instance in session.deleted:
+            pending[instance.id] = None
+        else:
+            pending[instance.id] = ProductEntry(*(getattr(instance, field) for field in ProductEntry._fields))
+
+
+def _apply_product_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending or not has_app_context():
+        return
+    index = current_app.extensions.get('product_search')
+    if index is not None and index.ready:
+        index.apply(pending)
+
+
+def _discard_product_changes(session):
+    session.info.pop(_PENDING_KEY, None)
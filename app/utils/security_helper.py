@@ -9,17 +9,14 @@ from flask_login import current_user
 from datetime import datetime, timedelta
 from app import db
 from app.models import SecurityLog, IPWhitelist, SessionLog
+from app.utils.rate_limit_helper import MemoryRateLimitBackend
 import time
 
-# Rate limiting storage (in-memory, use Redis in production)
-_rate_limit_storage = {}
+# Used by apps without init_rate_limiter (the configured backend is app.extensions['rate_limiter'])
+_default_rate_limiter = MemoryRateLimitBackend()
 
 def get_client_ip():
-    """Get client IP address"""
-    if request.headers.get('X-Forwarded-For'):
-        return request.headers.get('X-Forwarded-For').split(',')[0].strip()
-    elif request.headers.get('X-Real-IP'):
-        return request.headers.get('X-Real-IP')
+    """Get client IP address (resolved from trusted proxies by ProxyFix, see TRUSTED_PROXY_COUNT)"""
     return request.remote_addr or '0.0.0.0'
 
 def is_ip_whitelisted(ip_address):
@@ -29,7 +26,7 @@ def is_ip_whitelisted(ip_address):
 
 def check_rate_limit(key, max_requests=10, window_seconds=60):
     """
-    Check if rate limit is exceeded
+    Check if rate limit is exceeded (and count the request if not)
     
     Args:
         key: Unique identifier (e.g., IP address, user ID)
@@ -39,32 +36,9 @@ def check_rate_limit(key, max_requests=10, window_seconds=60):
     Returns:
         tuple: (is_allowed, remaining_requests, reset_time)
     """
-    now = time.time()
-    window_start = now - window_seconds
-    
-    # Clean old entries
-    if key in _rate_limit_storage:
-        _rate_limit_storage[key] = [
-            timestamp for timestamp in _rate_limit_storage[key]
-            if timestamp > window_start
-        ]
-    else:
-        _rate_limit_storage[key] = []
-    
-    # Check limit
-    current_requests = len(_rate_limit_storage[key])
-    
-    if current_requests >= max_requests:
-        oldest_request = min(_rate_limit_storage[key])
-        reset_time = oldest_request + window_seconds
-        return False, 0, reset_time
-    
-    # Add current request
-    _rate_limit_storage[key].append(now)
-    remaining = max_requests - (current_requests + 1)
-    reset_time = now + window_seconds
-    
-    return True, remaining, reset_time
+    backend = current_app.extensions.get('rate_limiter') or _default_rate_limiter
+    result = backend.hit(f'{key}:{window_seconds}', max_requests, window_seconds)
+    return result.allowed, result.remaining, result.reset_time
 
 def rate_limit(max_requests=10, window_seconds=60, by_ip=True):
     """
@@ -0,0 +1,142 @@
+"""
+Sequence Helper Functions
+Allocate document numbers (invoices, orders, journal entries, sessions)
+from the document_sequences counter table
+"""
+
+import threading
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, func
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models_settings import DocumentSequence
+
+# Process-local blocks of pre-allocated numbers: (prefix, period) -> [next, last]
+_sequence_blocks = {}
+_sequence_lock = threading.Lock()
+
+
+def next_document_number(prefix, period_format='%Y%m', width=4, column=None, block_size=None):
+    """
+    Allocate the next document number for a prefix in the current period
+
+    Args:
+        prefix: Document prefix (e.g. 'INV', 'JE')
+        period_format: strftime format of the period part ('' for no period)
+        width: Minimum number of digits; numbers grow past it instead of wrapping
+        column: Document number column, used once to seed a new counter from
+            numbers that were issued before the counter existed
+        block_size: Numbers reserved per round-trip and handed out from memory
+            (defaults to DOCUMENT_SEQUENCE_BLOCK_SIZE)
+
+    Returns:
+        str: e.g. INV2026010001, INV20260110000 after 9999
+    """
+    period = datetime.utcnow().strftime(period_format) if period_format else ''
+    value = next_sequence_value(prefix, period, width, column, block_size)
+    return f'{prefix}{period}{value:0{width}d}'
+
+
+def next_sequence_value(prefix, period='', width=4, column=None, block_size=None):
+    """Allocate the next integer value of a (prefix, period) counter"""
+    if block_size is None:
+        block_size = current_app.config.get('DOCUMENT_SEQUENCE_BLOCK_SIZE', 1)
+
+    # SQLite has a single writer, so the counter shares the caller's
+    # transaction (a rollback also rolls back the number and no block can
+    # be handed out twice). Server databases increment in their own short
+    # transaction so the counter row is never locked while a document is
+    # being written.
+    if db.engine.dialect.name == 'sqlite':
+        connection = db.session.connection()
+        return _increment_counter(connection, prefix, period, 1, width, column)
+
+    key = (prefix, period)
+    with _sequence_lock:
+        block = _sequence_blocks.get(key)
+        if block and block[0] <= block[1]:
+            value = block[0]
+            block[0] += 1
+            return value
+
+        with db.engine.begin() as connection:
+            last = _increment_counter(connection, prefix, period, block_size, width, column)
+
+        first = last - block_size + 1
+        _sequence_blocks[key] = [first + 1, last]
+        return first
+
+
+def reserve_sequence_block(prefix, period='', count=1, width=4, column=None):
+    """
+    Reserve a block of consecutive counter values in one round-trip
+
+    Returns:
+        tuple: (first, last) values of the reserved block
+    """
+    if db.engine.dialect.name == 'sqlite':
+        last = _increment_counter(db.session.connection(), prefix, period, count, width, column)
+    else:
+        with db.engine.begin() as connection:
+            last = _increment_counter(connection, prefix, period, count, width, column)
+    return last - count + 1, last
+
+
+def _increment_counter(connection, prefix, period, count, width, column):
+    """Atomically add count to a counter, creating it on first use"""
+    last = _update_counter(connection, prefix, period, count)
+    if last is None:
+        seed = _seed_value(connection, prefix + period, width, column)
+        _insert_counter(connection, prefix, period, seed)
+        last = _update_counter(connection, prefix, period, count)
+    return last
+
+
+def _update_counter(connection, prefix, period, count):
+    """Increment an existing counter row and return its new value"""
+    table = DocumentSequence.__table__
+    condition = (table.c.prefix == prefix) & (table.c.period == period)
+    statement = table.update().where(condition).values(
+        last_value=table.c.last_value + count,
+        updated_at=datetime.utcnow()
+    )
+
+    if connection.dialect.update_returning:
+        return connection.execute(statement.returning(table.c.last_value)).scalar()
+
+    if connection.execute(statement).rowcount == 0:
+        return None
+    return connection.execute(select(table.c.last_value).where(condition)).scalar()
+
+
+def _insert_counter(connection, prefix, period, seed):
+    """Create a counter row, ignoring a concurrent insert of the same key"""
+    table = DocumentSequence.__table__
+    values = dict(prefix=prefix, period=period, last_value=seed, updated_at=datetime.utcnow())
+
+    if connection.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(**values).on_conflict_do_nothing()
+    elif connection.dialect.name == 'sqlite':
+        statement = sqlite.insert(table).values(**values).on_conflict_do_nothing()
+    else:
+        statement = table.insert().values(**values)
+    connection.execute(statement)
+
+
+def _seed_value(connection, number_prefix, width, column):
+    """Find the highest number already issued for a prefix (legacy documents)"""
+    if column is None:
+        return 0
+
+    last_number = connection.execute(
+        select(func.max(column)).where(
+            column.like(f'{number_prefix}%'),
+            func.length(column) == len(number_prefix) + width
+        )
+    ).scalar()
+
+    try:
+        return int(last_number[len(number_prefix):]) if last_number else 0
+    except ValueError:
+        return 0
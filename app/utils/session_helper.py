@@ -0,0 +1,171 @@
+"""
+Session Helper Functions
+Server-side sessions stored in the database (server_sessions table)
+
+Replaces the Flask-Session filesystem store, so all workers on all hosts
+share the sessions without sticky routing. The cookie holds a random
+session id and the row is keyed by its SHA-256, so the table holds no
+usable ids. A session is written back only when its serialized data
+changed or its expiry needs extending (at most every SESSION_TOUCH_SECONDS,
+instead of on every request), and a daemon thread per process deletes
+expired rows through the expires_at index every SESSION_SWEEP_SECONDS.
+
+The store uses its own connections, never the request's db.session
+transaction. It runs on the application database, or on a separate one
+given by SESSION_DATABASE_URI (e.g. a local SQLite file in portable mode).
+"""
+
+import hashlib
+import logging
+import os
+import secrets
+import threading
+from datetime import datetime, timedelta
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import create_engine, delete, insert, select, update
+from werkzeug.datastructures import CallbackDict
+from app import db
+from app.models import ServerSession
+
+logger = logging.getLogger(__name__)
+
+_table = ServerSession.__table__
+
+
+class DatabaseSession(CallbackDict, SessionMixin):
+    """Session dict that remembers the data it was loaded with"""
+
+    def __init__(self, initial=None, sid=None, new=False, serialized=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.serialized = serialized
+        self.expires_at = expires_at
+
+
+class DatabaseSessionInterface(SessionInterface):
+    """Flask session interface backed by the server_sessions table"""
+
+    session_class = DatabaseSession
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, database_uri=None, touch_seconds=300):
+        self.touch = timedelta(seconds=touch_seconds)
+        self._engine = None
+        if database_uri:
+            self._engine = create_engine(database_uri)
+            _table.create(self._engine, checkfirst=True)
+
+    @property
+    def engine(self):
+        return self._engine if self._engine is not None else db.engine
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with self.engine.connect() as connection:
+                row = connection.execute(select(_table.c.data, _table.c.expires_at).where(
+                    _table.c.id == _session_key(sid), _table.c.expires_at > datetime.utcnow()
+                )).first()
+            if row is not None:
+                try:
+                    data = self.serializer.loads(row.data)
+                except ValueError:
+                    logger.warning('Discarding unreadable session data')
+                else:
+                    return self.session_class(data, sid=sid, serialized=row.data, expires_at=row.expires_at)
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if not session.new:
+                # Emptied (e.g. logout): drop the row and the cookie
+                with self.engine.begin() as connection:
+                    connection.execute(delete(_table).where(_table.c.id == _session_key(session.sid)))
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+                response.vary.add('Cookie')
+            return
+
+        now = datetime.utcnow()
+        lifetime = app.permanent_session_lifetime
+        serialized = self.serializer.dumps(dict(session))
+        expiring = session.expires_at is None or session.expires_at - now < lifetime - self.touch
+        if serialized == session.serialized and not expiring:
+            return
+
+        values = {'data': serialized, 'expires_at': now + lifetime, 'updated_at': now}
+        key = _session_key(session.sid)
+        with self.engine.begin() as connection:
+            # The row may have been swept since the session was loaded
+            if session.new or not connection.execute(update(_table).where(_table.c.id == key).values(**values)).rowcount:
+                connection.execute(insert(_table).values(id=key, **values))
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        response.vary.add('Cookie')
+
+
+def sweep_expired_sessions(engine=None):
+    """Delete expired session rows; returns the number deleted"""
+    with (engine or db.engine).begin() as connection:
+        return connection.execute(delete(_table).where(_table.c.expires_at <= datetime.utcnow())).rowcount
+
+
+class SessionSweeper:
+    """Daemon thread of one process deleting expired sessions, started once on demand"""
+
+    def __init__(self, app, interface, interval):
+        self.app = app
+        self.interface = interface
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # A forked process inherits the sweeper but not its thread
+        if self._pid == os.getpid() or self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='session-sweeper', daemon=True).start()
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    count = sweep_expired_sessions(self.interface.engine)
+                if count:
+                    logger.info('Deleted %s expired sessions', count)
+            except Exception:
+                logger.exception('Session sweep failed')
+
+
+def init_sessions(app):
+    """Store sessions in the database and sweep expired ones in the background"""
+    interface = DatabaseSessionInterface(app.config.get('SESSION_DATABASE_URI'),
+                                         app.config.get('SESSION_TOUCH_SECONDS', 300))
+    app.session_interface = interface
+
+    sweeper = SessionSweeper(app, interface, app.config.get('SESSION_SWEEP_SECONDS', 900))
+    app.extensions['session_sweeper'] = sweeper
+    app.before_request(sweeper.start)
+
+
+def _session_key(sid):
+    return hashlib.sha256(sid.encode('utf-8')).hexdigest()
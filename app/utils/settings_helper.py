@@ -0,0 +1,112 @@
+"""
+Settings Helper Functions
+Cached access to singleton configuration rows (Company, AccountingSettings)
+
+Lookups are memoized for the current request in flask.g and shared between
+requests through a process-wide cache of the row's column values. The
+first lookup of a request checks the cached copy against the row's id and
+updated_at (one single-row query), so a change saved by any worker
+is seen by all workers with their next request. Routes that change these
+rows call invalidate_settings_cache() after committing, which also drops
+the copy of the current request.
+"""
+
+import threading
+from flask import g, current_app, has_app_context
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app import db
+from app.models import Company
+from app.models_settings import AccountingSettings
+
+# Process-wide cache: table name -> column values of the row
+_settings_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_company():
+    """Get the company row (or None), cached per request and per process"""
+    return _get_singleton(Company)
+
+
+def get_accounting_settings():
+    """Get the accounting settings row (or None), cached per request and per process"""
+    return _get_singleton(AccountingSettings)
+
+
+def get_currency_info():
+    """
+    Get the active currency from the company settings
+
+    Returns:
+        dict: code, symbol and name (from the CURRENCIES config)
+    """
+    memo = _request_memo()
+    if 'currency' in memo:
+        return memo['currency']
+
+    try:
+        company = get_company()
+        currency_code = company.currency if company and company.currency else \
+            current_app.config.get('DEFAULT_CURRENCY', 'SAR')
+    except Exception:
+        # Fallback if database is not available
+        currency_code = 'SAR'
+
+    currency_info = current_app.config['CURRENCIES'].get(currency_code, {})
+    memo['currency'] = {
+        'code': currency_code,
+        'symbol': currency_info.get('symbol', 'ر.س'),
+        'name': currency_info.get('name', currency_code)
+    }
+    return memo['currency']
+
+
+def invalidate_settings_cache():
+    """Drop cached settings after Company or AccountingSettings changed"""
+    with _cache_lock:
+        _settings_cache.clear()
+    if has_app_context():
+        g.pop('_settings_memo', None)
+
+
+def _request_memo():
+    """Per-request memo dict (a throwaway dict outside an app context)"""
+    if not has_app_context():
+        return {}
+    if '_settings_memo' not in g:
+        g._settings_memo = {}
+    return g._settings_memo
+
+
+def _get_singleton(model):
+    """Return the first row of a singleton table attached to the current session"""
+    key = model.__tablename__
+    memo = _request_memo()
+    if key in memo:
+        return memo[key]
+
+    stamp = db.session.query(model.id, model.updated_at).first()
+    with _cache_lock:
+        values = _settings_cache.get(key)
+
+    if stamp is None:
+        instance = None
+    elif values is not None and values['id'] == stamp.id and values['updated_at'] == stamp.updated_at:
+        # Rebuild the row from cached values and attach it without a query
+        instance = model(**values)
+        make_transient_to_detached(instance)
+        instance = db.session.merge(instance, load=False)
+    else:
+        instance = db.session.get(model, stamp.id)
+        with _cache_lock:
+            _settings_cache[key] = _column_values(instance)
+
+    memo[key] = instance
+    return instance
+
+
+def _column_values(instance):
+    """Snapshot the column attributes of a loaded ORM instance"""
+    mapper = inspect(instance).mapper
+    return {attr.key: getattr(instance, attr.key) for attr in mapper.column_attrs}
@@ -0,0 +1,138 @@
+"""
+Stock Helper Functions
+Set-based stock aggregation used by the dashboard and inventory reports
+"""
+
+from sqlalchemy import func, case
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models_inventory import Product, Stock
+
+
+def stock_totals_subquery(warehouse_id=None, product_ids=None):
+    """
+    Build a subquery with one row of stock totals per product
+
+    Columns: product_id, on_hand, available, reserved, damaged
+    """
+    query = db.session.query(
+        Stock.product_id.label('product_id'),
+        func.coalesce(func.sum(Stock.quantity), 0).label('on_hand'),
+        func.coalesce(func.sum(Stock.available_quantity), 0).label('available'),
+        func.coalesce(func.sum(Stock.reserved_quantity), 0).label('reserved'),
+        func.coalesce(func.sum(Stock.damaged_quantity), 0).label('damaged')
+    )
+
+    if warehouse_id:
+        query = query.filter(Stock.warehouse_id == warehouse_id)
+    if product_ids is not None:
+        query = query.filter(Stock.product_id.in_(product_ids))
+
+    return query.group_by(Stock.product_id).subquery()
+
+
+def get_stock_levels(product_ids=None, warehouse_id=None, tracked_only=True, low_stock_only=False):
+    """
+    Get stock levels for all active products (or a filtered set) in one query
+
+    Args:
+        product_ids: Optional list of product ids to restrict the result to
+        warehouse_id: Optional warehouse to restrict the totals to
+        tracked_only: Only include products with track_inventory enabled
+        low_stock_only: Only include products at or below their min_stock
+
+    Returns:
+        list of dicts: product, on_hand, available, reserved, damaged, value
+    """
+    totals = stock_totals_subquery(warehouse_id, product_ids)
+    on_hand = func.coalesce(totals.c.on_hand, 0)
+
+    query = db.session.query(
+        Product,
+        on_hand.label('on_hand'),
+        func.coalesce(totals.c.available, 0).label('available'),
+        func.coalesce(totals.c.reserved, 0).label('reserved'),
+        func.coalesce(totals.c.damaged, 0).label('damaged'),
+        (on_hand * func.coalesce(Product.cost_price, 0)).label('value')
+    ).outerjoin(
+        totals, totals.c.product_id == Product.id
+    ).options(
+        joinedload(Product.category),
+        joinedload(Product.unit)
+    ).filter(Product.is_active == True)
+
+    if tracked_only:
+        query = query.filter(Product.track_inventory == True)
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    if low_stock_only:
+        query = query.filter(on_hand <= Product.min_stock)
+
+    return [{
+        'product': row.Product,
+        'on_hand': row.on_hand,
+        'available': row.available,
+        'reserved': row.reserved,
+        'damaged': row.damaged,
+        'value': row.value
+    } for row in query.order_by(Product.id).all()]
+
+
+def get_stock_map(product_ids, warehouse_id=None):
+    """
+    Get on-hand quantities for a set of products in one query
+
+    Args:
+        product_ids: Products to include, or None for every product with stock rows
+
+    Returns:
+        dict: product_id -> on-hand quantity (missing products are 0)
+    """
+    query = db.session.query(
+        Stock.product_id,
+        func.coalesce(func.sum(Stock.quantity), 0)
+    )
+
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return {}
+        query = query.filter(Stock.product_id.in_(product_ids))
+
+    if warehouse_id:
+        query = query.filter(Stock.warehouse_id == warehouse_id)
+
+    stock_map = dict.fromkeys(product_ids or (), 0)
+    stock_map.update(query.group_by(Stock.product_id).all())
+    return stock_map
+
+
+def get_stock_overview(warehouse_id=None):
+    """
+    Get dashboard inventory figures in a single round-trip
+
+    Returns:
+        dict: low_stock_products (count of tracked products with a min_stock
+        at or above their on-hand quantity) and inventory_value (on-hand
+        quantity valued at cost price)
+    """
+    totals = stock_totals_subquery(warehouse_id)
+    on_hand = func.coalesce(totals.c.on_hand, 0)
+
+    low_stock_products, inventory_value = db.session.query(
+        func.coalesce(func.sum(case(
+            ((Product.min_stock > 0) & (on_hand <= Product.min_stock), 1),
+            else_=0
+        )), 0),
+        func.coalesce(func.sum(on_hand * func.coalesce(Product.cost_price, 0)), 0)
+    ).select_from(Product).outerjoin(
+        totals, totals.c.product_id == Product.id
+    ).filter(
+        Product.is_active == True,
+        Product.track_inventory == True
+    ).one()
+
+    return {
+        'low_stock_products': int(low_stock_products),
+        'inventory_value': float(inventory_value)
+    }
@@ -0,0 +1,252 @@
+"""
+Stock Ledger Helper Functions
+Stock balances derived from the stock movement ledger: per-warehouse
+snapshots, replay of the movements after them, and the verification job
+that recomputes the stocks table from the ledger
+
+Every stock movement carries the signed change of quantity and
+damaged_quantity (see stock_mutation_helper), so the balance of a product in
+a warehouse is the sum of its movements. take_stock_snapshots() stores those
+sums per warehouse up to a movement id and ledger_balances() only replays
+the movements after the latest snapshot of each warehouse. The stocks table
+is the running total kept in the same transactions as the movements;
+verify_stock() compares it with the ledger in one pass and corrects drift.
+
+Snapshots leave out movements younger than SNAPSHOT_SETTLE_SECONDS, so a
+transaction that got a lower movement id but committed later is still
+replayed instead of being skipped by the snapshot. `verify_stock(full=True)`
+replays the whole ledger and does not trust the snapshots at all.
+"""
+
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func, bindparam, insert
+from app import db
+from app.models_inventory import Stock, StockMovement, StockSnapshot, StockSnapshotLine
+from app.utils.job_helper import job_handler
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SETTLE_SECONDS = 300   # Age of the newest movement a snapshot may include
+SNAPSHOTS_KEPT = 3              # Snapshots kept per warehouse
+EPSILON = 1e-6                  # Float difference still counted as equal
+DRIFTS_LOGGED = 20              # Drifted rows written to the log per verification
+
+# Balance of a product in a warehouse
+LedgerBalance = namedtuple('LedgerBalance', ['quantity', 'damaged_quantity'])
+EMPTY_BALANCE = LedgerBalance(0.0, 0.0)
+
+
+def latest_snapshots_subquery(up_to=None):
+    """
+    Subquery: the latest snapshot of each warehouse (id, warehouse_id,
+    last_movement_id), only among snapshots up to movement id up_to if given
+    """
+    latest = db.session.query(func.max(StockSnapshot.id).label('id'))
+    if up_to is not None:
+        latest = latest.filter(StockSnapshot.last_movement_id <= up_to)
+    latest = latest.group_by(StockSnapshot.warehouse_id).subquery()
+
+    return db.session.query(
+        StockSnapshot.id, StockSnapshot.warehouse_id, StockSnapshot.last_movement_id
+    ).join(latest, latest.c.id == StockSnapshot.id).subquery('latest_snapshots')
+
+
+def ledger_balances(warehouse_id=None, up_to=None, full=False):
+    """
+    Stock balances from the ledger
+
+    Args:
+        warehouse_id: Restrict to one warehouse
+        up_to: Last movement id included (None for all movements)
+        full: Replay all movements instead of starting from the snapshots
+
+    Returns:
+        dict: (product_id, warehouse_id) -> LedgerBalance
+    """
+    balances = {}
+
+    def add(product_id, row_warehouse_id, quantity, damaged_quantity):
+        key = (product_id, row_warehouse_id)
+        balance = balances.get(key, EMPTY_BALANCE)
+        balances[key] = LedgerBalance(balance.quantity + (quantity or 0.0),
+                                      balance.damaged_quantity + (damaged_quantity or 0.0))
+
+    movements = db.session.query(
+        StockMovement.product_id, StockMovement.warehouse_id,
+        func.sum(StockMovement.quantity), func.sum(StockMovement.damaged_quantity)
+    )
+    if warehouse_id:
+        movements = movements.filter(StockMovement.warehouse_id == warehouse_id)
+    if up_to is not None:
+        movements = movements.filter(StockMovement.id <= up_to)
+
+    if not full:
+        latest = latest_snapshots_subquery(up_to)
+        lines = db.session.query(
+            StockSnapshotLine.product_id, latest.c.warehouse_id,
+            StockSnapshotLine.quantity, StockSnapshotLine.damaged_quantity
+        ).join(latest, latest.c.id == StockSnapshotLine.snapshot_id)
+        if warehouse_id:
+            lines = lines.filter(latest.c.warehouse_id == warehouse_id)
+        for row in lines:
+            add(*row)
+
+        movements = movements.outerjoin(latest, latest.c.warehouse_id == StockMovement.warehouse_id).filter(
+            StockMovement.id > func.coalesce(latest.c.last_movement_id, 0)
+        )
+
+    for row in movements.group_by(StockMovement.product_id, StockMovement.warehouse_id):
+        add(*row)
+    return balances
+
+
+def take_stock_snapshots():
+    """
+    Snapshot the balances of every warehouse that has movements after its
+    latest snapshot, up to the newest settled movement. Runs in the
+    caller's transaction.
+
+    Returns:
+        int: Number of snapshots written
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=SNAPSHOT_SETTLE_SECONDS)
+    up_to = db.session.query(func.max(StockMovement.id)).filter(StockMovement.created_at <= cutoff).scalar()
+    if up_to is None:
+        return 0
+
+    latest = latest_snapshots_subquery()
+    warehouse_ids = [warehouse_id for (warehouse_id,) in db.session.query(StockMovement.warehouse_id).outerjoin(
+        latest, latest.c.warehouse_id == StockMovement.warehouse_id
+    ).filter(
+        StockMovement.id > func.coalesce(latest.c.last_movement_id, 0),
+        StockMovement.id <= up_to
+    ).group_by(StockMovement.warehouse_id)]
+    if not warehouse_ids:
+        return 0
+
+    balances = ledger_balances(up_to=up_to)
+    now = datetime.utcnow()
+    for warehouse_id in warehouse_ids:
+        snapshot = StockSnapshot(warehouse_id=warehouse_id, last_movement_id=up_to, created_at=now)
+        db.session.add(snapshot)
+        db.session.flush()
+
+        lines = [{'snapshot_id': snapshot.id, 'product_id': product_id,
+                  'quantity': balance.quantity, 'damaged_quantity': balance.damaged_quantity}
+                 for (product_id, line_warehouse_id), balance in balances.items()
+                 if line_warehouse_id == warehouse_id
+                 and (abs(balance.quantity) > EPSILON or abs(balance.damaged_quantity) > EPSILON)]
+        if lines:
+            db.session.execute(insert(StockSnapshotLine), lines)
+        _prune_snapshots(warehouse_id)
+    return len(warehouse_ids)
+
+
+def verify_stock(fix=True, full=False):
+    """
+    Compare the stocks table with the ledger in one pass and, with fix,
+    overwrite drifted rows with the ledger balances. Runs in the caller's
+    transaction.
+
+    Stock rows are read before the ledger and corrected with a version
+    check, so a row changed in between is left alone (counted as a
+    conflict) instead of being overwritten with an older balance.
+
+    Returns:
+        dict: checked, drifted, fixed and conflicts counts
+    """
+    stocks = db.session.query(
+        Stock.id, Stock.product_id, Stock.warehouse_id, Stock.quantity, Stock.damaged_quantity,
+        Stock.reserved_quantity, Stock.available_quantity, Stock.version
+    ).all()
+    balances = ledger_balances(full=full)
+
+    now = datetime.utcnow()
+    updates, inserts = [], []
+    for row in stocks:
+        balance = balances.pop((row.product_id, row.warehouse_id), EMPTY_BALANCE)
+        available = balance.quantity - (row.reserved_quantity or 0.0)
+        if _differs((row.quantity, balance.quantity), (row.damaged_quantity, balance.damaged_quantity),
+                    (row.available_quantity, available)):
+            _log_drift(len(updates), row.product_id, row.warehouse_id, row.quantity, row.damaged_quantity, balance)
+            updates.append({'b_id': row.id, 'b_version': row.version, 'b_quantity': balance.quantity,
+                            'b_damaged': balance.damaged_quantity, 'b_available': available, 'b_now': now})
+
+    # Ledger balances without a stock row
+    for (product_id, warehouse_id), balance in balances.items():
+        if _differs((0.0, balance.quantity), (0.0, balance.damaged_quantity)):
+            _log_drift(len(updates) + len(inserts), product_id, warehouse_id, None, None, balance)
+            inserts.append({
+                'product_id': product_id, 'warehouse_id': warehouse_id, 'quantity': balance.quantity,
+                'available_quantity': balance.quantity, 'reserved_quantity': 0.0,
+                'damaged_quantity': balance.damaged_quantity, 'version': 1, 'last_updated': now
+            })
+
+    result = {'checked': len(stocks), 'drifted': len(updates) + len(inserts), 'fixed': 0, 'conflicts': 0}
+    if fix:
+        fixed = _overwrite_stock_rows(updates)
+        if inserts:
+            db.session.execute(insert(Stock), inserts)
+        result['fixed'] = fixed + len(inserts)
+        result['conflicts'] = len(updates) - fixed
+    return result
+
+
+@job_handler('inventory.verify_stock')
+def verify_stock_job(job):
+    result = verify_stock(fix=job.payload.get('fix', True), full=job.payload.get('full', False))
+    result['snapshots'] = take_stock_snapshots()
+    return result
+
+
+@job_handler('inventory.snapshot_stock')
+def snapshot_stock_job(job):
+    return {'snapshots': take_stock_snapshots()}
+
+
+def delete_product_snapshot_lines(product_id):
+    """Remove a product from the snapshots (before the product is deleted)"""
+    db.session.query(StockSnapshotLine).filter(StockSnapshotLine.product_id == product_id).delete(
+        synchronize_session=False)
+
+
+def _overwrite_stock_rows(updates):
+    """Set the rows to the ledger balances if their version is unchanged; returns the rows updated"""
+    if not updates:
+        return 0
+    table = Stock.__table__
+    statement = table.update().where(
+        table.c.id == bindparam('b_id'), table.c.version == bindparam('b_version')
+    ).values(
+        quantity=bindparam('b_quantity'),
+        damaged_quantity=bindparam('b_damaged'),
+        available_quantity=bindparam('b_available'),
+        version=table.c.version + 1,
+        last_updated=bindparam('b_now')
+    )
+    if db.engine.dialect.supports_sane_multi_rowcount:
+        return db.session.execute(statement, updates).rowcount
+    return sum(db.session.execute(statement, params).rowcount for params in updates)
+
+
+def _prune_snapshots(warehouse_id):
+    old_ids = [snapshot_id for (snapshot_id,) in db.session.query(StockSnapshot.id).filter(
+        StockSnapshot.warehouse_id == warehouse_id
+    ).order_by(StockSnapshot.id.desc()).offset(SNAPSHOTS_KEPT)]
+    if old_ids:
+        db.session.query(StockSnapshotLine).filter(StockSnapshotLine.snapshot_id.in_(old_ids)).delete(
+            synchronize_session=False)
+        db.session.query(StockSnapshot).filter(StockSnapshot.id.in_(old_ids)).delete(synchronize_session=False)
+
+
+def _differs(*pairs):
+    return any(abs((stored or 0.0) - expected) > EPSILON for stored, expected in pairs)
+
+
+def _log_drift(index, product_id, warehouse_id, quantity, damaged_quantity, balance):
+    if index < DRIFTS_LOGGED:
+        logger.warning('Stock drift of product %s in warehouse %s: stored %s/%s damaged, ledger %s/%s damaged',
+                       product_id, warehouse_id, quantity, damaged_quantity,
+                       balance.quantity, balance.damaged_quantity)
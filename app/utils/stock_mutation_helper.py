@@ -0,0 +1,215 @@
+"""
+Stock Mutation Helper Functions
+The one way routes change stock quantities: locked or version-checked
+updates of the stock rows plus their (signed) stock movements
+
+change_stock() merges the changes per (product, warehouse) and reads the
+stock rows in product/warehouse order. On databases with row locks
+(PostgreSQL) the read is a SELECT ... FOR UPDATE, so concurrent documents
+wait for each other row by row and always lock in the same order (no
+deadlocks). On SQLite every stock UPDATE is a compare-and-swap on the
+row's version column; if another transaction changed the row since it was
+read, StockConflict is raised. Routes run their unit of work through
+@stock_transaction, which commits it and, on a conflict (or a deadlock /
+locked database), rolls back and runs it again from scratch.
+"""
+
+import random
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import wraps
+from flask_babel import gettext as _
+from sqlalchemy import bindparam, func, insert, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import db
+from app.models_inventory import Product, Stock, StockMovement
+
+# Attempts of a @stock_transaction unit of work
+STOCK_TRANSACTION_ATTEMPTS = 5
+
+# One change of a stock row; quantity is signed (negative takes stock out),
+# damaged is the change of damaged_quantity. Each change writes one movement
+# with the same signed quantities (the ledger in app/utils/stock_ledger_helper.py).
+StockChange = namedtuple('StockChange', ['product_id', 'warehouse_id', 'quantity', 'movement_type', 'notes', 'damaged'],
+                         defaults=(None, None, 0.0))
+
+
+class StockConflict(Exception):
+    """A stock row changed between its read and its update (retried by @stock_transaction)"""
+
+
+class InsufficientStock(ValueError):
+    """A change would take a stock row below zero"""
+
+    def __init__(self, product_id, warehouse_id, available, requested):
+        self.product_id = product_id
+        self.warehouse_id = warehouse_id
+        self.available = available
+        self.requested = requested
+        name = db.session.query(Product.name).filter(Product.id == product_id).scalar() or product_id
+        super().__init__(_('Insufficient quantity of %(name)s available. Available: %(qty)s',
+                           name=name, qty=available))
+
+
+def change_stock(changes, reference_type=None, reference_id=None, user_id=None, notes=None,
+                 allow_negative=False):
+    """
+    Apply stock changes and write their movements, in the caller's transaction
+
+    Args:
+        changes: Iterable of StockChange (or tuples in its field order)
+        reference_type, reference_id, user_id, notes: Recorded on the
+            movements (a change's own notes win)
+        allow_negative: Let quantities go below zero (sales that already
+            happened, e.g. offline POS orders)
+
+    Returns:
+        dict: (product_id, warehouse_id) -> new quantity
+
+    Raises:
+        InsufficientStock: A row would go below zero
+        StockConflict: A row was changed concurrently (SQLite) or created
+            concurrently
+    """
+    changes = [StockChange(*change) for change in changes]
+    deltas = {}
+    for change in changes:
+        delta = deltas.setdefault((change.product_id, change.warehouse_id), [0.0, 0.0])
+        delta[0] += change.quantity
+        delta[1] += change.damaged or 0.0
+    if not deltas:
+        return {}
+
+    keys = sorted(deltas)
+    rows = _read_stock_rows(keys)
+
+    now = datetime.utcnow()
+    updates, inserts, quantities = [], [], {}
+    for key in keys:
+        quantity, damaged = deltas[key]
+        row = rows.get(key)
+        current = (row.quantity or 0.0) if row is not None else 0.0
+        if quantity < 0 and current + quantity < -1e-9 and not allow_negative:
+            raise InsufficientStock(key[0], key[1], current, -quantity)
+        quantities[key] = current + quantity
+
+        if row is None:
+            inserts.append({
+                'product_id': key[0], 'warehouse_id': key[1], 'quantity': quantity,
+                'available_quantity': quantity, 'reserved_quantity': 0.0, 'damaged_quantity': damaged,
+                'version': 1, 'last_updated': now
+            })
+        elif quantity or damaged:
+            updates.append({'b_id': row.id, 'b_version': row.version, 'b_quantity': quantity,
+                            'b_damaged': damaged, 'b_now': now})
+
+    _update_stock_rows(updates)
+    if inserts:
+        try:
+            db.session.execute(insert(Stock), inserts)
+        except IntegrityError as e:
+            raise StockConflict('Stock row created concurrently') from e
+
+    movements = [{
+        'product_id': change.product_id,
+        'warehouse_id': change.warehouse_id,
+        'movement_type': change.movement_type or ('in' if change.quantity >= 0 else 'out'),
+        'quantity': change.quantity,
+        'damaged_quantity': change.damaged or 0.0,
+        'reference_type': reference_type,
+        'reference_id': reference_id,
+        'notes': change.notes if change.notes is not None else notes,
+        'user_id': user_id,
+        'created_at': now
+    } for change in changes if change.quantity or change.damaged]
+    if movements:
+        db.session.execute(insert(StockMovement), movements)
+
+    _expire_loaded_stocks(keys)
+    return quantities
+
+
+def stock_transaction(func):
+    """
+    Run a unit of work that changes stock and commit it; on a stock
+    conflict, deadlock or locked database roll back and run it again
+    (it must redo all its work from the database state)
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, STOCK_TRANSACTION_ATTEMPTS + 1):
+            try:
+                result = func(*args, **kwargs)
+                db.session.commit()
+                return result
+            except (StockConflict, OperationalError) as e:
+                db.session.rollback()
+                if attempt == STOCK_TRANSACTION_ATTEMPTS or not _is_retryable(e):
+                    raise
+                time.sleep(random.uniform(0, 0.05 * attempt))
+            except Exception:
+                db.session.rollback()
+                raise
+    return wrapper
+
+
+def _read_stock_rows(keys):
+    """Stock rows of the keys, locked in key order where the database supports it"""
+    product_ids = sorted({key[0] for key in keys})
+    warehouse_ids = sorted({key[1] for key in keys})
+    query = select(Stock.id, Stock.product_id, Stock.warehouse_id, Stock.quantity, Stock.version).where(
+        Stock.product_id.in_(product_ids), Stock.warehouse_id.in_(warehouse_ids)
+    ).order_by(Stock.product_id, Stock.warehouse_id)
+    if _uses_row_locks():
+        query = query.with_for_update()
+
+    wanted = set(keys)
+    return {(row.product_id, row.warehouse_id): row for row in db.session.execute(query)
+            if (row.product_id, row.warehouse_id) in wanted}
+
+
+def _update_stock_rows(updates):
+    """Add the deltas to the rows; each UPDATE only applies if the version is unchanged"""
+    if not updates:
+        return
+    table = Stock.__table__
+    statement = table.update().where(
+        table.c.id == bindparam('b_id'), table.c.version == bindparam('b_version')
+    ).values(
+        quantity=func.coalesce(table.c.quantity, 0) + bindparam('b_quantity'),
+        available_quantity=(func.coalesce(table.c.quantity, 0) + bindparam('b_quantity')
+                            - func.coalesce(table.c.reserved_quantity, 0)),
+        damaged_quantity=func.coalesce(table.c.damaged_quantity, 0) + bindparam('b_damaged'),
+        version=table.c.version + 1,
+        last_updated=bindparam('b_now')
+    )
+
+    if db.engine.dialect.supports_sane_multi_rowcount:
+        if db.session.execute(statement, updates).rowcount != len(updates):
+            raise StockConflict('Stock changed concurrently')
+    else:
+        for params in updates:
+            if db.session.execute(statement, params).rowcount != 1:
+                raise StockConflict('Stock changed concurrently')
+
+
+def _expire_loaded_stocks(keys):
+    """Stock objects already in the session must reload the updated values"""
+    keys = set(keys)
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, Stock) and (instance.product_id, instance.warehouse_id) in keys:
+            db.session.expire(instance)
+
+
+def _uses_row_locks():
+    return db.engine.dialect.name != 'sqlite'
+
+
+def _is_retryable(error):
+    if isinstance(error, StockConflict):
+        return True
+    code = getattr(error.orig, 'pgcode', None)
+    if code in ('40001', '40P01'):   # Serialization failure, deadlock
+        return True
+    return 'database is locked' in str(error.orig)
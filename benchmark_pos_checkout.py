@@ -0,0 +1,92 @@
+"""
+Benchmark the POS checkout pipeline
+قياس أداء عملية الدفع في نقطة البيع
+
+Runs repeated checkouts of a large cart against an in-memory database and
+fails (exit code 1) when the p99 latency exceeds POS_CHECKOUT_P99_TARGET_MS.
+
+Usage: python benchmark_pos_checkout.py [iterations] [cart_lines]
+"""
+import sys
+import os
+import time
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask_login import login_user
+from app import create_app, db
+from app.models import User, Warehouse, Product, Stock, POSSession
+from app.pos.routes import _checkout
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CART_LINES = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+CATALOGUE_SIZE = 5000
+
+app = create_app('testing')
+app.config['SQLALCHEMY_ECHO'] = False
+target_ms = app.config['POS_CHECKOUT_P99_TARGET_MS']
+
+with app.app_context():
+    db.create_all()
+
+    cashier = User(username='bench', email='bench@example.com', is_admin=True)
+    cashier.set_password('bench')
+    warehouse = Warehouse(name='Bench', code='BENCH')
+    db.session.add_all([cashier, warehouse])
+    db.session.flush()
+
+    db.session.add_all([
+        Product(name=f'Product {i}', code=f'BENCH-{i:05d}', selling_price=10.0, cost_price=6.0)
+        for i in range(CATALOGUE_SIZE)
+    ])
+    db.session.flush()
+    product_ids = [p.id for p in Product.query.order_by(Product.id).all()]
+    db.session.add_all([
+        Stock(product_id=product_id, warehouse_id=warehouse.id, quantity=1e9, available_quantity=1e9)
+        for product_id in product_ids
+    ])
+
+    pos_session = POSSession(session_number='BENCH001', cashier_id=cashier.id,
+                             warehouse_id=warehouse.id, status='open')
+    db.session.add(pos_session)
+    db.session.commit()
+
+    timings = []
+    for n in range(ITERATIONS):
+        offset = (n * CART_LINES) % (CATALOGUE_SIZE - CART_LINES)
+        items = [{'productId': product_id, 'quantity': 1, 'price': 10.0}
+                 for product_id in product_ids[offset:offset + CART_LINES]]
+        data = {
+            'session_id': pos_session.id,
+            'subtotal': 10.0 * CART_LINES,
+            'discount_amount': 0,
+            'tax_amount': 1.5 * CART_LINES,
+            'total_amount': 11.5 * CART_LINES,
+            'payment_method': 'cash',
+            'cash_amount': 11.5 * CART_LINES,
+            'card_amount': 0,
+            'items': items
+        }
+
+        with app.test_request_context():
+            login_user(db.session.get(User, cashier.id))
+            session_row = db.session.get(POSSession, pos_session.id)
+            started = time.perf_counter()
+            _checkout(data, session_row)
+            db.session.commit()
+            timings.append((time.perf_counter() - started) * 1000)
+
+timings.sort()
+p50 = timings[len(timings) // 2]
+p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+print("=" * 80)
+print(f"POS checkout: {ITERATIONS} orders x {CART_LINES} lines")
+print(f"p50: {p50:.1f} ms   p99: {p99:.1f} ms   target p99: {target_ms} ms")
+print("=" * 80)
+
+if p99 > target_ms:
+    print("❌ p99 latency above target")
+    sys.exit(1)
+print("✅ p99 latency within target")
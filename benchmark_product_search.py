@@ -0,0 +1,90 @@
+"""
+Benchmark the product search index
+قياس أداء البحث عن المنتجات
+
+Builds the in-process search index over a large catalogue in an in-memory
+database and fails (exit code 1) when the p99 typeahead latency exceeds
+PRODUCT_SEARCH_P99_TARGET_MS.
+
+Usage: python benchmark_product_search.py [catalogue_size] [queries]
+"""
+import sys
+import os
+import time
+import random
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import insert
+from app import create_app, db
+from app.models import Product
+from app.utils.search_helper import get_product_index, search_products, lookup_product
+
+CATALOGUE_SIZE = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+QUERIES = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+ARABIC_WORDS = ['بلاط', 'سيراميك', 'رخام', 'بورسلان', 'أرضيات', 'جدران', 'حمام', 'مطبخ', 'لامع', 'مطفي']
+ENGLISH_WORDS = ['tile', 'ceramic', 'marble', 'porcelain', 'floor', 'wall', 'bath', 'kitchen', 'glossy', 'matte']
+
+app = create_app('testing')
+app.config['SQLALCHEMY_ECHO'] = False
+target_ms = app.config['PRODUCT_SEARCH_P99_TARGET_MS']
+random.seed(42)
+
+with app.app_context():
+    db.create_all()
+
+    rows = []
+    for i in range(CATALOGUE_SIZE):
+        words = random.sample(range(len(ARABIC_WORDS)), 3)
+        rows.append({
+            'name': ' '.join(ARABIC_WORDS[w] for w in words) + f' {i}',
+            'name_en': ' '.join(ENGLISH_WORDS[w] for w in words) + f' {i}',
+            'code': f'SKU-{i:06d}',
+            'barcode': f'628{i:010d}',
+            'selling_price': 10.0,
+            'cost_price': 6.0
+        })
+    db.session.execute(insert(Product), rows)
+    db.session.commit()
+
+    started = time.perf_counter()
+    index = get_product_index()
+    build_ms = (time.perf_counter() - started) * 1000
+
+    queries = []
+    for _ in range(QUERIES):
+        i = random.randrange(CATALOGUE_SIZE)
+        queries.append(random.choice([
+            f'SKU-{i:06d}',                               # exact code
+            f'628{i:010d}',                               # exact barcode
+            random.choice(ENGLISH_WORDS)[:random.randint(2, 5)],   # English prefix
+            random.choice(ARABIC_WORDS)[:random.randint(2, 4)],    # Arabic prefix
+            'سيراميك لامع',                                # Arabic phrase
+            'amic',                                       # substring
+        ]))
+
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        search_products(query, limit=10, scope='sales')
+        timings.append((time.perf_counter() - started) * 1000)
+
+    assert lookup_product('SKU-000042').code == 'SKU-000042'
+    assert search_products('أرضيات', limit=1) == search_products('ارضيات', limit=1)
+
+timings.sort()
+p50 = timings[len(timings) // 2]
+p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+print("=" * 80)
+print(f"Product search: {CATALOGUE_SIZE} products, {len(index)} indexed, {QUERIES} queries")
+print(f"index build: {build_ms:.0f} ms")
+print(f"p50: {p50:.2f} ms   p99: {p99:.2f} ms   target p99: {target_ms} ms")
+print("=" * 80)
+
+if p99 > target_ms:
+    print("❌ p99 latency above target")
+    sys.exit(1)
+print("✅ p99 latency within target")
@@ -32,18 +32,27 @@ class Config:
     }
 
     # Session Security
-    SESSION_TYPE = 'filesystem'  # Use filesystem for session storage
+    SESSION_TYPE = 'database'  # Server-side sessions in the database (see app/utils/session_helper.py); other values use Flask-Session
+    SESSION_DATABASE_URI = os.environ.get('SESSION_DATABASE_URL')  # Separate session database (default: the application database)
+    SESSION_TOUCH_SECONDS = 300  # An unchanged session is written back (expiry extended) at most this often
+    SESSION_SWEEP_SECONDS = 900  # Expired sessions are deleted this often by each process (0: only `flask sweep-sessions`)
     PERMANENT_SESSION_LIFETIME = timedelta(hours=2)  # Session expires after 2 hours
     SESSION_COOKIE_SECURE = os.environ.get('SESSION_COOKIE_SECURE', 'False') == 'True'
     SESSION_COOKIE_HTTPONLY = True  # Prevent JavaScript access to cookies
     SESSION_COOKIE_SAMESITE = 'Lax'  # CSRF protection
-    SESSION_REFRESH_EACH_REQUEST = True  # Refresh session on each request
+    SESSION_REFRESH_EACH_REQUEST = True  # Refresh session on each request (database sessions: every SESSION_TOUCH_SECONDS)
 
     # Security
     WTF_CSRF_ENABLED = True  # Enable CSRF protection
     WTF_CSRF_TIME_LIMIT = None  # No time limit for CSRF tokens
     MAX_LOGIN_ATTEMPTS = 5  # Maximum failed login attempts before account lock
     ACCOUNT_LOCK_DURATION = 30  # Account lock duration in minutes
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'memory': per process; 'sqlite': shared by the workers of a host (see app/utils/rate_limit_helper.py)
+    RATE_LIMIT_SQLITE_PATH = os.environ.get('RATE_LIMIT_SQLITE_PATH') or os.path.join(basedir, 'rate_limits.db')
+    RATE_LIMIT_MAX_KEYS = 10000  # Least recently used keys are evicted beyond this (fixed memory)
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))  # Reverse proxies in front of the app (X-Forwarded-For hops trusted by ProxyFix)
+    LOGIN_RATE_LIMIT = 10  # Login attempts allowed per IP address per LOGIN_RATE_LIMIT_WINDOW
+    LOGIN_RATE_LIMIT_WINDOW = 60  # Seconds
     SESSION_TIMEOUT_WARNING = 5  # Show warning 5 minutes before session expires
     PASSWORD_MIN_LENGTH = 8  # Minimum password length
     PASSWORD_REQUIRE_UPPERCASE = True  # Require uppercase letter
@@ -57,6 +66,39 @@ class Config:
     
     # Pagination
     ITEMS_PER_PAGE = 20
+
+    # Document numbering (see app/utils/sequence_helper.py)
+    DOCUMENT_SEQUENCE_BLOCK_SIZE = 1  # Numbers reserved per round-trip on server databases
+    POS_ORDER_SEQUENCE_BLOCK_SIZE = 20  # POS order numbers are pre-allocated per worker
+    POS_CHECKOUT_P99_TARGET_MS = 150  # Checked by benchmark_pos_checkout.py (40-line cart)
+    POS_SYNC_MAX_BATCH = 200  # Orders accepted per /pos/sync-orders request
+    POS_OFFLINE_GRACE_SECONDS = 120  # Queued orders rung up at least this long before reaching the server count as offline sales (stock may go negative)
+
+    # Product search index (see app/utils/search_helper.py)
+    PRODUCT_SEARCH_REFRESH_SECONDS = 10  # Seconds between checks for changes made by other workers
+    PRODUCT_SEARCH_BUILD_INLINE = False  # Build the search index inside the first search instead of a background thread (tests)
+    PRODUCT_SEARCH_P99_TARGET_MS = 10  # Typeahead budget, see benchmark_product_search.py
+
+    # Keyset pagination (see app/utils/pagination_helper.py)
+    KEYSET_COUNT_LIMIT = 10000  # List views count rows up to this limit and show "10000+" beyond it
+
+    # Background jobs (see app/utils/job_helper.py)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '1'))  # Worker threads per process (0: only `flask run-jobs`)
+    JOB_POLL_SECONDS = 5  # Idle workers look for due jobs this often
+    JOB_MAX_ATTEMPTS = 3  # Runs before a failing job is marked failed
+    JOB_RETRY_DELAY = 30  # Seconds before the first retry, doubled on each further one
+    JOB_STALE_SECONDS = 600  # A running job without heartbeat for this long is claimed again
+    JOB_RUN_INLINE = False  # Run jobs inside enqueue_job (tests)
+
+    # SQL instrumentation (see app/utils/query_stats_helper.py)
+    SQL_INSTRUMENTATION = True  # Count and time statements per request
+    SQL_N_PLUS_ONE_THRESHOLD = 10  # Executions of one statement in a request that are logged as a possible N+1
+    SQL_SLOW_QUERY_MS = 200  # Statements at least this slow are written to the slow query log
+    SQL_SLOW_QUERY_LOG = os.path.join(basedir, 'logs', 'slow_queries.log')
+    SQL_SLOW_QUERY_LOG_BYTES = 5 * 1024 * 1024  # Rotated at this size
+    SQL_SLOW_QUERY_LOG_BACKUPS = 5
+    SQL_QUERY_BUDGET = 100  # Queries per request; views can set their own with @query_budget(n)
+    SQL_QUERY_BUDGET_ASSERT = False  # Fail requests over budget (tests) instead of logging them
     
     # Currency
     DEFAULT_CURRENCY = 'EUR'
@@ -88,12 +130,19 @@ class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
     SESSION_COOKIE_SECURE = True
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'sqlite')  # Counts hold with any number of gunicorn workers
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 1))  # Render/Railway load balancer
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    JOB_RUN_INLINE = True
+    PRODUCT_SEARCH_BUILD_INLINE = True
+    SQL_SLOW_QUERY_LOG = None
+    SQL_QUERY_BUDGET_ASSERT = True
+    SESSION_SWEEP_SECONDS = 0
 
 config = {
     'development': DevelopmentConfig,
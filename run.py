@@ -1,5 +1,6 @@
 import os
 import sys
+import click
 
 # Use production config on Render, development otherwise
 config_name = os.getenv('FLASK_ENV', 'development')
@@ -204,6 +205,20 @@ def init_database():
                 print('✅ Default data initialized successfully!')
             else:
                 print('ℹ️ Database already contains data, skipping initialization')
+
+            # Backfill the daily sales/purchase rollup once after upgrading
+            from app.utils.rollup_helper import rollup_needs_backfill, rebuild_rollups
+            if rollup_needs_backfill():
+                rows = rebuild_rollups()
+                db.session.commit()
+                print(f'✅ Daily rollup rebuilt ({rows} rows)')
+
+            # Backfill the monthly account balance snapshots once after upgrading
+            from app.utils.balance_helper import account_balances_need_backfill, rebuild_account_balances
+            if account_balances_need_backfill():
+                rows = rebuild_account_balances()
+                db.session.commit()
+                print(f'✅ Account balances rebuilt ({rows} rows)')
         except Exception as e:
             print(f"❌ Database initialization error: {e}")
             import traceback
@@ -325,6 +340,112 @@ def init_db():
     db.session.commit()
     print('Database initialized successfully!')
 
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the daily sales/purchase rollup from posted invoices"""
+    from app.utils.rollup_helper import rebuild_rollups
+    rows = rebuild_rollups()
+    db.session.commit()
+    print(f'Daily rollup rebuilt ({rows} rows)')
+
+@app.cli.command('rebuild-account-balances')
+def rebuild_account_balances_command():
+    """Recompute the monthly account balance snapshots and account totals from posted entries"""
+    from app.utils.balance_helper import rebuild_account_balances
+    rows = rebuild_account_balances()
+    db.session.commit()
+    print(f'Account balances rebuilt ({rows} rows)')
+
+@app.cli.command('verify-stock')
+@click.option('--dry-run', is_flag=True, help='Only report drifted stock rows')
+@click.option('--full', is_flag=True, help='Replay the whole movement ledger instead of starting from the snapshots')
+def verify_stock_command(dry_run, full):
+    """Recompute stock quantities from the stock movements and correct drifted rows"""
+    from app.utils.stock_ledger_helper import verify_stock
+    result = verify_stock(fix=not dry_run, full=full)
+    db.session.commit()
+    print(f"{result['checked']} stock rows checked, {result['drifted']} drifted, "
+          f"{result['fixed']} fixed, {result['conflicts']} changed meanwhile")
+
+@app.cli.command('snapshot-stock')
+def snapshot_stock_command():
+    """Snapshot the stock balances of each warehouse (run periodically, e.g. nightly from cron)"""
+    from app.utils.stock_ledger_helper import take_stock_snapshots
+    count = take_stock_snapshots()
+    db.session.commit()
+    print(f'{count} warehouse snapshots written')
+
+@app.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print the plan of every query')
+def check_query_plans_command(verbose):
+    """EXPLAIN the hot report/dashboard queries and fail if one fully scans a table"""
+    from app.utils.query_plan_helper import check_query_plans
+    checks = check_query_plans()
+    for check in checks:
+        print(f"{'ok  ' if check.ok else 'FAIL'} {check.name}" +
+              (f" (full scan of {', '.join(check.full_scans)})" if check.full_scans else ''))
+        if verbose or not check.ok:
+            for line in check.plan:
+                print(f'       {line}')
+    failed = sum(1 for check in checks if not check.ok)
+    if failed:
+        raise SystemExit(f'{failed} of {len(checks)} hot queries fall back to a full scan')
+    print(f'All {len(checks)} hot queries use an index')
+
+@app.cli.command('sweep-sessions')
+def sweep_sessions_command():
+    """Delete expired server-side sessions"""
+    from app.utils.session_helper import sweep_expired_sessions
+    engine = getattr(app.session_interface, 'engine', None)
+    print(f'{sweep_expired_sessions(engine)} expired sessions deleted')
+
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--warehouse', 'warehouse_code', help='Warehouse code of the opening quantities')
+@click.option('--no-update', is_flag=True, help='Report existing product codes as errors instead of updating them')
+def import_products_command(path, warehouse_code, no_update):
+    """Import products from a CSV or XLSX file"""
+    from app.utils.import_helper import get_import_format, read_import_rows, import_products
+    from flask_babel import force_locale
+
+    import_format = get_import_format(path)
+    if import_format is None:
+        raise click.UsageError('The file must be a .csv or .xlsx file')
+    warehouse_id = None
+    if warehouse_code:
+        warehouse = Warehouse.query.filter_by(code=warehouse_code).first()
+        if warehouse is None:
+            raise click.UsageError(f'Unknown warehouse: {warehouse_code}')
+        warehouse_id = warehouse.id
+
+    def progress(result):
+        print(f'{result.rows} rows: {result.created} created, {result.updated} updated, {result.error_count} errors')
+
+    with open(path, 'rb') as stream, force_locale(app.config['BABEL_DEFAULT_LOCALE']):
+        result = import_products(read_import_rows(stream, import_format), warehouse_id=warehouse_id,
+                                 update_existing=not no_update, progress=progress)
+    for row_number, message in result.errors:
+        print(f'Row {row_number}: {message}')
+    print(f'Import finished: {result.created} created, {result.updated} updated, '
+          f'{result.stock_rows} opening stock rows, {result.error_count} errors')
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run the jobs that are due and exit')
+def run_jobs_command(once):
+    """Run background jobs in this process (instead of or next to the web workers' threads)"""
+    import socket
+    import time
+    from app.utils.job_helper import run_pending_jobs
+
+    name = f'{socket.gethostname()}:{os.getpid()}:cli'
+    while True:
+        count = run_pending_jobs(name)
+        if count:
+            print(f'{count} jobs run')
+        if once:
+            break
+        time.sleep(app.config['JOB_POLL_SECONDS'])
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
 